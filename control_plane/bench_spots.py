@@ -0,0 +1,148 @@
+"""
+Benchmark for GET /spots: statements and latency per request as the spot count grows.
+
+For each size, provisions a synthetic location with that many spots (each with
+a current state) in DATABASE_URL. It then calls the endpoint in-process and
+counts the SQL statements each request issues. The endpoint must stay at a
+constant number of statements regardless of spot count. Any growth (an N+1)
+fails the run with exit code 1. Paged requests (limit=100) should also stay
+flat in latency.
+
+Example (Postgres or SQLite via DATABASE_URL):
+    python control_plane/bench_spots.py --sizes 100,1000,3000,10000 --repeats 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.db import SessionLocal, engine, read_engine
+from database.models import Camera, DesiredState, Location, Spot, SpotCurrentState
+from control_plane.main import app
+
+
+class StatementCounter:
+    """Counts statements sent on the engines the control plane reads from."""
+
+    def __init__(self, engines):
+        self.lock = threading.Lock()
+        self.count = 0
+        for bind in engines:
+            event.listen(bind, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self.lock:
+            self.count += 1
+
+    def take(self) -> int:
+        with self.lock:
+            count, self.count = self.count, 0
+            return count
+
+
+def provision(n_spots: int) -> uuid.UUID:
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        location = Location(name=f"bench-spots-{n_spots}")
+        db.add(location)
+        db.flush()
+        camera = Camera(name=f"bench-spots-{n_spots}", location_id=location.id, stream_url="bench://synthetic",
+                        desired_state=DesiredState.STOPPED)
+        db.add(camera)
+        db.flush()
+        spot_ids = [f"{location.id}:B{i:05d}" for i in range(n_spots)]
+        db.execute(Spot.__table__.insert(), [
+            {"id": s, "location_id": location.id, "name": s.split(":")[1]} for s in spot_ids
+        ])
+        db.execute(SpotCurrentState.__table__.insert(), [
+            {"spot_id": s, "camera_id": camera.id, "occupied": i % 3 == 0, "since": now, "last_seen": now}
+            for i, s in enumerate(spot_ids)
+        ])
+        db.commit()
+        return location.id
+    finally:
+        db.close()
+
+
+def cleanup(location_id: uuid.UUID):
+    db = SessionLocal()
+    try:
+        spot_ids = db.query(Spot.id).filter(Spot.location_id == location_id)
+        db.query(SpotCurrentState).filter(SpotCurrentState.spot_id.in_(spot_ids)).delete(synchronize_session=False)
+        db.query(Spot).filter(Spot.location_id == location_id).delete(synchronize_session=False)
+        db.query(Camera).filter(Camera.location_id == location_id).delete(synchronize_session=False)
+        db.query(Location).filter(Location.id == location_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def measure(client: TestClient, counter: StatementCounter, params: Dict[str, str], repeats: int, expected: int) -> Dict[str, float]:
+    client.get("/spots", params=params)  # Warm up connections and caches
+    counter.take()
+    latencies: List[float] = []
+    statements: List[int] = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        response = client.get("/spots", params=params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statements.append(counter.take())
+        if response.status_code != 200 or len(response.json()) != expected:
+            sys.exit(f"Unexpected response for {params}: {response.status_code}")
+    latencies.sort()
+    return {
+        "statements": max(statements),
+        "median_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that GET /spots stays flat as the spot count grows")
+    parser.add_argument("--sizes", default="100,1000,3000", help="Comma-separated spot counts")
+    parser.add_argument("--repeats", type=int, default=10, help="Requests per size")
+    parser.add_argument("--page", type=int, default=100, help="Page size for the paged request")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    counter = StatementCounter([engine] + ([read_engine] if read_engine is not None else []))
+    client = TestClient(app)
+    print(f"Benchmarking GET /spots against {engine.url.render_as_string(hide_password=True)}")
+
+    rows = []
+    for n in sizes:
+        location_id = provision(n)
+        try:
+            full = measure(client, counter, {"location_id": str(location_id)}, args.repeats, n)
+            paged = measure(client, counter, {"location_id": str(location_id), "limit": str(args.page)},
+                            args.repeats, min(n, args.page))
+        finally:
+            cleanup(location_id)
+        rows.append((n, full, paged))
+
+    print(f"\n{'spots':>7} {'stmts':>6} {'median ms':>10} {'p95 ms':>8} {'us/spot':>8} {'page stmts':>11} {'page ms':>8}")
+    for n, full, paged in rows:
+        print(f"{n:>7} {full['statements']:>6} {full['median_ms']:>10.2f} {full['p95_ms']:>8.2f} "
+              f"{full['median_ms'] * 1000 / n:>8.1f} {paged['statements']:>11} {paged['median_ms']:>8.2f}")
+
+    statement_counts = {full["statements"] for _, full, _ in rows} | {paged["statements"] for _, _, paged in rows}
+    if len(statement_counts) > 1:
+        print(f"\nFAIL: statements per request vary with spot count ({sorted(statement_counts)})")
+        sys.exit(1)
+    print(f"\nOK: {statement_counts.pop()} statement(s) per request at every size")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Persistent per-stream frame grabbers for the snapshot endpoints.
+
+Opening an RTSP/HTTP stream costs a full handshake plus a wait for the next
+keyframe. Instead of opening a `cv2.VideoCapture` per request, each stream URL
+gets a background reader thread that keeps the capture open and holds the
+latest decoded frame. Requests return that frame when it is younger than
+FRAME_MAX_AGE_SEC, or wait briefly for the next one.
+
+- Streams not requested for FRAME_IDLE_EVICT_SEC are closed by a reaper thread.
+- At most FRAME_MAX_STREAMS streams stay open. Opening another closes the
+  least recently used one.
+- At most FRAME_MAX_CONCURRENT_OPENS handshakes run at once, so a page
+  requesting every camera cannot stampede the cameras or the network.
+- Handshakes and reads time out (FRAME_OPEN_TIMEOUT_SEC, FRAME_READ_TIMEOUT_SEC),
+  so a closed stream's thread exits and releases its capture even if the
+  camera stalls. Requests waiting on a closed stream fail at once.
+- After consecutive failures a stream backs off exponentially (from
+  FRAME_RECONNECT_SEC up to FRAME_RECONNECT_MAX_SEC), and it only retries
+  once a request has asked for it since the last failure, so offline cameras
+  do not hold the open slots.
+- `grab_once` serves one-off URLs (e.g. from the camera setup wizard) without
+  keeping a stream open.
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+# Configuration from Environment
+FRAME_MAX_AGE_SEC = float(os.getenv("FRAME_MAX_AGE_SEC", "2"))
+FRAME_WAIT_TIMEOUT_SEC = float(os.getenv("FRAME_WAIT_TIMEOUT_SEC", "15"))
+FRAME_IDLE_EVICT_SEC = float(os.getenv("FRAME_IDLE_EVICT_SEC", "90"))  # Outlasts the monitor page's 60 s refresh
+FRAME_MAX_STREAMS = int(os.getenv("FRAME_MAX_STREAMS", "32"))
+FRAME_MAX_CONCURRENT_OPENS = int(os.getenv("FRAME_MAX_CONCURRENT_OPENS", "4"))
+FRAME_RECONNECT_SEC = float(os.getenv("FRAME_RECONNECT_SEC", "2"))
+FRAME_RECONNECT_MAX_SEC = float(os.getenv("FRAME_RECONNECT_MAX_SEC", "60"))
+# Bound blocking handshakes and reads, so a stopped stream's thread exits even if the camera stalls
+FRAME_OPEN_TIMEOUT_SEC = float(os.getenv("FRAME_OPEN_TIMEOUT_SEC", "10"))
+FRAME_READ_TIMEOUT_SEC = float(os.getenv("FRAME_READ_TIMEOUT_SEC", "5"))
+
+
+class FrameUnavailable(Exception):
+    """No frame could be read from the stream (`timed_out` when none arrived in time)."""
+
+    def __init__(self, message: str, timed_out: bool = False):
+        super().__init__(message)
+        self.timed_out = timed_out
+
+
+class Frame(NamedTuple):
+    """A decoded frame shared between requests. `image` is read-only; copy it before drawing on it."""
+    image: np.ndarray
+    seq: int  # Unique per decoded frame across all streams
+    captured_at: datetime
+
+
+_frame_seq = itertools.count(1)
+
+
+def _open_capture(url: str) -> cv2.VideoCapture:
+    return cv2.VideoCapture(url, cv2.CAP_ANY, [
+        cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(FRAME_OPEN_TIMEOUT_SEC * 1000),
+        cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(FRAME_READ_TIMEOUT_SEC * 1000),
+    ])
+
+
+class _Stream:
+    """One open capture and the latest frame read from it."""
+
+    def __init__(self, url: str, open_slots: threading.BoundedSemaphore, stats: Dict[str, int], stats_lock: threading.Lock):
+        self.url = url
+        self.open_slots = open_slots
+        self.stats = stats
+        self.stats_lock = stats_lock
+        self.cond = threading.Condition()
+        self.frame: Optional[Frame] = None
+        self.frame_at = 0.0  # monotonic time of the latest frame
+        self.error: Optional[str] = None
+        self.failed_at = 0.0
+        self.retry_at = 0.0  # monotonic time of the next open attempt after a failure
+        self.last_used = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self.thread.start()
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _fail(self, message: str):
+        with self.cond:
+            self.error, self.failed_at = message, time.monotonic()
+            self.cond.notify_all()
+
+    def _open(self) -> Optional[cv2.VideoCapture]:
+        with self.open_slots:
+            if not self.running:
+                return None
+            self._count("opens")
+            cap = _open_capture(self.url)
+        if not cap.isOpened():
+            cap.release()
+            self._count("open_failures")
+            self._fail("Could not open stream")
+            return None
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _wait_to_retry(self, failures: int):
+        """Back off after `failures` consecutive failures, then wait for a request newer than the last failure."""
+        delay = min(FRAME_RECONNECT_SEC * 2 ** (failures - 1), FRAME_RECONNECT_MAX_SEC)
+        with self.cond:
+            self.retry_at = time.monotonic() + delay
+            while self.running:
+                now = time.monotonic()
+                if now < self.retry_at:
+                    self.cond.wait(self.retry_at - now)
+                elif self.last_used <= self.failed_at:
+                    self.cond.wait()  # Woken by the next request or by stop()
+                else:
+                    return
+
+    def _run(self):
+        cap = None
+        failures = 0
+        while self.running:
+            if cap is None:
+                cap = self._open()
+                if cap is None:
+                    failures += 1
+                    self._wait_to_retry(failures)
+                    continue
+            ret, frame = cap.read()
+            if not ret:
+                cap.release()
+                cap = None
+                self._count("read_failures")
+                self._fail("Failed to read frame from stream")
+                failures += 1
+                self._wait_to_retry(failures)
+                continue
+            failures = 0
+            frame.flags.writeable = False
+            latest = Frame(frame, next(_frame_seq), datetime.now(timezone.utc))
+            with self.cond:
+                self.frame, self.frame_at, self.error = latest, time.monotonic(), None
+                self.cond.notify_all()
+        if cap is not None:
+            cap.release()
+
+    def stop(self):
+        """Stop reading. The thread exits after its current read; waiting requests fail at once."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def latest(self, max_age: float, timeout: float) -> Frame:
+        """The latest frame if no older than `max_age`, else waits up to `timeout` for the next one."""
+        requested = time.monotonic()
+        deadline = requested + timeout
+        with self.cond:
+            self.last_used = requested
+            self.cond.notify_all()  # A reader waiting to retry after a failure may go ahead
+            while True:
+                now = time.monotonic()
+                if self.frame is not None and now - self.frame_at <= max_age:
+                    return self.frame
+                if not self.running:
+                    raise FrameUnavailable("Stream closed")
+                # Report a failure that happened while this request was waiting
+                if self.error and self.failed_at >= requested:
+                    raise FrameUnavailable(self.error)
+                # Backing off past this request's deadline: report the last failure now
+                if self.error and self.frame is None and self.retry_at > deadline:
+                    raise FrameUnavailable(self.error)
+                if now >= deadline:
+                    raise FrameUnavailable(self.error or "Timed out waiting for a frame", timed_out=True)
+                self.cond.wait(deadline - now)
+
+
+class FrameGrabber:
+    def __init__(self, max_streams: int = FRAME_MAX_STREAMS, max_concurrent_opens: int = FRAME_MAX_CONCURRENT_OPENS,
+                 idle_evict_sec: float = FRAME_IDLE_EVICT_SEC):
+        self.max_streams = max_streams
+        self.idle_evict_sec = idle_evict_sec
+        self.open_slots = threading.BoundedSemaphore(max_concurrent_opens)
+        self.lock = threading.Lock()
+        self.streams: "OrderedDict[str, _Stream]" = OrderedDict()  # least recently used first
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "hits": 0, "opens": 0, "open_failures": 0, "read_failures": 0, "evictions": 0}
+        self._reaper: Optional[threading.Thread] = None
+
+    def _stream(self, url: str) -> _Stream:
+        with self.lock:
+            stream = self.streams.get(url)
+            if stream is not None:
+                self.streams.move_to_end(url)
+                return stream
+            while len(self.streams) >= self.max_streams:
+                _, oldest = self.streams.popitem(last=False)
+                oldest.stop()
+                self._count("evictions")
+            stream = self.streams[url] = _Stream(url, self.open_slots, self.stats, self.stats_lock)
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="frame-grabber-reaper", daemon=True)
+                self._reaper.start()
+            return stream
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _reap(self):
+        while True:
+            time.sleep(max(1.0, min(self.idle_evict_sec / 4, 15.0)))
+            cutoff = time.monotonic() - self.idle_evict_sec
+            with self.lock:
+                for url in [u for u, s in self.streams.items() if s.last_used < cutoff]:
+                    self.streams.pop(url).stop()
+                    self._count("evictions")
+
+    def latest_frame(self, url: str, max_age: float = FRAME_MAX_AGE_SEC, timeout: float = FRAME_WAIT_TIMEOUT_SEC) -> Frame:
+        """
+        Latest frame of `url` no older than `max_age` seconds, opening the stream on first use.
+        Raises FrameUnavailable if the stream cannot be opened or read, or no frame arrives within `timeout`.
+        """
+        stream = self._stream(url)
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            if stream.frame is not None and time.monotonic() - stream.frame_at <= max_age:
+                self.stats["hits"] += 1
+        return stream.latest(max_age, timeout)
+
+    def grab_once(self, url: str, max_age: float = FRAME_MAX_AGE_SEC, timeout: float = FRAME_WAIT_TIMEOUT_SEC) -> Frame:
+        """
+        A frame of `url` without keeping a stream open, for URLs that are not (yet) cameras.
+        Served from the stream's reader if one is already open, otherwise from a one-off capture.
+        """
+        with self.lock:
+            stream = self.streams.get(url)
+        if stream is not None:
+            return stream.latest(max_age, timeout)
+
+        with self.open_slots:
+            self._count("opens")
+            cap = _open_capture(url)
+        try:
+            if not cap.isOpened():
+                self._count("open_failures")
+                raise FrameUnavailable("Could not open stream")
+            ret, frame = cap.read()
+            if not ret:
+                self._count("read_failures")
+                raise FrameUnavailable("Failed to read frame from stream")
+        finally:
+            cap.release()
+        frame.flags.writeable = False
+        return Frame(frame, next(_frame_seq), datetime.now(timezone.utc))
+
+    def get_frame(self, url: str, max_age: float = FRAME_MAX_AGE_SEC, timeout: float = FRAME_WAIT_TIMEOUT_SEC) -> np.ndarray:
+        """Writable copy of `latest_frame(url).image`."""
+        return self.latest_frame(url, max_age, timeout).image.copy()
+
+    def close(self, url: str):
+        """Close the stream for `url`, e.g. after its camera is deleted."""
+        with self.lock:
+            stream = self.streams.pop(url, None)
+        if stream is not None:
+            stream.stop()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            open_streams = len(self.streams)
+        with self.stats_lock:
+            return {"open_streams": open_streams, "max_streams": self.max_streams, **self.stats}
+
+
+frame_grabber = FrameGrabber()
@@ -0,0 +1,302 @@
+"""
+Live change stream for the dashboards (`GET /stream`, Server-Sent Events).
+
+A single background thread per Control Plane process collects changes and fans
+them out to every connected viewer, so viewers no longer poll the list endpoints.
+- Spot state flips: on Postgres the thread LISTENs on the channel ingest publishes
+  to (database/changes.py), so flips arrive as soon as they commit. Other
+  databases have no notification bus; there spot_current_state is polled for rows
+  whose `since` moved, every LIVE_POLL_SEC. `since` is the worker's event time, not
+  commit order, so each poll re-reads LIVE_POLL_OVERLAP_SEC behind its cursor and
+  skips flips it already sent.
+- Camera status and last event time: one query over `cameras` every
+  LIVE_CAMERA_SCAN_SEC. This also catches cameras that go stale without a heartbeat.
+- Dashboard counters: re-read from the /stats cache after changes, at most every
+  LIVE_STATS_SEC, and sent only when they differ from the last push.
+
+Changes are coalesced to the latest value per spot and per camera, and sent at
+most every LIVE_FLUSH_SEC as one `changes` event. A viewer that may have missed
+changes gets a `resync` event and should refetch. That happens when its queue
+overflowed or the LISTEN connection was re-established. The thread runs only while
+at least one viewer is connected.
+"""
+
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.changes import CHANGES_CHANNEL, notifications_supported
+from database.models import Spot, SpotCurrentState
+
+# Configuration from Environment
+LIVE_FLUSH_SEC = float(os.getenv("LIVE_FLUSH_SEC", "1"))
+LIVE_POLL_SEC = float(os.getenv("LIVE_POLL_SEC", "2"))
+# Flips committed this late, or from camera clocks this far behind, are still picked up by polling
+LIVE_POLL_OVERLAP_SEC = float(os.getenv("LIVE_POLL_OVERLAP_SEC", "300"))
+LIVE_CAMERA_SCAN_SEC = float(os.getenv("LIVE_CAMERA_SCAN_SEC", "10"))
+LIVE_STATS_SEC = float(os.getenv("LIVE_STATS_SEC", "10"))
+LIVE_KEEPALIVE_SEC = float(os.getenv("LIVE_KEEPALIVE_SEC", "15"))
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "256"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "500"))
+LIVE_RECONNECT_SEC = float(os.getenv("LIVE_RECONNECT_SEC", "5"))
+# Polling more new changes than this at once sends `resync` instead
+LIVE_POLL_MAX_ROWS = 5000
+
+
+class LiveUnavailable(Exception):
+    pass
+
+
+def sse(event: str, data: Any) -> str:
+    """One Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+def _iso(ts: datetime) -> str:
+    return (ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts).isoformat()
+
+
+class LiveHub:
+    def __init__(self, engine, session_factory: Callable[[], Session],
+                 camera_states: Callable[[Session], Dict[str, dict]], stats: Callable[[], dict]):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.camera_states = camera_states
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stop_event = threading.Event()
+        self.worker: Optional[threading.Thread] = None
+        self.counters = {"events_sent": 0, "notifications": 0, "polls": 0, "camera_scans": 0, "overflows": 0, "errors": 0}
+
+    # --- Viewers (event loop side) ---
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        with self.lock:
+            if len(self.subscribers) >= LIVE_MAX_SUBSCRIBERS:
+                raise LiveUnavailable("Too many live viewers")
+            self.loop = asyncio.get_running_loop()
+            self.subscribers.add(queue)
+            if self.worker is None or not self.worker.is_alive() or self.stop_event.is_set():
+                self.stop_event = threading.Event()
+                self.worker = threading.Thread(target=self._run, args=(self.stop_event,), name="live-stream", daemon=True)
+                self.worker.start()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self.lock:
+            self.subscribers.discard(queue)
+            if not self.subscribers:
+                self.stop_event.set()
+
+    async def events(self, queue: asyncio.Queue) -> AsyncIterator[str]:
+        """SSE body for one viewer; unsubscribes when the client disconnects."""
+        try:
+            yield f"retry: {int(LIVE_RECONNECT_SEC * 1000)}\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def _deliver(self, frame: str):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # A slow viewer fell behind: drop its backlog and have it refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(sse("resync", {}))
+                self._count("overflows")
+
+    def _broadcast(self, event: str, data: Any):
+        with self.lock:
+            loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, sse(event, data))
+        except RuntimeError:
+            return  # Event loop closed (shutdown)
+        self._count("events_sent")
+
+    def _count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            running = self.worker is not None and self.worker.is_alive() and not self.stop_event.is_set()
+            return {
+                "viewers": len(self.subscribers),
+                "source": "listen" if notifications_supported(self.engine) else "poll",
+                "running": running,
+                **self.counters,
+            }
+
+    # --- Change collection (worker thread) ---
+
+    def _listen(self):
+        """Dedicated autocommit connection LISTENing on the changes channel, kept out of the pool."""
+        pooled = self.engine.raw_connection()
+        dbapi = pooled.driver_connection
+        pooled.detach()
+        dbapi.autocommit = True
+        cursor = dbapi.cursor()
+        cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+        cursor.close()
+        return dbapi
+
+    def _receive(self, dbapi, timeout: float, spots: Dict[str, dict], cameras: Dict[str, dict]):
+        if not select.select([dbapi], [], [], timeout)[0]:
+            return
+        dbapi.poll()
+        while dbapi.notifies:
+            message = json.loads(dbapi.notifies.pop(0).payload)
+            self._count("notifications")
+            if message["type"] == "spots":
+                for spot_id, occupied in message["changes"]:
+                    spots[spot_id] = {
+                        "spot_id": spot_id, "location_id": message["location_id"], "camera_id": message["camera_id"],
+                        "occupied": occupied, "since": message["timestamp"],
+                    }
+            elif message["type"] == "camera":
+                cameras.setdefault(message["camera_id"], {"id": message["camera_id"]})["status"] = message["status"]
+
+    def _poll_spots(self, cursor: Optional[datetime], sent: Dict[str, datetime], spots: Dict[str, dict]) -> datetime:
+        """
+        Collect spots whose state changed since the last poll; returns the new cursor.
+        Rows back to LIVE_POLL_OVERLAP_SEC before `cursor` are re-read (at most one per spot),
+        and flips already in `sent` (spot_id -> since) are skipped. The first poll only primes `sent`.
+        """
+        self._count("polls")
+        db = self.session_factory()
+        try:
+            priming = cursor is None
+            if priming:
+                cursor = db.query(func.max(SpotCurrentState.since)).scalar() or datetime(1970, 1, 1)
+            floor = cursor - timedelta(seconds=LIVE_POLL_OVERLAP_SEC)
+            rows = db.query(
+                SpotCurrentState.spot_id, SpotCurrentState.occupied, SpotCurrentState.since,
+                SpotCurrentState.camera_id, Spot.location_id,
+            ).join(Spot, Spot.id == SpotCurrentState.spot_id)\
+                .filter(SpotCurrentState.since > floor)\
+                .order_by(SpotCurrentState.since).all()
+        finally:
+            db.close()
+        if rows:
+            cursor = max(cursor, rows[-1].since)
+        new = [row for row in rows if sent.get(row.spot_id) != row.since]
+        for row in new:
+            sent[row.spot_id] = row.since
+        floor = cursor - timedelta(seconds=LIVE_POLL_OVERLAP_SEC)
+        for spot_id in [k for k, since in sent.items() if since <= floor]:
+            del sent[spot_id]
+        if priming:
+            return cursor
+        if len(new) > LIVE_POLL_MAX_ROWS:
+            spots.clear()
+            self._broadcast("resync", {})
+            return cursor
+        for row in new:
+            spots[row.spot_id] = {
+                "spot_id": row.spot_id, "location_id": str(row.location_id), "camera_id": str(row.camera_id),
+                "occupied": row.occupied, "since": _iso(row.since),
+            }
+        return cursor
+
+    def _scan_cameras(self, previous: Optional[Dict[str, dict]], cameras: Dict[str, dict]) -> Dict[str, dict]:
+        self._count("camera_scans")
+        db = self.session_factory()
+        try:
+            current = self.camera_states(db)
+        finally:
+            db.close()
+        if previous is not None:
+            for camera_id, state in current.items():
+                if previous.get(camera_id) != state:
+                    cameras.setdefault(camera_id, {}).update(state)
+        return current
+
+    def _run(self, stop: threading.Event):
+        use_listen = notifications_supported(self.engine)
+        listener = None
+        reconnecting = False
+        spots: Dict[str, dict] = {}
+        cameras: Dict[str, dict] = {}
+        known_cameras: Optional[Dict[str, dict]] = None
+        spot_cursor: Optional[datetime] = None
+        sent_flips: Dict[str, datetime] = {}
+        last_stats: Optional[dict] = None
+        stats_due = False
+        now = time.monotonic()
+        next_flush = next_poll = next_scan = next_stats = now
+        while not stop.is_set():
+            try:
+                if use_listen and listener is None:
+                    listener = self._listen()
+                    if reconnecting:
+                        self._broadcast("resync", {})  # Notifications sent while disconnected are lost
+                        reconnecting = False
+
+                now = time.monotonic()
+                deadlines = [next_scan]
+                if spots or cameras:
+                    deadlines.append(next_flush)
+                if stats_due:
+                    deadlines.append(next_stats)
+                if not use_listen:
+                    deadlines.append(next_poll)
+                # Wake at least once a second to notice the last viewer leaving
+                wait = min(max(0.0, min(deadlines) - now), 1.0)
+
+                if use_listen:
+                    self._receive(listener, wait, spots, cameras)
+                else:
+                    stop.wait(wait)
+                    if time.monotonic() >= next_poll:
+                        spot_cursor = self._poll_spots(spot_cursor, sent_flips, spots)
+                        next_poll = time.monotonic() + LIVE_POLL_SEC
+
+                now = time.monotonic()
+                if now >= next_scan:
+                    known_cameras = self._scan_cameras(known_cameras, cameras)
+                    next_scan = now + LIVE_CAMERA_SCAN_SEC
+                if (spots or cameras) and now >= next_flush:
+                    self._broadcast("changes", {"spots": list(spots.values()), "cameras": list(cameras.values())})
+                    spots, cameras = {}, {}
+                    next_flush = now + LIVE_FLUSH_SEC
+                    stats_due = True
+                if stats_due and now >= next_stats:
+                    stats = self.stats()
+                    if stats != last_stats:
+                        self._broadcast("stats", stats)
+                        last_stats = stats
+                    stats_due = False
+                    next_stats = now + LIVE_STATS_SEC
+            except Exception as e:
+                print(f"Live stream error: {e}")
+                self._count("errors")
+                if listener is not None:
+                    try:
+                        listener.close()
+                    except Exception:
+                        pass
+                    listener = None
+                reconnecting = use_listen
+                stop.wait(LIVE_RECONNECT_SEC)
+        if listener is not None:
+            listener.close()
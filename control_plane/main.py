@@ -1,29 +1,57 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
+from sqlalchemy.orm import Session, load_only
+from typing import Callable, Iterator, List, NamedTuple, Optional
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
 import cv2
 import numpy as np
 import base64
+import hashlib
+import json
 
 # Path hack for POC
 import sys
 import os
+import threading
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database.db import get_db, engine
-from database.models import Base, Camera, OccupancyEvent, HealthLog, Location, Spot, SpotObservation, DeviceStatus
+from database.db import get_db, get_read_db, open_read_session, engine, read_engine, pool_metrics, read_routing_metrics
+from database.models import (
+    Base, Camera, OccupancyEvent, Location, Spot, SpotCurrentState, SpotObservation, SpotStateInterval, DeviceStatus,
+    PurgeJob, CameraSpotIndex,
+    spot_state_at, unpack_spot_states,
+)
+from database.snapshot_store import get_snapshot_store, is_valid_ref
+from database.partitions import create_partitioned_tables
+from database.rollups import GRANULARITIES
+from database.archive import iter_archived
+from database import purge, queries
+from control_plane.frame_grabber import Frame, FrameUnavailable, frame_grabber
+from control_plane.live import LiveHub, LiveUnavailable
 from control_plane.schemas import (
     CameraCreate, CameraResponse, CameraUpdate, OccupancyUpdate, 
     HealthUpdate, OccupancyEventResponse, CaptureFrameRequest, CaptureFrameResponse,
-    LocationCreate, LocationResponse, SpotResponse
+    LocationCreate, LocationResponse, SpotResponse, PurgeJobResponse
 )
 
-# Initialize database tables
+# Configuration from Environment
+# /stats is recomputed at most this often; control plane writes invalidate it immediately
+STATS_CACHE_TTL_SEC = float(os.getenv("STATS_CACHE_TTL_SEC", "5"))
+# Analytics exports fetch and encode this many rows per round trip / response chunk
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+# /cameras/{id}/snapshot.jpg reuses an encoded frame this long; browsers may cache it for the remainder
+SNAPSHOT_MAX_AGE_SEC = float(os.getenv("SNAPSHOT_MAX_AGE_SEC", "30"))
+SNAPSHOT_CACHE_ENTRIES = int(os.getenv("SNAPSHOT_CACHE_ENTRIES", "128"))
+
+# Initialize database tables (history tables first, so they can be created partitioned)
+create_partitioned_tables(engine)
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Camera Control Plane")
@@ -34,6 +62,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "ETag"],
 )
 
 
@@ -45,102 +74,216 @@ async def root():
 
 @app.get("/locations", response_model=List[LocationResponse])
 def list_locations(db: Session = Depends(get_db)):
-    return db.query(Location).all()
+    return db.query(Location).filter(Location.deleted_at == None).all()
 
 @app.post("/locations", response_model=LocationResponse, status_code=status.HTTP_201_CREATED)
 def create_location(location_in: LocationCreate, db: Session = Depends(get_db)):
     db_location = Location(**location_in.model_dump())
     db.add(db_location)
     db.commit()
+    _stats_cache.invalidate()
     db.refresh(db_location)
     return db_location
 
 @app.get("/locations/{location_id}", response_model=LocationResponse)
 def get_location(location_id: uuid.UUID, db: Session = Depends(get_db)):
-    db_loc = db.query(Location).filter(Location.id == location_id).first()
+    db_loc = db.query(Location).filter(Location.id == location_id, Location.deleted_at == None).first()
     if not db_loc:
         raise HTTPException(status_code=404, detail="Location not found")
     return db_loc
 
-@app.delete("/locations/{location_id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/locations/{location_id}", response_model=PurgeJobResponse, status_code=status.HTTP_202_ACCEPTED)
 def delete_location(location_id: uuid.UUID, db: Session = Depends(get_db)):
-    """Delete a location. Note: This will unlink cameras and potentially delete spots."""
-    db_location = db.query(Location).filter(Location.id == location_id).first()
+    """
+    Delete a location and its spots. They disappear at once; their history is removed
+    in the background by the returned purge job (poll GET /purge-jobs/{id}).
+    """
+    db_location = db.query(Location).filter(Location.id == location_id, Location.deleted_at == None).first()
     if not db_location:
         raise HTTPException(status_code=404, detail="Location not found")
     
-    # 1. Unlink cameras (set location_id to null)
-    db.query(Camera).filter(Camera.location_id == location_id).update({Camera.location_id: None})
-    
-    # 2. Delete spots associated with this location
-    db.query(SpotObservation).filter(SpotObservation.spot_id.in_(
-        db.query(Spot.id).filter(Spot.location_id == location_id)
-    )).delete(synchronize_session=False)
+    # Cameras must be deleted or moved first: a camera cannot exist without a location
+    if db.query(Camera.id).filter(Camera.location_id == location_id, Camera.deleted_at == None).first():
+        raise HTTPException(status_code=409, detail="Location still has cameras; delete or move them first")
     
-    db.query(Spot).filter(Spot.location_id == location_id).delete()
+    now = datetime.now(timezone.utc)
+    spots = db.query(Spot.id).filter(Spot.location_id == location_id)
+    db.query(SpotCurrentState).filter(SpotCurrentState.spot_id.in_(spots)).delete(synchronize_session=False)
+    db.query(Spot).filter(Spot.location_id == location_id, Spot.deleted_at == None)\
+        .update({Spot.deleted_at: now}, synchronize_session=False)
+    db_location.deleted_at = now
     
-    # 3. Delete the location
-    db.delete(db_location)
+    job = _queue_purge(db, purge.LOCATION, location_id)
     db.commit()
-    return None
+    _stats_cache.invalidate()
+    return job
 
 @app.get("/locations/{location_id}/status")
-def get_location_status(location_id: uuid.UUID, db: Session = Depends(get_db)):
-    """Return the latest occupancy status for all spots in a location."""
-    spots = db.query(Spot).filter(Spot.location_id == location_id).all()
-    
-    results = []
-    for spot in spots:
-        # Get latest observation for this spot
-        latest_obs = db.query(SpotObservation).filter(SpotObservation.spot_id == spot.id).order_by(SpotObservation.timestamp.desc()).first()
-        results.append({
-            "spot_id": spot.id,
-            "name": spot.name,
-            "occupied": latest_obs.occupied if latest_obs else False,
-            "last_update": latest_obs.timestamp if latest_obs else None
-        })
-    
-    return results
+def get_location_status(location_id: uuid.UUID, since: Optional[datetime] = None, db: Session = Depends(get_read_db)):
+    """
+    Return the latest occupancy status for all spots in a location, in one query.
+    
+    - since: Optional; only spots whose state changed after this time.
+    """
+    if since:
+        since = _as_aware(since).astimezone(timezone.utc)
+    
+    return [
+        {
+            "spot_id": row.id,
+            "name": row.name,
+            "occupied": bool(row.occupied),
+            "since": row.since,
+            "last_update": row.last_seen
+        }
+        for row in queries.location_status(db, location_id, since)
+    ]
 
 # --- Cameras ---
 
 @app.get("/cameras", response_model=List[CameraResponse])
 def list_cameras(db: Session = Depends(get_db)):
-    cameras = db.query(Camera).all()
+    cameras = db.query(Camera).filter(Camera.deleted_at == None).all()
     for cam in cameras:
         cam.status = _compute_status(cam)
     return cameras
 
-@app.get("/events")
-def list_events(camera_id: Optional[uuid.UUID] = None, limit: int = 100, db: Session = Depends(get_db)):
-    """Get recent occupancy events with camera name and location."""
-    query = db.query(
-        OccupancyEvent,
-        Camera.name.label('camera_name'),
-        Location.name.label('location_name')
-    ).join(Camera, OccupancyEvent.camera_id == Camera.id)\
-     .join(Location, Camera.location_id == Location.id)
+# --- Keyset pagination ---
+
+def _encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Opaque token for the (timestamp, id) key of the last row on a page."""
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_page(query, time_column, id_column, key: Callable, cursor: Optional[str], limit: int,
+                 start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """
+    Newest-first page of `query` after `cursor`, within [start_date, end_date].
+    Seeks on (time, id) instead of using OFFSET, so every page costs the same as the first.
+    `key` returns the (time, id) of a result row. Returns (rows, next_cursor).
+    """
+    after = _decode_cursor(cursor) if cursor else None
+    rows = queries.keyset_page(query, time_column, id_column, limit, after, start_date, end_date).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor(*key(rows[-1]))
+
+
+def _set_next_cursor(request: Request, response: Response, next_cursor: Optional[str]):
+    """Advertise the next page in X-Next-Cursor and an RFC 8288 Link header."""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+
+# Fields of an event in API responses, and the views naming common subsets
+EVENT_FIELDS = ("id", "camera_id", "camera_name", "location_name", "timestamp",
+                "occupied_count", "free_count", "total_slots", "metadata_json", "spot_details")
+EVENT_VIEWS = {
+    "full": EVENT_FIELDS,
+    "slim": ("id", "camera_id", "camera_name", "location_name", "timestamp", "occupied_count", "free_count", "total_slots"),
+}
+
+
+def _event_fields(view: str, fields: Optional[str]) -> tuple:
+    """Requested event fields: an explicit comma-separated `fields` list, else the named view."""
+    if fields:
+        requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in requested if f not in EVENT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}; expected {', '.join(EVENT_FIELDS)}")
+        return requested
+    if view not in EVENT_VIEWS:
+        raise HTTPException(status_code=400, detail=f"view must be one of {', '.join(EVENT_VIEWS)}")
+    return EVENT_VIEWS[view]
+
+
+def _event_dicts(db: Session, rows: list, fields: tuple) -> List[dict]:
+    spot_tables = {}
+    if "spot_details" in fields:
+        spot_tables = _spot_tables(db, {(row.OccupancyEvent.camera_id, row.OccupancyEvent.spot_table_version) for row in rows})
     
-    if camera_id:
-        query = query.filter(OccupancyEvent.camera_id == camera_id)
+    def _value(row, field):
+        event = row.OccupancyEvent
+        if field in ("camera_name", "location_name"):
+            return getattr(row, field)
+        if field == "spot_details":
+            return _spot_details(event, spot_tables)
+        return getattr(event, field)
     
-    results = query.order_by(OccupancyEvent.timestamp.desc()).limit(limit).all()
+    return [{field: _value(row, field) for field in fields} for row in rows]
+
+
+@app.get("/events")
+def list_events(
+    request: Request,
+    response: Response,
+    camera_id: Optional[uuid.UUID] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    view: str = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get occupancy events with camera name and location, newest first.
+    Pass the X-Next-Cursor header of a response as `cursor` to get the next (older) page.
     
-    # Transform results to include camera details
-    return [
-        {
-            "id": row.OccupancyEvent.id,
-            "camera_id": row.OccupancyEvent.camera_id,
-            "camera_name": row.camera_name,
-            "location_name": row.location_name,
-            "timestamp": row.OccupancyEvent.timestamp,
-            "occupied_count": row.OccupancyEvent.occupied_count,
-            "free_count": row.OccupancyEvent.free_count,
-            "total_slots": row.OccupancyEvent.total_slots,
-            "metadata_json": row.OccupancyEvent.metadata_json
-        }
-        for row in results
-    ]
+    - view: 'full' (default) or 'slim' (counts and names only; no metadata_json or spot_details).
+    - fields: Comma-separated subset of fields; overrides `view`.
+    """
+    selected = _event_fields(view, fields)
+    query = queries.events(db, selected, camera_id)
+    
+    results, next_cursor = _keyset_page(query, OccupancyEvent.timestamp, OccupancyEvent.id,
+                                        lambda row: (row.OccupancyEvent.timestamp, row.OccupancyEvent.id),
+                                        cursor, limit, start_date, end_date)
+    _set_next_cursor(request, response, next_cursor)
+    return _event_dicts(db, results, selected)
+
+
+@app.get("/events/{event_id}")
+def get_event(event_id: int, view: str = "full", fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """A single event, by default with metadata_json and spot_details (for detail views over slim lists)."""
+    selected = _event_fields(view, fields)
+    row = queries.events(db, selected).filter(OccupancyEvent.id == event_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return _event_dicts(db, [row], selected)[0]
+
+def _spot_tables(db: Session, keys: set) -> dict:
+    """Ordered zone IDs per (camera_id, spot table version), for decoding packed spot states."""
+    keys = {k for k in keys if k[1] is not None}
+    if not keys:
+        return {}
+    tables = {}
+    rows = db.query(CameraSpotIndex.camera_id, CameraSpotIndex.table_version, CameraSpotIndex.zone_id)\
+        .filter(CameraSpotIndex.camera_id.in_({k[0] for k in keys}),
+                CameraSpotIndex.table_version.in_({k[1] for k in keys}))\
+        .order_by(CameraSpotIndex.position)
+    for camera_id, version, zone_id in rows:
+        tables.setdefault((camera_id, version), []).append(zone_id)
+    return tables
+
+def _spot_details(event: OccupancyEvent, spot_tables: dict) -> Optional[list]:
+    """Per-spot states of an event, decoded from its bit vector (or legacy `spot_details` JSON)."""
+    zones = spot_tables.get((event.camera_id, event.spot_table_version))
+    if event.spot_states is not None and zones is not None:
+        states = unpack_spot_states(event.spot_states, len(zones))
+        return [{"spot_id": zone, "occupied": occupied} for zone, occupied in zip(zones, states)]
+    return (event.metadata_json or {}).get("spot_details")
 
 def _sync_spots(db: Session, db_camera: Camera):
     """Ensure all spots defined in camera geometry are registered in the spots table."""
@@ -173,12 +316,29 @@ def _sync_spots(db: Session, db_camera: Camera):
             # Ensure it's linked to the correct location (re-parenting if moved)
             db_spot.location_id = db_camera.location_id
     db.commit()
+    _stats_cache.invalidate()
+
+def _check_not_deleted(db: Session, location_id: Optional[uuid.UUID], geometry):
+    """Reject pointing a camera at a deleted location, or at spots whose purge is still pending."""
+    if not location_id:
+        return
+    location = db.query(Location.deleted_at).filter(Location.id == location_id).first()
+    if location and location.deleted_at:
+        raise HTTPException(status_code=404, detail="Location not found")
+    zone_ids = {zone.get("id") for zone in geometry or [] if isinstance(zone, dict) and zone.get("id")}
+    if zone_ids:
+        pending = [row.name for row in db.query(Spot.name).filter(
+            Spot.id.in_([f"{location_id}:{zone_id}" for zone_id in zone_ids]), Spot.deleted_at != None)]
+        if pending:
+            raise HTTPException(status_code=409, detail=f"Spots {', '.join(sorted(pending))} are still being deleted; retry later")
 
 @app.post("/cameras", response_model=CameraResponse, status_code=status.HTTP_201_CREATED)
 def create_camera(camera_in: CameraCreate, db: Session = Depends(get_db)):
+    _check_not_deleted(db, camera_in.location_id, camera_in.geometry)
     db_camera = Camera(**camera_in.model_dump())
     db.add(db_camera)
     db.commit()
+    _stats_cache.invalidate()
     db.refresh(db_camera)
     
     # Compute status for immediate response
@@ -197,7 +357,7 @@ def _compute_status(camera: Camera) -> DeviceStatus:
     if not camera.last_heartbeat:
         return DeviceStatus.DISCONNECTED
         
-    delta = (datetime.now(timezone.utc) - camera.last_heartbeat).total_seconds()
+    delta = (datetime.now(timezone.utc) - _as_aware(camera.last_heartbeat)).total_seconds()
     
     # Relaxed thresholds to accommodate default 60s polling intervals
     if delta > 600: # 10 minutes without heartbeat
@@ -209,7 +369,7 @@ def _compute_status(camera: Camera) -> DeviceStatus:
 
 @app.get("/cameras/{camera_id}", response_model=CameraResponse)
 def get_camera(camera_id: uuid.UUID, db: Session = Depends(get_db)):
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    db_camera = db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
         
@@ -223,15 +383,19 @@ def get_camera(camera_id: uuid.UUID, db: Session = Depends(get_db)):
 @app.patch("/cameras/{camera_id}", response_model=CameraResponse)
 def update_camera(camera_id: uuid.UUID, camera_update: CameraUpdate, db: Session = Depends(get_db)):
     """Update camera settings or desired_state (start/stop)."""
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    db_camera = db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
     update_data = camera_update.model_dump(exclude_unset=True)
+    if "location_id" in update_data or "geometry" in update_data:
+        _check_not_deleted(db, update_data.get("location_id", db_camera.location_id),
+                           update_data.get("geometry", db_camera.geometry))
     for key, value in update_data.items():
         setattr(db_camera, key, value)
     
     db.commit()
+    _stats_cache.invalidate()
     db.refresh(db_camera)
     
     # Sync spots if location_id or geometry was updated
@@ -240,27 +404,39 @@ def update_camera(camera_id: uuid.UUID, camera_update: CameraUpdate, db: Session
         
     return db_camera
 
-@app.delete("/cameras/{camera_id}", status_code=status.HTTP_204_NO_CONTENT)
+def _queue_purge(db: Session, entity_type: str, entity_id, spot_ids: Optional[List[str]] = None) -> PurgeJob:
+    """Queue background removal of a soft-deleted entity's history (database/purge.py); committed by the caller."""
+    job = PurgeJob(entity_type=entity_type, entity_id=str(entity_id), spot_ids=spot_ids,
+                   status=purge.PENDING, rows_deleted=0)
+    db.add(job)
+    return job
+
+@app.delete("/cameras/{camera_id}", response_model=PurgeJobResponse, status_code=status.HTTP_202_ACCEPTED)
 def delete_camera(camera_id: uuid.UUID, db: Session = Depends(get_db)):
-    """Permanently delete a camera and its related data."""
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    """
+    Delete a camera, and the spots of its location that no other camera covers.
+    They disappear at once; their history is removed in the background by the
+    returned purge job (poll GET /purge-jobs/{id}).
+    """
+    db_camera = db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
     location_id = db_camera.location_id
+    now = datetime.now(timezone.utc)
 
-    # 1. Delete transient data
-    db.query(OccupancyEvent).filter(OccupancyEvent.camera_id == camera_id).delete()
-    db.query(HealthLog).filter(HealthLog.camera_id == camera_id).delete()
-    db.query(SpotObservation).filter(SpotObservation.camera_id == camera_id).delete()
+    # 1. Current state goes now (it is small); history is left to the purge job
+    db.query(SpotCurrentState).filter(SpotCurrentState.camera_id == camera_id).delete(synchronize_session=False)
     
     # 2. Identify spots that were uniquely referenced by THIS camera in this location
+    orphaned = []
     if location_id and db_camera.geometry:
         # Get all spots currently in this location
-        all_spots = db.query(Spot).filter(Spot.location_id == location_id).all()
+        all_spots = db.query(Spot).filter(Spot.location_id == location_id, Spot.deleted_at == None).all()
         
         # Get all OTHER cameras in this location
-        other_cameras = db.query(Camera).filter(Camera.location_id == location_id, Camera.id != camera_id).all()
+        other_cameras = db.query(Camera).filter(Camera.location_id == location_id, Camera.id != camera_id,
+                                                Camera.deleted_at == None).all()
         
         # Build set of spot IDs covered by OTHER cameras
         covered_by_others = set()
@@ -273,39 +449,95 @@ def delete_camera(camera_id: uuid.UUID, db: Session = Depends(get_db)):
         # For PeakPark, let's prune orphaned spots to keep the UI clean as requested.
         for spot in all_spots:
             if spot.id not in covered_by_others:
-                db.query(SpotObservation).filter(SpotObservation.spot_id == spot.id).delete()
-                db.delete(spot)
+                spot.deleted_at = now
+                orphaned.append(spot.id)
+        if orphaned:
+            db.query(SpotCurrentState).filter(SpotCurrentState.spot_id.in_(orphaned)).delete(synchronize_session=False)
 
-    db.delete(db_camera)
+    db_camera.deleted_at = now
+    job = _queue_purge(db, purge.CAMERA, camera_id, orphaned)
     db.commit()
-    return None
+    _stats_cache.invalidate()
+    frame_grabber.close(db_camera.stream_url)
+    return job
 
-@app.delete("/spots/{spot_id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/spots/{spot_id}", response_model=PurgeJobResponse, status_code=status.HTTP_202_ACCEPTED)
 def delete_spot(spot_id: str, db: Session = Depends(get_db)):
-    """Manually delete a spot and its history."""
-    db_spot = db.query(Spot).filter(Spot.id == spot_id).first()
+    """Manually delete a spot. Its history is removed in the background by the returned purge job."""
+    db_spot = db.query(Spot).filter(Spot.id == spot_id, Spot.deleted_at == None).first()
     if not db_spot:
         raise HTTPException(status_code=404, detail="Spot not found")
     
-    db.query(SpotObservation).filter(SpotObservation.spot_id == spot_id).delete()
-    db.delete(db_spot)
+    db.query(SpotCurrentState).filter(SpotCurrentState.spot_id == spot_id).delete(synchronize_session=False)
+    db_spot.deleted_at = datetime.now(timezone.utc)
+    job = _queue_purge(db, purge.SPOT, spot_id)
     db.commit()
-    return None
+    _stats_cache.invalidate()
+    return job
+
+@app.get("/purge-jobs", response_model=List[PurgeJobResponse])
+def list_purge_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db)):
+    """Background deletes, newest first. `status`: pending, running or done."""
+    query = db.query(PurgeJob)
+    if status:
+        query = query.filter(PurgeJob.status == status)
+    return query.order_by(PurgeJob.id.desc()).limit(limit).all()
+
+@app.get("/purge-jobs/{job_id}", response_model=PurgeJobResponse)
+def get_purge_job(job_id: int, db: Session = Depends(get_db)):
+    """Progress of a background delete: `step` being purged and rows deleted per table."""
+    job = db.get(PurgeJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return job
+
+def _latest_frame(stream_url: str, persistent: bool = True) -> Frame:
+    """
+    Latest frame from the shared, persistent stream reader (see control_plane/frame_grabber.py).
+    `persistent=False` for URLs that are not cameras yet: no reader is kept open for them.
+    """
+    try:
+        if persistent:
+            return frame_grabber.latest_frame(stream_url)
+        return frame_grabber.grab_once(stream_url)
+    except FrameUnavailable as e:
+        raise HTTPException(status_code=504 if e.timed_out else 400, detail=str(e))
+
+def _grab_frame(stream_url: str, persistent: bool = True) -> np.ndarray:
+    return _latest_frame(stream_url, persistent).image.copy()
+
+def _annotate_zones(frame: np.ndarray, geometry: list):
+    """Draw each spot zone's polygon and ID onto `frame` in place."""
+    for zone in geometry:
+        points = np.array(zone['points'], np.int32)
+        # Draw polygon
+        cv2.polylines(frame, [points], True, (0, 255, 0), 2)
+
+        # Draw ID in center
+        if 'id' in zone:
+            M = cv2.moments(points)
+            if M["m00"] != 0:
+                cx = int(M["m10"] / M["m00"])
+                cy = int(M["m01"] / M["m00"])
+            else:
+                # Fallback to mean if moments fail
+                cx, cy = np.mean(points, axis=0).astype(int)
+
+            text = str(zone['id'])
+            # Simple text with background for readability
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            scale = 0.5
+            thickness = 1
+            (tw, th), baseline = cv2.getTextSize(text, font, scale, thickness)
+            cv2.rectangle(frame, (cx - tw//2 - 2, cy - th//2 - 2), (cx + tw//2 + 2, cy + th//2 + 2), (0, 0, 0), -1)
+            cv2.putText(frame, text, (cx - tw//2, cy + th//2), font, scale, (255, 255, 255), thickness)
 
 @app.post("/cameras/capture-frame", response_model=CaptureFrameResponse)
 def capture_frame_endpoint(request: CaptureFrameRequest):
     """Capture a single frame from an RTSP/HTTP stream and return as base64."""
     try:
-        cap = cv2.VideoCapture(request.stream_url)
-        if not cap.isOpened():
-            raise HTTPException(status_code=400, detail="Could not open stream")
-        
-        ret, frame = cap.read()
-        cap.release()
-        
-        if not ret:
-            raise HTTPException(status_code=400, detail="Failed to read frame from stream")
-        
+        # Typed into the setup wizard, possibly wrong: read once instead of holding a stream open
+        frame = _grab_frame(request.stream_url, persistent=False)
         height, width = frame.shape[:2]
         
         # Encode as JPEG
@@ -325,45 +557,14 @@ def capture_frame_endpoint(request: CaptureFrameRequest):
 @app.get("/cameras/{camera_id}/snapshot", response_model=CaptureFrameResponse)
 def get_camera_snapshot(camera_id: uuid.UUID, annotate: bool = True, db: Session = Depends(get_db)):
     """Fetch a live frame from the camera and optionally annotate it with spot zones."""
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    db_camera = db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
     try:
-        cap = cv2.VideoCapture(db_camera.stream_url)
-        if not cap.isOpened():
-            raise HTTPException(status_code=400, detail="Could not open stream")
-        
-        ret, frame = cap.read()
-        cap.release()
-        
-        if not ret:
-            raise HTTPException(status_code=400, detail="Failed to read frame from stream")
-        
+        frame = _grab_frame(db_camera.stream_url)
         if annotate and db_camera.geometry:
-            for zone in db_camera.geometry:
-                points = np.array(zone['points'], np.int32)
-                # Draw polygon
-                cv2.polylines(frame, [points], True, (0, 255, 0), 2)
-                
-                # Draw ID in center
-                if 'id' in zone:
-                    M = cv2.moments(points)
-                    if M["m00"] != 0:
-                        cx = int(M["m10"] / M["m00"])
-                        cy = int(M["m01"] / M["m00"])
-                    else:
-                        # Fallback to mean if moments fail
-                        cx, cy = np.mean(points, axis=0).astype(int)
-                    
-                    text = str(zone['id'])
-                    # Simple text with background for readability
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    scale = 0.5
-                    thickness = 1
-                    (tw, th), baseline = cv2.getTextSize(text, font, scale, thickness)
-                    cv2.rectangle(frame, (cx - tw//2 - 2, cy - th//2 - 2), (cx + tw//2 + 2, cy + th//2 + 2), (0, 0, 0), -1)
-                    cv2.putText(frame, text, (cx - tw//2, cy + th//2), font, scale, (255, 255, 255), thickness)
+            _annotate_zones(frame, db_camera.geometry)
 
         height, width = frame.shape[:2]
         _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
@@ -379,95 +580,310 @@ def get_camera_snapshot(camera_id: uuid.UUID, annotate: bool = True, db: Session
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Snapshot error: {str(e)}")
 
+class _Jpeg(NamedTuple):
+    data: bytes
+    etag: str
+    captured_at: datetime
+
+class _JpegCache:
+    """
+    LRU of encoded snapshot JPEGs. Each variant (camera, annotate, width, zones) holds its newest
+    encoding, identified by the frame it came from, and is reused until that frame is `max_age` old.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[tuple, _Jpeg]" = OrderedDict()  # least recently used first
+
+    def get(self, variant: tuple, max_age: float) -> Optional[_Jpeg]:
+        with self.lock:
+            jpeg = self.entries.get(variant)
+            if jpeg is None or (datetime.now(timezone.utc) - jpeg.captured_at).total_seconds() > max_age:
+                return None
+            self.entries.move_to_end(variant)
+            return jpeg
+
+    def put(self, variant: tuple, jpeg: _Jpeg):
+        with self.lock:
+            self.entries[variant] = jpeg
+            self.entries.move_to_end(variant)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+_jpeg_cache = _JpegCache(SNAPSHOT_CACHE_ENTRIES)
+
+def _encode_snapshot(frame: Frame, geometry: Optional[list], width: Optional[int]) -> bytes:
+    image = frame.image
+    if geometry:
+        image = image.copy()  # The grabber's frame is shared and read-only
+        _annotate_zones(image, geometry)
+    if width and width < image.shape[1]:
+        height = max(1, round(image.shape[0] * width / image.shape[1]))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+def _not_modified(request: Request, jpeg: _Jpeg) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return jpeg.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return jpeg.captured_at.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@app.get("/cameras/{camera_id}/snapshot.jpg")
+def get_camera_snapshot_jpeg(
+    camera_id: uuid.UUID,
+    request: Request,
+    annotate: bool = True,
+    width: Optional[int] = Query(None, ge=16, le=4096, description="Downscale to this width (never upscales)"),
+    db: Session = Depends(get_db)
+):
+    """Live frame as `image/jpeg`, cacheable by browsers (ETag / Last-Modified / max-age)."""
+    db_camera = db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None).first()
+    if not db_camera:
+        raise HTTPException(status_code=404, detail="Camera not found")
+
+    geometry = db_camera.geometry if annotate else None
+    zones = hashlib.sha1(json.dumps(geometry, sort_keys=True).encode()).hexdigest()[:12] if geometry else None
+    variant = (camera_id, annotate, width, zones)
+    jpeg = _jpeg_cache.get(variant, SNAPSHOT_MAX_AGE_SEC)
+    if jpeg is None:
+        frame = _latest_frame(db_camera.stream_url)
+        try:
+            data = _encode_snapshot(frame, geometry, width)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Snapshot error: {str(e)}")
+        tag = hashlib.sha1(repr((camera_id, frame.seq, frame.captured_at, annotate, width, zones)).encode()).hexdigest()[:20]
+        jpeg = _Jpeg(data, f'"{tag}"', frame.captured_at)
+        _jpeg_cache.put(variant, jpeg)
+
+    age = (datetime.now(timezone.utc) - jpeg.captured_at).total_seconds()
+    headers = {
+        "ETag": jpeg.etag,
+        "Last-Modified": format_datetime(jpeg.captured_at, usegmt=True),
+        "Cache-Control": f"private, max-age={max(0, int(SNAPSHOT_MAX_AGE_SEC - age))}",
+    }
+    if _not_modified(request, jpeg):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=jpeg.data, media_type="image/jpeg", headers=headers)
+
+@app.get("/snapshots/{ref}")
+def get_stored_snapshot(ref: str, request: Request):
+    """Serve an archived event snapshot by its content reference (`metadata_json.snapshot_ref`)."""
+    if not is_valid_ref(ref):
+        raise HTTPException(status_code=400, detail="Invalid snapshot reference")
+
+    # Content-addressed blobs never change, so clients may cache them indefinitely
+    headers = {
+        "ETag": f'"{ref}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    data = get_snapshot_store().get(ref)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found (expired or never stored)")
+
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+@app.get("/metrics")
+def metrics():
+    """Database pool usage, replica routing (when a read replica is configured) and open camera streams."""
+    metrics = {"db_pool": pool_metrics(), "read_routing": read_routing_metrics(), "frame_grabber": frame_grabber.metrics(),
+               "live": live_hub.metrics()}
+    if read_engine is not None:
+        metrics["db_read_pool"] = pool_metrics(read_engine)
+    return metrics
+
+class _SingleFlightCache:
+    """Holds one computed value for `ttl` seconds. Concurrent misses wait for a single recomputation."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires = 0.0
+        self.generation = 0
+
+    def get(self, compute):
+        if self.value is not None and time.monotonic() < self.expires:
+            return self.value
+        with self.lock:
+            # Another request may have recomputed while we waited
+            if self.value is not None and time.monotonic() < self.expires:
+                return self.value
+            generation = self.generation
+            value = compute()
+            self.value = value
+            # A write that landed during the computation leaves the result uncached
+            if generation == self.generation:
+                self.expires = time.monotonic() + self.ttl
+            return value
+
+    def invalidate(self):
+        self.generation += 1
+        self.expires = 0.0
+
+
+_stats_cache = _SingleFlightCache(STATS_CACHE_TTL_SEC)
+
+def _compute_stats(db: Session) -> dict:
+    """All dashboard counters in a single round trip."""
+    row = db.execute(queries.stats(datetime.now(timezone.utc) - timedelta(days=1))).one()
+    return dict(row._mapping)
+
 @app.get("/stats")
-def get_stats(db: Session = Depends(get_db)):
-    """Aggregate statistics for the dashboard."""
-    total_cameras = db.query(Camera).count()
-    active_cameras = db.query(Camera).filter(Camera.status == DeviceStatus.HEALTHY).count()
-    total_locations = db.query(Location).count()
-    
-    # Spot stats
-    # We need the LATEST observation for every spot
-    # This is slightly expensive, so we might want to optimize with a materialized view later
-    # For now, we fetch all latest observations
-    
-    # Subquery to get max timestamp per spot
-    subquery = db.query(
-        SpotObservation.spot_id,
-        func.max(SpotObservation.timestamp).label('max_ts')
-    ).group_by(SpotObservation.spot_id).subquery()
-    
-    # Join to get the status
-    latest_obs = db.query(SpotObservation).join(
-        subquery,
-        (SpotObservation.spot_id == subquery.c.spot_id) & 
-        (SpotObservation.timestamp == subquery.c.max_ts)
-    ).all()
-    
-    occupied_count = sum(1 for obs in latest_obs if obs.occupied)
-    
-    # Total spots (all configured spots)
-    total_spots = db.query(Spot).count()
-    
-    # Recent events count (last 24h)
-    one_day_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=1)
-    # Note: timestamps in DB might be naive or aware depending on driver. 
-    # Assuming naive UTC for sqlite/postgres usually implies simple comparison.
-    # If using postgres with timestamptz, ensure comp.
-    recent_events = db.query(OccupancyEvent).filter(OccupancyEvent.timestamp >= one_day_ago).count()
-    
+def get_stats(db: Session = Depends(get_read_db)):
+    """Aggregate statistics for the dashboard, cached for STATS_CACHE_TTL_SEC."""
+    return _stats_cache.get(lambda: _compute_stats(db))
+
+# --- Live updates ---
+
+def _live_camera_states(db: Session) -> dict:
+    """Per-camera fields the dashboards display, compared between scans by the live stream."""
+    cameras = db.query(Camera).options(load_only(Camera.id, Camera.status, Camera.last_heartbeat, Camera.last_event_time))\
+        .filter(Camera.deleted_at == None)
     return {
-        "total_cameras": total_cameras,
-        "active_cameras": active_cameras,
-        "total_locations": total_locations,
-        "total_spots": total_spots,
-        "occupied_spots": occupied_count,
-        "recent_events_24h": recent_events
+        str(cam.id): {
+            "id": str(cam.id),
+            "status": _compute_status(cam).value,
+            "last_event_time": _as_aware(cam.last_event_time).isoformat() if cam.last_event_time else None,
+        }
+        for cam in cameras
     }
 
+def _live_stats() -> dict:
+    db = open_read_session()
+    try:
+        return _stats_cache.get(lambda: _compute_stats(db))
+    finally:
+        db.close()
+
+live_hub = LiveHub(engine, open_read_session, _live_camera_states, _live_stats)
+
+@app.get("/stream")
+async def live_stream():
+    """
+    Server-Sent Events for the dashboards (see control_plane/live.py):
+    `changes` (spot state flips, camera status / last event), `stats` (dashboard counters)
+    and `resync` (changes may have been missed; refetch).
+    """
+    try:
+        queue = live_hub.subscribe()
+    except LiveUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        live_hub.events(queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- Analytics & Reporting ---
 
 @app.get("/spots")
-def list_spots(location_id: Optional[uuid.UUID] = None, db: Session = Depends(get_db)):
-    """Return all spots with their latest status and location name."""
-    query = db.query(
-        Spot,
-        Location.name.label('location_name')
-    ).join(Location, Spot.location_id == Location.id)
-    
-    if location_id:
-        query = query.filter(Spot.location_id == location_id)
-        
-    spots_data = query.all()
-    results = []
-    
-    for row in spots_data:
-        spot = row.Spot
-        # Get latest observation
-        latest = db.query(SpotObservation)\
-            .filter(SpotObservation.spot_id == spot.id)\
-            .order_by(SpotObservation.timestamp.desc())\
-            .first()
-            
-        results.append({
-            "id": spot.id,
-            "name": spot.name,
-            "location_id": spot.location_id,
+def list_spots(
+    location_id: Optional[uuid.UUID] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Return spots with their latest status and location name, in one query.
+    
+    - location_id: Optional filter to a specific location.
+    - limit / offset: Optional page, ordered by spot ID (all spots when limit is omitted).
+    """
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "location_id": row.location_id,
             "location_name": row.location_name,
-            "occupied": latest.occupied if latest else False,
-            "last_update": latest.timestamp if latest else None
-        })
-        
-    return results
+            "occupied": bool(row.occupied),
+            "last_update": row.last_seen
+        }
+        for row in queries.spots(db, location_id, offset, limit)
+    ]
 
 @app.get("/spots/{spot_id}/history")
-def get_spot_history_endpoint(spot_id: str, limit: int = 50, db: Session = Depends(get_db)):
-    """Get recent status changes for a specific spot."""
-    history = db.query(SpotObservation)\
-        .filter(SpotObservation.spot_id == spot_id)\
-        .order_by(SpotObservation.timestamp.desc())\
-        .limit(limit)\
-        .all()
+def get_spot_history_endpoint(
+    spot_id: str,
+    request: Request,
+    response: Response,
+    view: str = "observations",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get status changes for a specific spot, newest first.
+    Pass the X-Next-Cursor header of a response as `cursor` to get the next (older) page.
+    
+    - view: 'observations' (default, one row per sample), 'intervals' (one row per state run)
+      or 'events' (one row per event, decoded from the packed spot states; works without spot_observations).
+    - start_date / end_date: Optional range on the sample time (interval start for 'intervals').
+    Rows from deleted cameras are left out; a deleted spot returns 404.
+    """
+    spot = db.query(Spot.deleted_at).filter(Spot.id == spot_id).first()
+    if spot and spot.deleted_at:
+        raise HTTPException(status_code=404, detail="Spot not found")
+    deleted_cameras = queries.deleted_camera_ids(db)
+    
+    if view == "intervals":
+        query = queries.spot_intervals(db, spot_id, deleted_cameras)
+        intervals, next_cursor = _keyset_page(query, SpotStateInterval.start_time, SpotStateInterval.id,
+                                              lambda iv: (iv.start_time, iv.id), cursor, limit, start_date, end_date)
+        _set_next_cursor(request, response, next_cursor)
+        
+        return [
+            {
+                "start_time": iv.start_time,
+                "end_time": iv.end_time,
+                "duration_sec": (iv.end_time - iv.start_time).total_seconds(),
+                "occupied": iv.occupied,
+                "camera_id": iv.camera_id,
+                "observation_count": iv.observation_count,
+                "is_open": iv.is_open
+            }
+            for iv in intervals
+        ]
+    
+    if view == "events":
+        location_id, _, zone_id = spot_id.partition(":")
+        try:
+            location_id = uuid.UUID(location_id)
+        except ValueError:
+            return []
+        # Bit position of the spot in each camera's spot table, across table versions
+        query = queries.spot_events(db, location_id, zone_id)
+        rows, next_cursor = _keyset_page(query, OccupancyEvent.timestamp, OccupancyEvent.id,
+                                         lambda row: (row.timestamp, row.id), cursor, limit, start_date, end_date)
+        _set_next_cursor(request, response, next_cursor)
+        
+        return [
+            {
+                "timestamp": row.timestamp,
+                "occupied": spot_state_at(row.spot_states, row.position),
+                "camera_id": row.camera_id
+            }
+            for row in rows
+        ]
+    
+    query = queries.spot_observations(db, spot_id, deleted_cameras)
+    history, next_cursor = _keyset_page(query, SpotObservation.timestamp, SpotObservation.id,
+                                        lambda obs: (obs.timestamp, obs.id), cursor, limit, start_date, end_date)
+    _set_next_cursor(request, response, next_cursor)
         
     return [
         {
@@ -481,168 +897,537 @@ def get_spot_history_endpoint(spot_id: str, limit: int = 50, db: Session = Depen
 # --- Data Export (Power BI / CSV) ---
 
 from fastapi.responses import StreamingResponse
+from types import SimpleNamespace
 import csv
 import io
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Media type and file extension per export format; every format is streamed batch by batch
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "json": ("application/json", "json"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def _archived_rows(db: Session, table: str, start_date, end_date, filters: dict) -> Iterator[SimpleNamespace]:
+    """
+    Rows from the Parquet archive, one file at a time, newest day first.
+    Archived rows carry ids only, so display names are resolved from the live tables.
+    Rows of deleted spots, locations or cameras are skipped.
+    """
+    names = {"spot": {}, "location": {}, "camera": {}}
+    deleted = set()
+    lookups = {
+        "spot": (Spot, str),
+        "location": (Location, uuid.UUID),
+        "camera": (Camera, uuid.UUID),
+    }
+    for _, archived in iter_archived(db, table, start_date, end_date, filters):
+        for kind, (model, parse) in lookups.items():
+            cache = names[kind]
+            missing = {r[f"{kind}_id"] for r in archived if r.get(f"{kind}_id")} - cache.keys()
+            if missing:
+                found = {row.id: row for row in db.query(model.id, model.name, model.deleted_at)
+                         .filter(model.id.in_({parse(i) for i in missing}))}
+                for i in missing:
+                    row = found.get(parse(i))
+                    cache[i] = row.name if row else None
+                    if row and row.deleted_at:
+                        deleted.add(i)
+        for r in archived:
+            if deleted and any(r.get(f"{kind}_id") in deleted for kind in lookups):
+                continue
+            r["spot_name"] = names["spot"].get(r.get("spot_id"))
+            r["location_name"] = names["location"].get(r.get("location_id"))
+            r["camera_name"] = names["camera"].get(r.get("camera_id"))
+            if "status" in r:
+                r["status"] = DeviceStatus(r["status"]) if r["status"] else None
+            yield SimpleNamespace(**r)
+
+
+def _stream_rows(stmt, to_row: Callable, archive: Optional[tuple] = None) -> Iterator[list]:
+    """
+    Export rows from a server-side cursor, EXPORT_BATCH_ROWS at a time, then from the archive if given.
+    Runs in its own read session, since the response body is produced after the endpoint returns.
+    """
+    db = open_read_session()
+    try:
+        for row in db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_ROWS)):
+            yield to_row(row)
+        if archive:
+            for row in _archived_rows(db, *archive):
+                yield to_row(row)
+    finally:
+        db.close()
+
+
+def _text_value(value):
+    """Render a typed export value for the text formats."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, DeviceStatus):
+        return value.value
+    return value
+
+
+def _encode_text(columns: List[tuple], rows: Iterator[list], format: str) -> Iterator[str]:
+    """Encode export rows as CSV, NDJSON or a JSON array, one text chunk per EXPORT_BATCH_ROWS rows."""
+    names = [name for name, _ in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(names)
+    elif format == "json":
+        buffer.write("[")
+    
+    count = 0
+    for row in rows:
+        values = [_text_value(v) for v in row]
+        if format == "csv":
+            writer.writerow(values)
+        else:
+            if format == "json" and count:
+                buffer.write(",")
+            buffer.write(json.dumps(dict(zip(names, values))))
+            buffer.write("\n")
+        count += 1
+        if count % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if format == "json":
+        buffer.write("]")
+    yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def _arrow_schema(columns: List[tuple]):
+    # Repeated ids and names (spot, location, camera, status) are dictionary-encoded
+    types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "key": pa.dictionary(pa.int32(), pa.string()),
+        "text": pa.string(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _arrow_column(values: list, kind: str, arrow_type):
+    if kind == "timestamp":
+        # SQLite hands back naive datetimes; all stored times are UTC
+        values = [v.replace(tzinfo=timezone.utc) if v is not None and v.tzinfo is None else v for v in values]
+    elif kind in ("key", "text"):
+        values = [None if v is None else str(_text_value(v)) for v in values]
+    if kind == "key":
+        return pa.array(values, pa.string()).dictionary_encode()
+    return pa.array(values, arrow_type)
+
+
+def _encode_arrow(columns: List[tuple], rows: Iterator[list], format: str) -> Iterator[bytes]:
+    """
+    Encode export rows as an Arrow IPC stream or a Parquet file, one record batch
+    (Parquet row group) per EXPORT_BATCH_ROWS rows, sent as soon as it is written.
+    """
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    if format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+        write = writer.write_table
+        make = pa.Table.from_arrays
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+        make = pa.RecordBatch.from_arrays
+    
+    def flush(batch: List[list]):
+        arrays = [
+            _arrow_column([row[i] for row in batch], kind, schema.field(i).type)
+            for i, (_, kind) in enumerate(columns)
+        ]
+        write(make(arrays, schema=schema))
+    
+    batch: List[list] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH_ROWS:
+            flush(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        flush(batch)
+    writer.close()
+    yield sink.drain()
+
+
+def _gzip_chunks(chunks: Iterator) -> Iterator[bytes]:
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header allows gzip, by name or through `*`.
+    A coding listed with q=0 is refused (RFC 9110 section 12.5.3).
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.lower()] = weight
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in weights:
+            return weights[coding] > 0
+    return False
+
+
+def _check_export_format(format: str):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if format in ("parquet", "arrow") and not PYARROW_AVAILABLE:
+        raise HTTPException(status_code=400, detail=f"format '{format}' requires pyarrow, which is not installed")
+
+
+def _export_response(request: Request, columns: List[tuple], rows: Iterator[list], filename: str, format: str):
+    """
+    Stream export rows in the requested format. Text formats and Arrow are gzip-compressed
+    on the fly when the client accepts it; Parquet is compressed per column already.
+    Nothing is buffered beyond one batch, so exports have no row cap.
+    """
+    media_type, extension = EXPORT_FORMATS[format]
+    headers = {"Content-Disposition": f"attachment; filename={filename}.{extension}"}
+    if format in ("parquet", "arrow"):
+        chunks = _encode_arrow(columns, rows, format)
+    else:
+        chunks = _encode_text(columns, rows, format)
+    if format != "parquet":
+        headers["Vary"] = "Accept-Encoding"
+        if _accepts_gzip(request.headers.get("accept-encoding", "")):
+            headers["Content-Encoding"] = "gzip"
+            chunks = _gzip_chunks(chunks)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def _as_aware(ts: Optional[datetime]) -> datetime:
+    if ts is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
 
 @app.get("/analytics/observations")
 def export_observations(
+    request: Request,
     location_id: Optional[uuid.UUID] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    format: str = "csv",
-    db: Session = Depends(get_db)
+    format: str = "csv"
 ):
     """
     Export spot observations with location and spot names for Power BI.
+    Hot rows come first (newest first), followed by archived days.
     
     Parameters:
     - location_id: Optional filter to a specific location.
     - start_date: Optional start of time range (ISO format).
     - end_date: Optional end of time range (ISO format).
-    - format: 'csv' (default) or 'json'.
-    """
-    query = db.query(
-        SpotObservation.id,
-        SpotObservation.timestamp,
-        SpotObservation.occupied,
-        SpotObservation.spot_id,
-        Spot.name.label('spot_name'),
-        Spot.location_id,
-        Location.name.label('location_name'),
-        SpotObservation.camera_id,
-        Camera.name.label('camera_name')
-    ).join(Spot, SpotObservation.spot_id == Spot.id)\
-     .join(Location, Spot.location_id == Location.id)\
-     .join(Camera, SpotObservation.camera_id == Camera.id)
-    
-    if location_id:
-        query = query.filter(Spot.location_id == location_id)
-    if start_date:
-        query = query.filter(SpotObservation.timestamp >= start_date)
-    if end_date:
-        query = query.filter(SpotObservation.timestamp <= end_date)
-    
-    query = query.order_by(SpotObservation.timestamp.desc())
-    
-    # Limit to prevent huge exports (can be adjusted)
-    results = query.limit(100000).all()
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_export_format(format)
+    stmt = queries.export_observations(location_id, start_date, end_date)
+    archive = ("spot_observations", start_date, end_date, {"location_id": str(location_id) if location_id else None})
     
-    if format == "json":
+    columns = [("id", "int"), ("timestamp", "timestamp"), ("occupied", "bool"), ("spot_id", "key"), ("spot_name", "key"),
+               ("location_id", "key"), ("location_name", "key"), ("camera_id", "key"), ("camera_name", "key")]
+    
+    def _row(row):
         return [
-            {
-                "id": row.id,
-                "timestamp": row.timestamp.isoformat() if row.timestamp else None,
-                "occupied": row.occupied,
-                "spot_id": row.spot_id,
-                "spot_name": row.spot_name,
-                "location_id": str(row.location_id),
-                "location_name": row.location_name,
-                "camera_id": str(row.camera_id),
-                "camera_name": row.camera_name
-            }
-            for row in results
+            row.id,
+            row.timestamp,
+            row.occupied,
+            row.spot_id,
+            row.spot_name,
+            row.location_id,
+            row.location_name,
+            row.camera_id,
+            row.camera_name
         ]
     
-    # CSV format
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["id", "timestamp", "occupied", "spot_id", "spot_name", "location_id", "location_name", "camera_id", "camera_name"])
+    return _export_response(request, columns, _stream_rows(stmt, _row, archive), "observations_export", format)
+
+
+@app.get("/analytics/intervals")
+def export_intervals(
+    request: Request,
+    location_id: Optional[uuid.UUID] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: str = "csv"
+):
+    """
+    Export spot state intervals (dwell times) with location and spot names.
     
-    for row in results:
-        writer.writerow([
+    Parameters:
+    - location_id: Optional filter to a specific location.
+    - start_date: Optional start of time range; intervals overlapping the range are included.
+    - end_date: Optional end of time range.
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_export_format(format)
+    stmt = queries.export_intervals(location_id, start_date, end_date)
+    
+    columns = [("id", "int"), ("start_time", "timestamp"), ("end_time", "timestamp"), ("duration_sec", "float"),
+               ("occupied", "bool"), ("observation_count", "int"), ("is_open", "bool"),
+               ("spot_id", "key"), ("spot_name", "key"), ("location_id", "key"), ("location_name", "key"),
+               ("camera_id", "key"), ("camera_name", "key")]
+    
+    def _row(row):
+        return [
             row.id,
-            row.timestamp.isoformat() if row.timestamp else "",
+            row.start_time,
+            row.end_time,
+            (row.end_time - row.start_time).total_seconds(),
             row.occupied,
+            row.observation_count,
+            row.is_open,
             row.spot_id,
             row.spot_name,
-            str(row.location_id),
+            row.location_id,
             row.location_name,
-            str(row.camera_id),
+            row.camera_id,
             row.camera_name
-        ])
+        ]
     
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=observations_export.csv"}
-    )
+    return _export_response(request, columns, _stream_rows(stmt, _row), "intervals_export", format)
+
+
+def _check_granularity(granularity: str):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+
+def _ratio(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+@app.get("/analytics/rollups/spots")
+def export_spot_rollups(
+    request: Request,
+    granularity: str = "hour",
+    location_id: Optional[uuid.UUID] = None,
+    spot_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: str = "csv"
+):
+    """
+    Export hourly or daily occupancy per spot, maintained incrementally by the rollup job.
+    
+    Parameters:
+    - granularity: 'hour' (default) or 'day'.
+    - location_id / spot_id: Optional filters.
+    - start_date / end_date: Optional range on the bucket start.
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_granularity(granularity)
+    _check_export_format(format)
+    stmt = queries.export_spot_rollups(granularity, location_id, spot_id, start_date, end_date)
+    
+    columns = [("bucket_start", "timestamp"), ("granularity", "key"), ("spot_id", "key"), ("spot_name", "key"),
+               ("location_id", "key"), ("location_name", "key"), ("occupied_seconds", "float"), ("observed_seconds", "float"),
+               ("occupancy_ratio", "float"), ("observation_count", "int"), ("flips", "int")]
+    
+    def _row(row):
+        r = row.SpotOccupancyRollup
+        return [
+            r.bucket_start,
+            r.granularity,
+            r.spot_id,
+            row.spot_name,
+            r.location_id,
+            row.location_name,
+            r.occupied_seconds,
+            r.observed_seconds,
+            _ratio(r.occupied_seconds, r.observed_seconds),
+            r.observation_count,
+            r.flips
+        ]
+    
+    return _export_response(request, columns, _stream_rows(stmt, _row), f"spot_rollups_{granularity}", format)
+
+
+@app.get("/analytics/rollups/locations")
+def export_location_rollups(
+    request: Request,
+    granularity: str = "hour",
+    location_id: Optional[uuid.UUID] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: str = "csv"
+):
+    """
+    Export hourly or daily occupancy per location (summed over its spots).
+    
+    Parameters:
+    - granularity: 'hour' (default) or 'day'.
+    - location_id: Optional filter to a specific location.
+    - start_date / end_date: Optional range on the bucket start.
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_granularity(granularity)
+    _check_export_format(format)
+    stmt = queries.export_location_rollups(granularity, location_id, start_date, end_date)
+    
+    columns = [("bucket_start", "timestamp"), ("granularity", "key"), ("location_id", "key"), ("location_name", "key"),
+               ("spot_count", "int"), ("occupied_seconds", "float"), ("observed_seconds", "float"),
+               ("occupancy_ratio", "float"), ("observation_count", "int"), ("flips", "int")]
+    
+    def _row(row):
+        r = row.LocationOccupancyRollup
+        return [
+            r.bucket_start,
+            r.granularity,
+            r.location_id,
+            row.location_name,
+            r.spot_count,
+            r.occupied_seconds,
+            r.observed_seconds,
+            _ratio(r.occupied_seconds, r.observed_seconds),
+            r.observation_count,
+            r.flips
+        ]
+    
+    return _export_response(request, columns, _stream_rows(stmt, _row), f"location_rollups_{granularity}", format)
+
+
+@app.get("/analytics/rollups/cameras")
+def export_camera_rollups(
+    request: Request,
+    granularity: str = "hour",
+    camera_id: Optional[uuid.UUID] = None,
+    location_id: Optional[uuid.UUID] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: str = "csv"
+):
+    """
+    Export hourly or daily occupied_count statistics per camera (from occupancy events).
+    
+    Parameters:
+    - granularity: 'hour' (default) or 'day'.
+    - camera_id / location_id: Optional filters.
+    - start_date / end_date: Optional range on the bucket start.
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_granularity(granularity)
+    _check_export_format(format)
+    stmt = queries.export_camera_rollups(granularity, camera_id, location_id, start_date, end_date)
+    
+    columns = [("bucket_start", "timestamp"), ("granularity", "key"), ("camera_id", "key"), ("camera_name", "key"),
+               ("location_id", "key"), ("event_count", "int"), ("min_occupied", "int"), ("max_occupied", "int"),
+               ("avg_occupied", "float"), ("max_total_slots", "int")]
+    
+    def _row(row):
+        r = row.CameraOccupancyRollup
+        return [
+            r.bucket_start,
+            r.granularity,
+            r.camera_id,
+            row.camera_name,
+            r.location_id,
+            r.event_count,
+            r.min_occupied,
+            r.max_occupied,
+            _ratio(r.sum_occupied, r.event_count),
+            r.max_total_slots
+        ]
+    
+    return _export_response(request, columns, _stream_rows(stmt, _row), f"camera_rollups_{granularity}", format)
 
 
 @app.get("/analytics/health")
 def export_health_history(
+    request: Request,
     camera_id: Optional[uuid.UUID] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    format: str = "csv",
-    db: Session = Depends(get_db)
+    format: str = "csv"
 ):
     """
     Export camera health history for uptime analysis.
+    Hot rows come first (newest first), followed by archived days.
     
     Parameters:
     - camera_id: Optional filter to a specific camera.
     - start_date: Optional start of time range.
     - end_date: Optional end of time range.
-    - format: 'csv' (default) or 'json'.
-    """
-    query = db.query(
-        HealthLog.id,
-        HealthLog.timestamp,
-        HealthLog.status,
-        HealthLog.message,
-        HealthLog.camera_id,
-        Camera.name.label('camera_name'),
-        Location.name.label('location_name')
-    ).join(Camera, HealthLog.camera_id == Camera.id)\
-     .outerjoin(Location, Camera.location_id == Location.id)
-    
-    if camera_id:
-        query = query.filter(HealthLog.camera_id == camera_id)
-    if start_date:
-        query = query.filter(HealthLog.timestamp >= start_date)
-    if end_date:
-        query = query.filter(HealthLog.timestamp <= end_date)
-    
-    query = query.order_by(HealthLog.timestamp.desc())
-    results = query.limit(50000).all()
-    
-    if format == "json":
-        return [
-            {
-                "id": row.id,
-                "timestamp": row.timestamp.isoformat() if row.timestamp else None,
-                "status": row.status.value if row.status else None,
-                "message": row.message,
-                "camera_id": str(row.camera_id),
-                "camera_name": row.camera_name,
-                "location_name": row.location_name
-            }
-            for row in results
-        ]
+    - format: 'csv' (default), 'ndjson', 'json', 'parquet' or 'arrow' (IPC stream).
+    """
+    _check_export_format(format)
+    stmt = queries.export_health(camera_id, start_date, end_date)
+    archive = ("health_logs", start_date, end_date, {"camera_id": str(camera_id) if camera_id else None})
     
-    # CSV format
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["id", "timestamp", "status", "message", "camera_id", "camera_name", "location_name"])
+    columns = [("id", "int"), ("timestamp", "timestamp"), ("status", "key"), ("message", "text"),
+               ("camera_id", "key"), ("camera_name", "key"), ("location_name", "key")]
     
-    for row in results:
-        writer.writerow([
+    def _row(row):
+        return [
             row.id,
-            row.timestamp.isoformat() if row.timestamp else "",
-            row.status.value if row.status else "",
-            row.message or "",
-            str(row.camera_id),
+            row.timestamp,
+            row.status,
+            row.message,
+            row.camera_id,
             row.camera_name,
-            row.location_name or ""
-        ])
+            row.location_name
+        ]
     
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=health_export.csv"}
-    )
+    return _export_response(request, columns, _stream_rows(stmt, _row, archive), "health_export", format)
 
 if __name__ == "__main__":
     import uvicorn
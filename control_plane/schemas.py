@@ -96,3 +96,19 @@ class CaptureFrameResponse(BaseModel):
     image_base64: str
     width: int
     height: int
+
+class PurgeJobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    entity_type: str
+    entity_id: str
+    spot_ids: Optional[List[str]] = None
+    status: str
+    step: Optional[str] = None
+    rows_deleted: int
+    progress: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
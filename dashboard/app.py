@@ -49,7 +49,7 @@ def get_cameras():
 
 def get_events():
     try:
-        response = requests.get(f"{CONTROL_PLANE_URL}/events", params={"limit": 100}, timeout=2)
+        response = requests.get(f"{CONTROL_PLANE_URL}/events", params={"limit": 100, "view": "slim"}, timeout=2)
         if response.status_code == 200:
             return response.json()
     except Exception as e:
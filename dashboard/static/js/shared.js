@@ -124,8 +124,12 @@ async function getLocationStatus(locationId) {
     return await apiRequest(`/locations/${locationId}/status`);
 }
 
-async function getEvents(limit = 100) {
-    return await apiRequest(`/events?limit=${limit}`);
+async function getEvents(limit = 100, view = 'slim') {
+    return await apiRequest(`/events?limit=${limit}&view=${view}`);
+}
+
+async function getEvent(eventId) {
+    return await apiRequest(`/events/${eventId}`);
 }
 
 async function updateCamera(cameraId, data) {
@@ -152,6 +156,17 @@ async function getCameraSnapshot(cameraId) {
     return await apiRequest(`/cameras/${cameraId}/snapshot`);
 }
 
+/**
+ * Live frame as a JPEG blob, fetched through the browser HTTP cache
+ * (the server sends max-age and ETag, so repeat requests are cheap)
+ */
+async function getCameraSnapshotJpeg(cameraId, width = null) {
+    const query = width ? `?width=${width}` : '';
+    const response = await fetch(`${CONTROL_PLANE_URL}/cameras/${cameraId}/snapshot.jpg${query}`);
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    return { blob: await response.blob(), etag: response.headers.get('ETag') };
+}
+
 async function captureFrame(streamUrl) {
     return await apiRequest('/cameras/capture-frame', {
         method: 'POST',
@@ -270,20 +285,86 @@ function initTabs() {
     });
 }
 
+// ============================================
+// Live Updates (Server-Sent Events)
+// ============================================
+
+/**
+ * Subscribes to the control plane's /stream. Events:
+ * - changes: { spots: [{ spot_id, location_id, camera_id, occupied, since }], cameras: [{ id, status, last_event_time }] }
+ * - stats: same shape as GET /stats
+ * - resync: changes may have been missed (reconnect or backlog); refetch
+ */
+class LiveFeed {
+    constructor() {
+        this.handlers = { changes: [], stats: [], resync: [] };
+        this.source = null;
+        this.connected = false;
+        this.everConnected = false;
+    }
+
+    on(type, handler) {
+        this.handlers[type].push(handler);
+        this.connect();
+        return this;
+    }
+
+    emit(type, data) {
+        this.handlers[type].forEach(handler => {
+            try { handler(data); } catch (e) { console.error(`Live ${type} handler failed:`, e); }
+        });
+    }
+
+    connect() {
+        if (this.source || typeof EventSource === 'undefined') return;
+        this.source = new EventSource(`${CONTROL_PLANE_URL}/stream`);
+        this.source.onopen = () => {
+            this.connected = true;
+            // Anything that changed while disconnected was not pushed
+            if (this.everConnected) this.emit('resync');
+            this.everConnected = true;
+        };
+        this.source.onerror = () => { this.connected = false; }; // EventSource reconnects by itself
+        this.source.addEventListener('changes', e => this.emit('changes', JSON.parse(e.data)));
+        this.source.addEventListener('stats', e => this.emit('stats', JSON.parse(e.data)));
+        this.source.addEventListener('resync', () => this.emit('resync'));
+    }
+}
+
+const liveFeed = new LiveFeed();
+
 // ============================================
 // Auto-Refresh Manager
 // ============================================
 
+// While the live feed is connected, pushed changes keep pages current; polling is only a safety net
+const LIVE_FALLBACK_POLL_MS = 120000;
+
 class AutoRefresh {
-    constructor(callback, intervalMs = 10000) {
+    /**
+     * With { live: true }, the callback also runs on liveFeed `resync`, and interval polling
+     * drops to LIVE_FALLBACK_POLL_MS while the feed is connected
+     */
+    constructor(callback, intervalMs = 10000, { live = false } = {}) {
         this.callback = callback;
         this.intervalMs = intervalMs;
+        this.live = live;
         this.intervalId = null;
+        this.lastRun = 0;
+    }
+
+    run() {
+        this.lastRun = Date.now();
+        this.callback();
     }
 
     start() {
-        this.callback(); // Initial load
-        this.intervalId = setInterval(() => this.callback(), this.intervalMs);
+        this.run(); // Initial load
+        if (this.live) liveFeed.on('resync', () => this.run());
+        this.intervalId = setInterval(() => {
+            if (this.live && liveFeed.connected && Date.now() - this.lastRun < LIVE_FALLBACK_POLL_MS) return;
+            this.run();
+        }, this.intervalMs);
     }
 
     stop() {
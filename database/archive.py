@@ -0,0 +1,392 @@
+"""
+Columnar cold storage: moves old history out of the database into Parquet files.
+
+Each run archives whole UTC days older than the table's ARCHIVE_AFTER_DAYS_*
+threshold. One file per table per day is written to ARCHIVE_DIR, sorted by
+(location, spot or camera, timestamp) and compressed with ARCHIVE_COMPRESSION.
+Rows are streamed into the file in batches of ARCHIVE_BATCH_ROWS. The file is
+recorded in `archive_manifest`, then exactly the rows written are deleted by
+id in batches; rows that arrive late for an archived day go into an additional
+part file. On PostgreSQL, partitions that lie entirely before the cutoff are
+written day by day and then dropped whole. Raw events and observations are
+only archived once the hourly rollups cover them.
+
+`read_archived()` and `iter_archived()` (one file at a time, for streaming)
+let the analytics exports read across the hot database and the archive.
+Requires pyarrow; without it archiving is disabled and reads return nothing.
+
+Run once:   python -m database.archive [--table spot_observations]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from array import array
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import partitions
+from database.models import ArchiveManifest, Camera, HealthLog, OccupancyEvent, Spot, SpotObservation
+from database.rollups import HOUR, watermark
+
+# Configuration from Environment
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/data/archive")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+ARCHIVE_MAX_DAYS_PER_RUN = int(os.getenv("ARCHIVE_MAX_DAYS_PER_RUN", "31"))
+# Rows fetched per round trip while writing a file, and deleted per transaction afterwards
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "50000"))
+ARCHIVE_DELETE_BATCH_ROWS = int(os.getenv("ARCHIVE_DELETE_BATCH_ROWS", "5000"))
+# Age in days after which rows move to the archive; 0 keeps the table fully in the database
+ARCHIVE_AFTER_DAYS = {
+    "spot_observations": int(os.getenv("ARCHIVE_AFTER_DAYS_SPOT_OBSERVATIONS", "0")),
+    "occupancy_events": int(os.getenv("ARCHIVE_AFTER_DAYS_OCCUPANCY_EVENTS", "0")),
+    "health_logs": int(os.getenv("ARCHIVE_AFTER_DAYS_HEALTH_LOGS", "0")),
+}
+
+ARCHIVED_TABLES = list(ARCHIVE_AFTER_DAYS)
+# Tables whose raw rows feed the hourly rollups and must not be archived ahead of them
+ROLLUP_SOURCES = {"spot_observations", "occupancy_events"}
+
+
+def _as_utc(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def _uuid(value) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+# --- Table layouts: select (sorted for the file), column types, row conversion ---
+
+def _observations(db: Session, w0: datetime, w1: datetime):
+    return db.query(
+        SpotObservation.id, SpotObservation.timestamp, Spot.location_id, SpotObservation.spot_id,
+        SpotObservation.camera_id, SpotObservation.occupied,
+    ).outerjoin(Spot, SpotObservation.spot_id == Spot.id)\
+     .filter(SpotObservation.timestamp >= w0, SpotObservation.timestamp < w1)\
+     .order_by(Spot.location_id, SpotObservation.spot_id, SpotObservation.timestamp)
+
+
+def _events(db: Session, w0: datetime, w1: datetime):
+    return db.query(
+        OccupancyEvent.id, OccupancyEvent.timestamp, Camera.location_id, OccupancyEvent.camera_id,
+        OccupancyEvent.occupied_count, OccupancyEvent.free_count, OccupancyEvent.total_slots, OccupancyEvent.metadata_json,
+        OccupancyEvent.spot_table_version, OccupancyEvent.spot_states,
+    ).outerjoin(Camera, OccupancyEvent.camera_id == Camera.id)\
+     .filter(OccupancyEvent.timestamp >= w0, OccupancyEvent.timestamp < w1)\
+     .order_by(Camera.location_id, OccupancyEvent.camera_id, OccupancyEvent.timestamp)
+
+
+def _health(db: Session, w0: datetime, w1: datetime):
+    return db.query(
+        HealthLog.id, HealthLog.timestamp, Camera.location_id, HealthLog.camera_id, HealthLog.status, HealthLog.message,
+    ).outerjoin(Camera, HealthLog.camera_id == Camera.id)\
+     .filter(HealthLog.timestamp >= w0, HealthLog.timestamp < w1)\
+     .order_by(Camera.location_id, HealthLog.camera_id, HealthLog.timestamp)
+
+
+LAYOUTS = {
+    "spot_observations": {
+        "model": SpotObservation,
+        "select": _observations,
+        "columns": ["id", "timestamp", "location_id", "spot_id", "camera_id", "occupied"],
+        "convert": lambda r: [r.id, _as_utc(r.timestamp), _uuid(r.location_id), r.spot_id, _uuid(r.camera_id), r.occupied],
+    },
+    "occupancy_events": {
+        "model": OccupancyEvent,
+        "select": _events,
+        "columns": ["id", "timestamp", "location_id", "camera_id", "occupied_count", "free_count", "total_slots", "metadata_json",
+                    "spot_table_version", "spot_states"],
+        "convert": lambda r: [r.id, _as_utc(r.timestamp), _uuid(r.location_id), _uuid(r.camera_id), r.occupied_count,
+                              r.free_count, r.total_slots, json.dumps(r.metadata_json) if r.metadata_json is not None else None,
+                              r.spot_table_version, r.spot_states],
+    },
+    "health_logs": {
+        "model": HealthLog,
+        "select": _health,
+        "columns": ["id", "timestamp", "location_id", "camera_id", "status", "message"],
+        "convert": lambda r: [r.id, _as_utc(r.timestamp), _uuid(r.location_id), _uuid(r.camera_id),
+                              r.status.value if r.status else None, r.message],
+    },
+}
+
+
+def _schema(table: str):
+    types = {
+        "id": pa.int64(), "timestamp": pa.timestamp("us", tz="UTC"), "location_id": pa.string(), "spot_id": pa.string(),
+        "camera_id": pa.string(), "occupied": pa.bool_(), "occupied_count": pa.int32(), "free_count": pa.int32(),
+        "total_slots": pa.int32(), "metadata_json": pa.string(), "status": pa.string(), "message": pa.string(),
+        "spot_table_version": pa.int64(), "spot_states": pa.binary(),
+    }
+    return pa.schema([(name, types[name]) for name in LAYOUTS[table]["columns"]])
+
+
+# --- Writing ---
+
+def _relative_path(db: Session, table: str, day: datetime) -> str:
+    base = f"{table}/{day:%Y}/{table}_{day:%Y%m%d}"
+    parts = db.query(func.count(ArchiveManifest.id))\
+        .filter(ArchiveManifest.table_name == table, ArchiveManifest.range_start == day).scalar()
+    return f"{base}.parquet" if not parts else f"{base}_part{parts + 1}.parquet"
+
+
+def _write_day(db: Session, table: str, day: datetime, path: str) -> Tuple[int, "array"]:
+    """Stream one day of `table` into a Parquet file at `path`. Returns the file size and the ids written."""
+    layout = LAYOUTS[table]
+    schema = _schema(table)
+    query = layout["select"](db, day, day + timedelta(days=1)).statement
+    ids = array("q")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        with pq.ParquetWriter(tmp, schema, compression=ARCHIVE_COMPRESSION) as writer:
+            for batch in db.execute(query, execution_options={"yield_per": ARCHIVE_BATCH_ROWS}).partitions():
+                columns = list(zip(*(layout["convert"](r) for r in batch)))
+                writer.write_table(pa.table(dict(zip(layout["columns"], map(list, columns))), schema=schema))
+                ids.extend(columns[0])
+        if not ids:
+            os.unlink(tmp)
+            return 0, ids
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return os.path.getsize(path), ids
+
+
+def _unfinished_ids(db: Session, table: str, day: datetime) -> "array":
+    """Ids of rows still in the database that the day's files already hold, left by a run stopped before its deletes."""
+    archived: Dict[int, datetime] = {}
+    for entry in db.query(ArchiveManifest).filter(ArchiveManifest.table_name == table, ArchiveManifest.range_start == day):
+        path = os.path.join(ARCHIVE_DIR, entry.path)
+        if os.path.exists(path):
+            data = pq.read_table(path, columns=["id", "timestamp"])
+            archived.update(zip(data.column("id").to_pylist(), data.column("timestamp").to_pylist()))
+    ids = array("q")
+    if not archived:
+        return ids
+    model = LAYOUTS[table]["model"]
+    rows = db.query(model.id, model.timestamp).filter(model.timestamp >= day, model.timestamp < day + timedelta(days=1))
+    # Matching the timestamp too keeps a reused id (SQLite) from deleting a late row
+    ids.extend(row.id for row in rows.yield_per(ARCHIVE_BATCH_ROWS) if archived.get(row.id) == _as_utc(row.timestamp))
+    return ids
+
+
+def _delete_ids(db: Session, model, day: datetime, ids) -> int:
+    """Delete the rows with these ids from `day`, one committed batch at a time."""
+    ids = sorted(ids)
+    deleted = 0
+    for i in range(0, len(ids), ARCHIVE_DELETE_BATCH_ROWS):
+        batch = ids[i:i + ARCHIVE_DELETE_BATCH_ROWS]
+        # The time range keeps each batch within the day's partition
+        deleted += db.query(model).filter(model.timestamp >= day, model.timestamp < day + timedelta(days=1),
+                                          model.id.in_(batch)).delete(synchronize_session=False)
+        db.commit()
+    return deleted
+
+
+def _archivable_partitions(db: Session, table: str, cutoff: datetime) -> List[partitions.Partition]:
+    """Range partitions of `table` that lie entirely before the cutoff (PostgreSQL only)."""
+    bind = db.get_bind()
+    if not partitions.enabled(bind):
+        return []
+    return [p for p in partitions.list_partitions(bind, table) if p.end is not None and p.end <= cutoff]
+
+
+def _archive_partition(db: Session, table: str, partition: partitions.Partition) -> Dict[str, int]:
+    """Write every day of a partition to files, then detach and drop it instead of deleting its rows."""
+    written = []
+    rows_archived = 0
+    try:
+        # Late writes into the partition wait until it is gone, so no row is dropped unarchived
+        db.execute(text(f"LOCK TABLE {partition.name} IN SHARE MODE"))
+        day = partition.start
+        while day < partition.end:
+            relative = _relative_path(db, table, day)
+            path = os.path.join(ARCHIVE_DIR, relative)
+            size, ids = _write_day(db, table, day, path)
+            if ids:
+                written.append(path)
+                db.add(ArchiveManifest(table_name=table, range_start=day, range_end=day + timedelta(days=1),
+                                       path=relative, row_count=len(ids), file_bytes=size))
+                rows_archived += len(ids)
+            day += timedelta(days=1)
+        db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition.name}"))
+        db.execute(text(f"DROP TABLE {partition.name}"))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        # The manifest rows were rolled back, so nothing references these files
+        for path in written:
+            os.unlink(path)
+        raise
+    return {"files": len(written), "rows": rows_archived}
+
+
+def archive_table(db: Session, table: str, days: Optional[int] = None, limit: int = ARCHIVE_MAX_DAYS_PER_RUN) -> Dict[str, int]:
+    """
+    Archive whole days of `table` older than its threshold. Returns files and rows written.
+    Partitions that lie entirely before the cutoff are archived and dropped whole (PostgreSQL);
+    other days are written to a file and their rows deleted by id.
+    """
+    days = ARCHIVE_AFTER_DAYS[table] if days is None else days
+    if days <= 0 or not PYARROW_AVAILABLE:
+        return {"files": 0, "rows": 0}
+
+    model = LAYOUTS[table]["model"]
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    if table in ROLLUP_SOURCES:
+        mark = watermark(db, HOUR)
+        if mark is None:
+            # Nothing is rolled up yet; archived rows would never be
+            return {"files": 0, "rows": 0}
+        cutoff = min(cutoff, mark)
+    cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    files = rows_archived = 0
+    for partition in _archivable_partitions(db, table, cutoff):
+        if files >= limit:
+            break
+        result = _archive_partition(db, table, partition)
+        files += result["files"]
+        rows_archived += result["rows"]
+
+    while files < limit:
+        # Archived rows are deleted, so the oldest remaining row is always the next day to archive
+        first = db.query(func.min(model.timestamp)).filter(model.timestamp < cutoff).scalar()
+        if first is None:
+            break
+        day = _as_utc(first).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # Finish the deletes of a run that stopped after writing the day's file
+        if _delete_ids(db, model, day, _unfinished_ids(db, table, day)):
+            continue
+
+        relative = _relative_path(db, table, day)
+        size, ids = _write_day(db, table, day, os.path.join(ARCHIVE_DIR, relative))
+        if not ids:
+            continue
+        # The file is durable before the manifest; a failure here leaves a file the manifest never references
+        db.add(ArchiveManifest(table_name=table, range_start=day, range_end=day + timedelta(days=1), path=relative,
+                               row_count=len(ids), file_bytes=size))
+        db.commit()
+        # Only the rows written are deleted; rows that arrived meanwhile go into the day's next part file
+        _delete_ids(db, model, day, ids)
+        files += 1
+        rows_archived += len(ids)
+    return {"files": files, "rows": rows_archived}
+
+
+def run(db: Session, tables=ARCHIVED_TABLES) -> Dict[str, Dict[str, int]]:
+    return {table: archive_table(db, table) for table in tables}
+
+
+def archived_through(db: Session, table: str) -> datetime:
+    """Time before which the archive has copied every row of `table`, for jobs that remove history."""
+    through = db.query(func.max(ArchiveManifest.range_end)).filter(ArchiveManifest.table_name == table).scalar()
+    if through is None:
+        return datetime.fromtimestamp(0, tz=timezone.utc)
+    # Late rows for an archived day wait for the archive's next part file
+    model = LAYOUTS[table]["model"]
+    due = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS[table])
+    pending = db.query(func.min(model.timestamp)).filter(model.timestamp < due).scalar()
+    return min(_as_utc(through), _as_utc(pending)) if pending is not None else _as_utc(through)
+
+
+# --- Reading ---
+
+def iter_archived(
+    db: Session,
+    table: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[datetime, List[Dict[str, Any]]]]:
+    """
+    (day, rows) for each archive file of `table` overlapping [start, end], newest day first.
+    Only one file is held in memory at a time.
+    `filters` are equality filters on archived columns (e.g. {"location_id": "..."}).
+    """
+    if not PYARROW_AVAILABLE:
+        return
+
+    query = db.query(ArchiveManifest).filter(ArchiveManifest.table_name == table)
+    if start:
+        query = query.filter(ArchiveManifest.range_end > start)
+    if end:
+        query = query.filter(ArchiveManifest.range_start <= end)
+
+    predicates = [(column, "==", value) for column, value in (filters or {}).items() if value is not None]
+    if start:
+        predicates.append(("timestamp", ">=", _as_utc(start)))
+    if end:
+        predicates.append(("timestamp", "<=", _as_utc(end)))
+
+    for entry in query.order_by(ArchiveManifest.range_start.desc(), ArchiveManifest.id.desc()).all():
+        path = os.path.join(ARCHIVE_DIR, entry.path)
+        if not os.path.exists(path):
+            print(f"Archive file missing: {entry.path}")
+            continue
+        data = pq.read_table(path, filters=predicates or None)
+        yield entry.range_start, data.sort_by([("timestamp", "descending")]).to_pylist()
+
+
+def read_archived(
+    db: Session,
+    table: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Rows of `table` from archive files overlapping [start, end], newest day first.
+    `filters` are equality filters on archived columns (e.g. {"location_id": "..."}).
+    """
+    rows: List[Dict[str, Any]] = []
+    last_day = None
+    for day, part in iter_archived(db, table, start, end, filters):
+        # Stop only between days so every part of the last day read is included
+        if limit is not None and len(rows) >= limit and day != last_day:
+            break
+        rows.extend(part)
+        last_day = day
+    return rows
+
+
+def main():
+    from database.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move old history into Parquet files")
+    parser.add_argument("--table", action="append", choices=ARCHIVED_TABLES, help="Archive only this table (repeatable)")
+    args = parser.parse_args()
+
+    if not PYARROW_AVAILABLE:
+        sys.exit("pyarrow is not installed; archiving is unavailable")
+
+    db = SessionLocal()
+    try:
+        for table, result in run(db, args.table or ARCHIVED_TABLES).items():
+            print(f"{table}: {result['files']} files, {result['rows']} rows archived")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
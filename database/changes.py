@@ -0,0 +1,84 @@
+"""
+Change notifications from ingest to the Control Plane's live stream (`GET /stream`).
+
+On Postgres, ingest publishes spot state flips and reported camera status changes
+with `pg_notify` inside the write transaction. They are delivered when it commits,
+and not at all if it rolls back. Each NOTIFY runs in a savepoint, so a failing
+notification is dropped without rolling back the telemetry. The Control Plane LISTENs on CHANGES_CHANNEL and
+fans them out to dashboard viewers. Other databases have no notification bus;
+there the Control Plane polls `spot_current_state` instead (see control_plane/live.py).
+
+Payloads are compact JSON, split by encoded size to stay under Postgres' 8000-byte
+NOTIFY limit:
+    {"type": "spots", "camera_id": ..., "location_id": ..., "timestamp": ..., "changes": [[spot_id, occupied], ...]}
+    {"type": "camera", "camera_id": ..., "status": ...}
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Any, Iterable, List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+# Configuration from Environment
+PUBLISH_CHANGES = os.getenv("PUBLISH_CHANGES", "true").lower() == "true"
+
+CHANGES_CHANNEL = "parking_changes"
+# Encoded payload size per notification, below Postgres' 8000-byte limit
+NOTIFY_MAX_BYTES = 7900
+
+
+def notifications_supported(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def _encode(value: Any) -> str:
+    # ASCII-only (non-ASCII is escaped), so the length in characters is the length in bytes
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _notify(db: Session, payload: str):
+    """NOTIFY in a savepoint: a failure is logged and dropped, the caller's transaction carries on."""
+    try:
+        with db.begin_nested():
+            db.execute(select(func.pg_notify(CHANGES_CHANNEL, payload)))
+    except Exception as e:
+        print(f"Change notification dropped: {e}")
+
+
+def publish_spot_changes(db: Session, camera_id, location_id, timestamp: datetime, changes: Iterable[Tuple[str, bool]]):
+    """Queue a notification of spot state flips; sent when `db` commits."""
+    if not PUBLISH_CHANGES or not notifications_supported(db.get_bind()):
+        return
+    envelope = _encode({
+        "type": "spots",
+        "camera_id": str(camera_id),
+        "location_id": str(location_id),
+        "timestamp": timestamp.isoformat(),
+        "changes": [],
+    })
+    head, tail = envelope[:-2], "]}"  # Splice the changes into the empty list
+    budget = NOTIFY_MAX_BYTES - len(head) - len(tail)
+    chunk: List[str] = []
+    size = 0
+    for change in changes:
+        item = _encode(list(change))
+        if len(item) > budget:
+            print(f"Change notification for spot {change[0][:80]!r}... exceeds {NOTIFY_MAX_BYTES} bytes; skipped")
+            continue
+        if chunk and size + 1 + len(item) > budget:
+            _notify(db, head + ",".join(chunk) + tail)
+            chunk, size = [], 0
+        size += len(item) + (1 if chunk else 0)
+        chunk.append(item)
+    if chunk:
+        _notify(db, head + ",".join(chunk) + tail)
+
+
+def publish_camera_status(db: Session, camera_id, status: str):
+    """Queue a notification that a camera reported a new status; sent when `db` commits."""
+    if not PUBLISH_CHANGES or not notifications_supported(db.get_bind()):
+        return
+    _notify(db, _encode({"type": "camera", "camera_id": str(camera_id), "status": status}))
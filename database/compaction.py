@@ -0,0 +1,286 @@
+"""
+Compaction of historical telemetry into cheaper long-term forms.
+
+Tiers, each enabled by an age threshold in days (0 disables the tier):
+
+1. strip-metadata   COMPACT_METADATA_AFTER_DAYS   clear occupancy_events.metadata_json
+                                                  (spot states live on in the spot tables,
+                                                  snapshot blobs expire in the snapshot store)
+2. event-summaries  COMPACT_EVENTS_AFTER_DAYS     fold occupancy_events into fixed-width
+                                                  occupancy_event_summaries buckets
+3. health-intervals COMPACT_HEALTH_AFTER_DAYS     collapse health_logs runs into
+                                                  health_status_intervals
+
+Work is done one window at a time, oldest first, each in its own transaction.
+When database/archive.py archives a table, its tiers never pass the archive's
+progress, so rows are archived with their metadata and spot states before they
+are rewritten.
+On PostgreSQL the freed space is reused after autovacuum; only dropping
+partitions (database/partitions.py) returns it to the OS.
+
+Run once:   python -m database.compaction [--dry-run] [--tier event-summaries]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Integer, cast, func, literal_column, null
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import archive
+from database.models import HealthLog, HealthStatusInterval, OccupancyEvent, OccupancyEventSummary
+from database.rollups import HOUR, watermark
+
+# Configuration from Environment
+COMPACT_METADATA_AFTER_DAYS = int(os.getenv("COMPACT_METADATA_AFTER_DAYS", "0"))
+COMPACT_EVENTS_AFTER_DAYS = int(os.getenv("COMPACT_EVENTS_AFTER_DAYS", "0"))
+COMPACT_EVENT_BUCKET_SEC = int(os.getenv("COMPACT_EVENT_BUCKET_SEC", "60"))
+COMPACT_HEALTH_AFTER_DAYS = int(os.getenv("COMPACT_HEALTH_AFTER_DAYS", "0"))
+# Heartbeats further apart than this start a new status interval even if the status is unchanged
+COMPACT_HEALTH_MAX_GAP_SEC = int(os.getenv("COMPACT_HEALTH_MAX_GAP_SEC", "300"))
+COMPACT_MAX_WINDOWS_PER_RUN = int(os.getenv("COMPACT_MAX_WINDOWS_PER_RUN", "168"))
+
+STRIP_METADATA = "strip-metadata"
+EVENT_SUMMARIES = "event-summaries"
+HEALTH_INTERVALS = "health-intervals"
+TIERS = (STRIP_METADATA, EVENT_SUMMARIES, HEALTH_INTERVALS)
+
+# Rough on-disk size of one summary/interval row, used to net out dry-run estimates
+_COMPACT_ROW_BYTES = 64
+
+
+class TierResult(NamedTuple):
+    tier: str
+    rows: int      # Source rows rewritten or removed
+    bytes: int     # Estimated bytes reclaimed
+    windows: int   # Windows that held data (0 for a dry run)
+
+
+def _as_utc(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _bytes(db: Session, model, column=None, *criteria) -> int:
+    """Payload bytes of matching rows (or of one column): exact on PostgreSQL, estimated elsewhere."""
+    if _is_postgres(db):
+        expr = func.pg_column_size(column if column is not None else literal_column(f"{model.__tablename__}.*"))
+    else:
+        columns = [column] if column is not None else list(model.__table__.columns)
+        expr = sum(func.coalesce(func.length(c), 0) for c in columns)
+    return int(db.query(func.coalesce(func.sum(expr), 0)).select_from(model).filter(*criteria).scalar())
+
+
+def _cutoff(db: Session, days: int, respect_rollups: bool = False, archived=None) -> datetime:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    if respect_rollups:
+        # Never remove raw events that the hourly rollups have not consumed yet (none, before their first run)
+        mark = watermark(db, HOUR)
+        cutoff = min(cutoff, mark) if mark is not None else datetime.fromtimestamp(0, tz=timezone.utc)
+    if archived is not None and archive.ARCHIVE_AFTER_DAYS[archived.__tablename__] > 0:
+        # Never rewrite rows the archive has not copied yet
+        cutoff = min(cutoff, archive.archived_through(db, archived.__tablename__))
+    return cutoff
+
+
+def _windows(first: Optional[datetime], cutoff: datetime, width: int, limit: int) -> List[Tuple[datetime, datetime]]:
+    """Epoch-aligned windows of `width` seconds from `first` that end before the cutoff."""
+    if first is None:
+        return []
+    epoch = int(_as_utc(first).timestamp())
+    start = datetime.fromtimestamp(epoch - epoch % width, tz=timezone.utc)
+    windows = []
+    while len(windows) < limit and start + timedelta(seconds=width) <= cutoff:
+        windows.append((start, start + timedelta(seconds=width)))
+        start += timedelta(seconds=width)
+    return windows
+
+
+# --- Tier 1: strip metadata ---
+
+def strip_metadata(db: Session, days: int = COMPACT_METADATA_AFTER_DAYS, dry_run: bool = False) -> TierResult:
+    if days <= 0:
+        return TierResult(STRIP_METADATA, 0, 0, 0)
+    cutoff = _cutoff(db, days, archived=OccupancyEvent)
+    criteria = (OccupancyEvent.timestamp < cutoff, OccupancyEvent.metadata_json.isnot(None))
+
+    rows = db.query(func.count(OccupancyEvent.id)).filter(*criteria).scalar()
+    reclaimed = _bytes(db, OccupancyEvent, OccupancyEvent.metadata_json, *criteria)
+    if dry_run or not rows:
+        return TierResult(STRIP_METADATA, rows, reclaimed, 0)
+
+    windows = _windows(db.query(func.min(OccupancyEvent.timestamp)).filter(*criteria).scalar(),
+                       cutoff, 86400, COMPACT_MAX_WINDOWS_PER_RUN)
+    for w0, w1 in windows:
+        db.query(OccupancyEvent).filter(*criteria, OccupancyEvent.timestamp >= w0, OccupancyEvent.timestamp < w1)\
+            .update({OccupancyEvent.metadata_json: null()}, synchronize_session=False)
+        db.commit()
+    return TierResult(STRIP_METADATA, rows, reclaimed, len(windows))
+
+
+# --- Tier 2: event summaries ---
+
+def _bucket_epoch(db: Session, column, seconds: int):
+    """SQL expression for the epoch second at which a row's bucket starts."""
+    if _is_postgres(db):
+        return func.floor(func.date_part("epoch", column) / seconds) * seconds
+    return cast(func.strftime("%s", column), Integer) // seconds * seconds
+
+
+def summarize_events(db: Session, days: int = COMPACT_EVENTS_AFTER_DAYS, bucket_sec: int = COMPACT_EVENT_BUCKET_SEC,
+                     dry_run: bool = False) -> TierResult:
+    if days <= 0:
+        return TierResult(EVENT_SUMMARIES, 0, 0, 0)
+    cutoff = _cutoff(db, days, respect_rollups=True, archived=OccupancyEvent)
+    # Windows are whole multiples of the bucket so no bucket straddles two windows
+    width = bucket_sec * max(1, 3600 // bucket_sec)
+    cutoff = datetime.fromtimestamp(int(cutoff.timestamp()) // width * width, tz=timezone.utc)
+    old = OccupancyEvent.timestamp < cutoff
+    bucket = _bucket_epoch(db, OccupancyEvent.timestamp, bucket_sec)
+
+    if dry_run:
+        rows = db.query(func.count(OccupancyEvent.id)).filter(old).scalar()
+        buckets = db.query(OccupancyEvent.camera_id, bucket).filter(old).distinct().count() if rows else 0
+        reclaimed = _bytes(db, OccupancyEvent, None, old) - buckets * _COMPACT_ROW_BYTES
+        return TierResult(EVENT_SUMMARIES, rows, max(reclaimed, 0), 0)
+
+    windows = _windows(db.query(func.min(OccupancyEvent.timestamp)).scalar(), cutoff, width, COMPACT_MAX_WINDOWS_PER_RUN)
+    rows = reclaimed = compacted = 0
+    for w0, w1 in windows:
+        in_window = (OccupancyEvent.timestamp >= w0, OccupancyEvent.timestamp < w1)
+        groups = db.query(
+            OccupancyEvent.camera_id,
+            bucket.label("bucket"),
+            func.count(OccupancyEvent.id),
+            func.min(OccupancyEvent.occupied_count),
+            func.max(OccupancyEvent.occupied_count),
+            func.sum(OccupancyEvent.occupied_count),
+            func.max(OccupancyEvent.total_slots),
+        ).filter(*in_window).group_by(OccupancyEvent.camera_id, bucket).all()
+        if not groups:
+            continue
+
+        # Merge with summaries already written for this window (late events compacted in a later run)
+        existing = {
+            (s.camera_id, _as_utc(s.bucket_start)): s
+            for s in db.query(OccupancyEventSummary).filter(
+                OccupancyEventSummary.bucket_start >= w0, OccupancyEventSummary.bucket_start < w1)
+        }
+        for camera_id, epoch, count, lo, hi, total, slots in groups:
+            start = datetime.fromtimestamp(int(epoch), tz=timezone.utc)
+            summary = existing.get((camera_id, start))
+            if summary is None:
+                db.add(OccupancyEventSummary(
+                    camera_id=camera_id, bucket_start=start, bucket_seconds=bucket_sec, event_count=count,
+                    min_occupied=lo, max_occupied=hi, sum_occupied=total, max_total_slots=slots,
+                ))
+            else:
+                summary.event_count += count
+                summary.min_occupied = min(summary.min_occupied, lo)
+                summary.max_occupied = max(summary.max_occupied, hi)
+                summary.sum_occupied += total
+                summary.max_total_slots = max(summary.max_total_slots, slots)
+
+        window_bytes = _bytes(db, OccupancyEvent, None, *in_window)
+        deleted = db.query(OccupancyEvent).filter(*in_window).delete(synchronize_session=False)
+        db.commit()
+        rows += deleted
+        reclaimed += max(window_bytes - len(groups) * _COMPACT_ROW_BYTES, 0)
+        compacted += 1
+    return TierResult(EVENT_SUMMARIES, rows, reclaimed, compacted)
+
+
+# --- Tier 3: health intervals ---
+
+def collapse_health_logs(db: Session, days: int = COMPACT_HEALTH_AFTER_DAYS, max_gap_sec: int = COMPACT_HEALTH_MAX_GAP_SEC,
+                         dry_run: bool = False) -> TierResult:
+    if days <= 0:
+        return TierResult(HEALTH_INTERVALS, 0, 0, 0)
+    cutoff = _cutoff(db, days, archived=HealthLog)
+    old = HealthLog.timestamp < cutoff
+
+    if dry_run:
+        rows = db.query(func.count(HealthLog.id)).filter(old).scalar()
+        return TierResult(HEALTH_INTERVALS, rows, _bytes(db, HealthLog, None, old), 0)
+
+    gap = timedelta(seconds=max_gap_sec)
+    windows = _windows(db.query(func.min(HealthLog.timestamp)).scalar(), cutoff, 3600, COMPACT_MAX_WINDOWS_PER_RUN)
+    rows = reclaimed = compacted = 0
+    for w0, w1 in windows:
+        in_window = (HealthLog.timestamp >= w0, HealthLog.timestamp < w1)
+        logs = db.query(HealthLog.camera_id, HealthLog.timestamp, HealthLog.status, HealthLog.message)\
+            .filter(*in_window).order_by(HealthLog.camera_id, HealthLog.timestamp).all()
+        if not logs:
+            continue
+
+        # Latest interval per camera that a run in this window could continue
+        current: Dict[object, HealthStatusInterval] = {}
+        for interval in db.query(HealthStatusInterval).filter(HealthStatusInterval.end_time >= w0 - gap)\
+                .order_by(HealthStatusInterval.end_time):
+            current[interval.camera_id] = interval
+
+        created = 0
+        for log in logs:
+            ts = _as_utc(log.timestamp)
+            interval = current.get(log.camera_id)
+            if interval is not None and interval.status == log.status and ts - _as_utc(interval.end_time) <= gap:
+                interval.end_time = ts
+                interval.heartbeat_count += 1
+                interval.last_message = log.message
+                continue
+            interval = HealthStatusInterval(camera_id=log.camera_id, status=log.status, start_time=ts, end_time=ts,
+                                            heartbeat_count=1, last_message=log.message)
+            db.add(interval)
+            current[log.camera_id] = interval
+            created += 1
+
+        window_bytes = _bytes(db, HealthLog, None, *in_window)
+        deleted = db.query(HealthLog).filter(*in_window).delete(synchronize_session=False)
+        db.commit()
+        rows += deleted
+        reclaimed += max(window_bytes - created * _COMPACT_ROW_BYTES, 0)
+        compacted += 1
+    return TierResult(HEALTH_INTERVALS, rows, reclaimed, compacted)
+
+
+TIER_FUNCTIONS = {
+    STRIP_METADATA: strip_metadata,
+    EVENT_SUMMARIES: summarize_events,
+    HEALTH_INTERVALS: collapse_health_logs,
+}
+
+
+def run(db: Session, tiers=TIERS, dry_run: bool = False) -> List[TierResult]:
+    return [TIER_FUNCTIONS[tier](db, dry_run=dry_run) for tier in tiers]
+
+
+def format_results(results: List[TierResult], dry_run: bool = False) -> str:
+    verb = "would reclaim" if dry_run else "reclaimed"
+    return "; ".join(f"{r.tier}: {r.rows} rows, {verb} ~{r.bytes / 1e6:.1f} MB" for r in results)
+
+
+def main():
+    from database.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Compact historical telemetry")
+    parser.add_argument("--tier", action="append", choices=TIERS, help="Run only this tier (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be compacted without changing anything")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(format_results(run(db, args.tier or TIERS, dry_run=args.dry_run), dry_run=args.dry_run))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
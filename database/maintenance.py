@@ -0,0 +1,194 @@
+"""
+Database Maintenance Runner: periodic housekeeping jobs (retention, cleanup).
+
+Run as a long-lived loop:     python -m database.maintenance
+Run selected jobs once:       python -m database.maintenance --once --job snapshot-retention
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import func, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.db import SessionLocal, engine
+from database import archive, compaction, partitions, purge, rollups
+from database.models import Spot, SpotCurrentState, SpotObservation, SpotStateInterval
+from database.snapshot_store import get_snapshot_store
+
+# Configuration from Environment
+SNAPSHOT_RETENTION_DAYS = int(os.getenv("SNAPSHOT_RETENTION_DAYS", "30"))
+MAINTENANCE_TICK_SEC = int(os.getenv("MAINTENANCE_TICK_SEC", "30"))
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class Job:
+    def __init__(self, name: str, func: Callable[[], str], interval_sec: int):
+        self.name = name
+        self.func = func
+        self.interval_sec = interval_sec
+        self.last_run = 0.0
+
+
+JOBS: Dict[str, Job] = {}
+
+
+def job(name: str, interval_sec: int):
+    """Register a maintenance job. The function returns a short summary for the log."""
+    def decorator(func):
+        JOBS[name] = Job(name, func, interval_sec)
+        return func
+    return decorator
+
+
+# --- Jobs ---
+
+@job("snapshot-retention", interval_sec=int(os.getenv("SNAPSHOT_RETENTION_INTERVAL_SEC", "3600")))
+def purge_expired_snapshots() -> str:
+    """Delete snapshot blobs older than SNAPSHOT_RETENTION_DAYS."""
+    if SNAPSHOT_RETENTION_DAYS <= 0:
+        return "disabled"
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SNAPSHOT_RETENTION_DAYS)
+    removed = get_snapshot_store().purge_older_than(cutoff)
+    return f"removed {removed} snapshots older than {SNAPSHOT_RETENTION_DAYS}d"
+
+
+@job("partitions", interval_sec=int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SEC", "3600")))
+def maintain_partitions() -> str:
+    """Create upcoming partitions and retire those past their table's retention."""
+    if not partitions.enabled(engine):
+        return "partitioning disabled"
+    created = partitions.ensure_partitions(engine)
+    retired = partitions.apply_retention(engine)
+    action = "archived" if partitions.RETENTION_MODE == "archive" else "dropped"
+    return f"created {created} partitions, {action} {len(retired)}: {', '.join(retired) or '-'}"
+
+
+def _latest_per_spot(db: Session, model, *order):
+    """`model`'s latest row (by `order`) for each live spot that has no current-state row yet."""
+    query = select(model).join(Spot, Spot.id == model.spot_id)\
+        .outerjoin(SpotCurrentState, SpotCurrentState.spot_id == model.spot_id)\
+        .where(SpotCurrentState.spot_id == None, Spot.deleted_at == None)
+    if db.get_bind().dialect.name == "postgresql":
+        return query.distinct(model.spot_id).order_by(model.spot_id, *order).subquery()
+    ranked = query.add_columns(func.row_number().over(partition_by=model.spot_id, order_by=order).label("rank")).subquery()
+    return select(ranked).where(ranked.c.rank == 1).subquery()
+
+
+@job("spot-state-backfill", interval_sec=int(os.getenv("SPOT_STATE_BACKFILL_INTERVAL_SEC", "86400")))
+def backfill_spot_current_state() -> str:
+    """Seed spot_current_state for spots that have history but no current-state row yet."""
+    db = SessionLocal()
+    try:
+        insert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+        columns = ["spot_id", "camera_id", "occupied", "since", "last_seen"]
+        # Prefer the latest state interval (it knows when the current state began), then the latest observation
+        interval = _latest_per_spot(db, SpotStateInterval, SpotStateInterval.end_time.desc())
+        obs = _latest_per_spot(db, SpotObservation, SpotObservation.timestamp.desc())
+        seeded = 0
+        for source in (
+            select(interval.c.spot_id, interval.c.camera_id, interval.c.occupied, interval.c.start_time, interval.c.end_time),
+            select(obs.c.spot_id, obs.c.camera_id, obs.c.occupied, obs.c.timestamp, obs.c.timestamp),
+        ):
+            # Ingest may seed the same spots meanwhile; its row is newer, so keep it.
+            # SQLite needs a WHERE before ON CONFLICT to parse an INSERT ... SELECT.
+            stmt = insert(SpotCurrentState.__table__).from_select(columns, source.where(true()))\
+                .on_conflict_do_nothing(index_elements=["spot_id"])
+            seeded += db.execute(stmt).rowcount
+        db.commit()
+        return f"seeded {seeded} spots without current state"
+    finally:
+        db.close()
+
+
+@job("rollups", interval_sec=int(os.getenv("ROLLUP_INTERVAL_SEC", "300")))
+def build_rollups() -> str:
+    """Build hourly/daily occupancy rollups past the watermark."""
+    db = SessionLocal()
+    try:
+        built = rollups.run(db)
+        return f"built {built[rollups.HOUR]} hourly and {built[rollups.DAY]} daily buckets"
+    finally:
+        db.close()
+
+
+@job("compaction", interval_sec=int(os.getenv("COMPACTION_INTERVAL_SEC", "3600")))
+def compact_history() -> str:
+    """Strip, summarize and collapse telemetry past each compaction tier's age threshold."""
+    db = SessionLocal()
+    try:
+        return compaction.format_results(compaction.run(db))
+    finally:
+        db.close()
+
+
+@job("archive", interval_sec=int(os.getenv("ARCHIVE_INTERVAL_SEC", "3600")))
+def archive_history() -> str:
+    """Move whole days past each table's archive threshold into Parquet files."""
+    if not archive.PYARROW_AVAILABLE:
+        return "pyarrow not installed"
+    db = SessionLocal()
+    try:
+        results = archive.run(db)
+        return ", ".join(f"{table}: {r['files']} files/{r['rows']} rows" for table, r in results.items())
+    finally:
+        db.close()
+
+
+@job("purge", interval_sec=int(os.getenv("PURGE_INTERVAL_SEC", "30")))
+def purge_deleted() -> str:
+    """Remove the history of deleted cameras, locations and spots in bounded batches."""
+    db = SessionLocal()
+    try:
+        return purge.format_result(purge.run(db))
+    finally:
+        db.close()
+
+
+# --- Runner ---
+
+def run_job(j: Job):
+    started = time.time()
+    try:
+        summary = j.func()
+        print(f"[{time.ctime()}] {j.name}: {summary} ({time.time() - started:.1f}s)")
+    except Exception as e:
+        print(f"[{time.ctime()}] {j.name} failed: {e}")
+    finally:
+        j.last_run = time.time()
+
+
+def run_forever(selected: List[Job]):
+    print(f"Maintenance runner started: {', '.join(j.name for j in selected)}")
+    while True:
+        now = time.time()
+        for j in selected:
+            if now - j.last_run >= j.interval_sec:
+                run_job(j)
+        time.sleep(MAINTENANCE_TICK_SEC)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parking database maintenance jobs")
+    parser.add_argument("--job", action="append", choices=sorted(JOBS), help="Run only this job (repeatable)")
+    parser.add_argument("--once", action="store_true", help="Run the selected jobs once and exit")
+    args = parser.parse_args()
+
+    selected = [JOBS[name] for name in (args.job or JOBS)]
+    if args.once:
+        for j in selected:
+            run_job(j)
+    else:
+        run_forever(selected)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Enum, BigInteger, UUID, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Enum, BigInteger, UUID, Boolean, Float, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
+from typing import Iterable, List
 import uuid
 import enum
 
 Base = declarative_base()
 
+# SQLite only auto-increments INTEGER primary keys; keep BIGINT on Postgres
+BigIntegerPK = BigInteger().with_variant(Integer, "sqlite")
+
 class ConnectionType(enum.Enum):
     FIBER = "fiber" # Centralized processing
     EDGE = "edge"   # Remote processing
@@ -28,6 +32,7 @@ class Location(Base):
     name = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True) # Soft-deleted; history is purged by a PurgeJob
 
     cameras = relationship("Camera", back_populates="location_ref")
     spots = relationship("Spot", back_populates="location")
@@ -63,11 +68,16 @@ class Camera(Base):
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True) # Soft-deleted; history is purged by a PurgeJob
 
     location_ref = relationship("Location", back_populates="cameras")
     events = relationship("OccupancyEvent", back_populates="camera")
     health_logs = relationship("HealthLog", back_populates="camera")
     observations = relationship("SpotObservation", back_populates="camera")
+    state_intervals = relationship("SpotStateInterval", back_populates="camera")
+    event_summaries = relationship("OccupancyEventSummary", back_populates="camera")
+    health_intervals = relationship("HealthStatusInterval", back_populates="camera")
+    spot_index = relationship("CameraSpotIndex", back_populates="camera")
 
 class Spot(Base):
     __tablename__ = "spots"
@@ -76,14 +86,21 @@ class Spot(Base):
     location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id"), nullable=False)
     name = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True) # Soft-deleted; history is purged by a PurgeJob
 
     location = relationship("Location", back_populates="spots")
     observations = relationship("SpotObservation", back_populates="spot")
+    state_intervals = relationship("SpotStateInterval", back_populates="spot")
+    current_state = relationship("SpotCurrentState", back_populates="spot", uselist=False)
+
+    __table_args__ = (
+        Index("idx_spots_location", "location_id"),
+    )
 
 class OccupancyEvent(Base):
     __tablename__ = "occupancy_events"
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
     camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
     
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -94,12 +111,35 @@ class OccupancyEvent(Base):
     # Metadata for transparency (Confidence, raw boxes, etc)
     metadata_json = Column(JSON, nullable=True)
 
+    # Per-spot states as a packed bit vector; bit positions are listed in camera_spot_index
+    spot_table_version = Column(BigInteger, nullable=True)
+    spot_states = Column(LargeBinary, nullable=True)
+
     camera = relationship("Camera", back_populates="events")
 
+class CameraSpotIndex(Base):
+    """
+    Bit position of each zone in a camera's packed spot state vector.
+    Keyed by spot table version, so older events still decode after the geometry changes.
+    """
+    __tablename__ = "camera_spot_index"
+
+    camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), primary_key=True)
+    table_version = Column(BigInteger, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    zone_id = Column(String, nullable=False) # Spot ID as the worker reports it (not location-prefixed)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    camera = relationship("Camera", back_populates="spot_index")
+
+    __table_args__ = (
+        Index("idx_camera_spot_index_zone", "camera_id", "zone_id"),
+    )
+
 class SpotObservation(Base):
     __tablename__ = "spot_observations"
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
     spot_id = Column(String, ForeignKey("spots.id"), nullable=False)
     camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
     occupied = Column(Boolean, nullable=False)
@@ -108,10 +148,52 @@ class SpotObservation(Base):
     spot = relationship("Spot", back_populates="observations")
     camera = relationship("Camera", back_populates="observations")
 
+class SpotStateInterval(Base):
+    """
+    Run-length encoded spot history: one row per (spot, camera) state run.
+    The open interval is extended in place while the state holds and closed on a flip.
+    """
+    __tablename__ = "spot_state_intervals"
+
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
+    spot_id = Column(String, ForeignKey("spots.id"), nullable=False)
+    camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
+    occupied = Column(Boolean, nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False) # Last observation while open; flip time once closed
+    observation_count = Column(Integer, nullable=False, default=1)
+    is_open = Column(Boolean, nullable=False, default=True)
+
+    spot = relationship("Spot", back_populates="state_intervals")
+    camera = relationship("Camera", back_populates="state_intervals")
+
+    __table_args__ = (
+        Index("idx_spot_intervals_spot_start", "spot_id", "start_time", "id"),
+        # At most one open interval per camera and spot, even under concurrent ingest
+        Index("idx_spot_intervals_open", "camera_id", "spot_id", unique=True,
+              postgresql_where=is_open, sqlite_where=is_open),
+        Index("idx_spot_intervals_end", "end_time"),
+    )
+
+class SpotCurrentState(Base):
+    """
+    Latest known state per spot, upserted by ingest in the same transaction as the event.
+    Current-state reads are primary-key lookups instead of scans over spot history.
+    """
+    __tablename__ = "spot_current_state"
+
+    spot_id = Column(String, ForeignKey("spots.id"), primary_key=True)
+    camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
+    occupied = Column(Boolean, nullable=False)
+    since = Column(DateTime(timezone=True), nullable=False) # When the spot entered its current state
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+
+    spot = relationship("Spot", back_populates="current_state")
+
 class HealthLog(Base):
     __tablename__ = "health_logs"
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
     camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
     
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -119,3 +201,156 @@ class HealthLog(Base):
     message = Column(String, nullable=True)
 
     camera = relationship("Camera", back_populates="health_logs")
+
+class OccupancyEventSummary(Base):
+    """Fixed-width bucket summary of compacted occupancy_events (see database/compaction.py)."""
+    __tablename__ = "occupancy_event_summaries"
+
+    camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    bucket_seconds = Column(Integer, nullable=False)
+    event_count = Column(Integer, nullable=False)
+    min_occupied = Column(Integer, nullable=False)
+    max_occupied = Column(Integer, nullable=False)
+    sum_occupied = Column(BigInteger, nullable=False) # avg = sum_occupied / event_count
+    max_total_slots = Column(Integer, nullable=False)
+
+    camera = relationship("Camera", back_populates="event_summaries")
+
+class HealthStatusInterval(Base):
+    """Run of identical camera status, collapsed from compacted health_logs."""
+    __tablename__ = "health_status_intervals"
+
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
+    camera_id = Column(UUID(as_uuid=True), ForeignKey("cameras.id"), nullable=False)
+    status = Column(Enum(DeviceStatus), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False) # Last heartbeat in the run
+    heartbeat_count = Column(Integer, nullable=False, default=1)
+    last_message = Column(String, nullable=True)
+
+    camera = relationship("Camera", back_populates="health_intervals")
+
+    __table_args__ = (
+        Index("idx_health_intervals_camera_start", "camera_id", "start_time"),
+    )
+
+class SpotOccupancyRollup(Base):
+    """
+    Hourly/daily occupancy per spot, built by the rollup job from spot_state_intervals and spot_observations.
+    Rollups are derived data: they have no foreign keys and outlive deleted spots.
+    """
+    __tablename__ = "spot_occupancy_rollups"
+
+    spot_id = Column(String, primary_key=True)
+    granularity = Column(String, primary_key=True) # "hour" | "day"
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    location_id = Column(UUID(as_uuid=True), nullable=False)
+    occupied_seconds = Column(Float, nullable=False, default=0)
+    observed_seconds = Column(Float, nullable=False, default=0) # Time covered by state intervals
+    observation_count = Column(Integer, nullable=False, default=0)
+    flips = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("idx_spot_rollups_location_bucket", "location_id", "granularity", "bucket_start"),
+    )
+
+class LocationOccupancyRollup(Base):
+    """Hourly/daily occupancy per location, summed from the spot rollups of the same bucket."""
+    __tablename__ = "location_occupancy_rollups"
+
+    location_id = Column(UUID(as_uuid=True), primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    spot_count = Column(Integer, nullable=False, default=0)
+    occupied_seconds = Column(Float, nullable=False, default=0)
+    observed_seconds = Column(Float, nullable=False, default=0)
+    observation_count = Column(Integer, nullable=False, default=0)
+    flips = Column(Integer, nullable=False, default=0)
+
+class CameraOccupancyRollup(Base):
+    """Hourly/daily occupied_count statistics per camera, built from occupancy_events."""
+    __tablename__ = "camera_occupancy_rollups"
+
+    camera_id = Column(UUID(as_uuid=True), primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    location_id = Column(UUID(as_uuid=True), nullable=True)
+    event_count = Column(Integer, nullable=False, default=0)
+    min_occupied = Column(Integer, nullable=True)
+    max_occupied = Column(Integer, nullable=True)
+    sum_occupied = Column(BigInteger, nullable=False, default=0) # avg = sum_occupied / event_count
+    max_total_slots = Column(Integer, nullable=True)
+
+class RollupWatermark(Base):
+    """High-water mark per rollup granularity: every bucket before it has been built."""
+    __tablename__ = "rollup_watermarks"
+
+    granularity = Column(String, primary_key=True)
+    high_water = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ArchiveManifest(Base):
+    """One Parquet file of history moved out of the database by database/archive.py."""
+    __tablename__ = "archive_manifest"
+
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
+    table_name = Column(String, nullable=False)
+    range_start = Column(DateTime(timezone=True), nullable=False) # Inclusive
+    range_end = Column(DateTime(timezone=True), nullable=False) # Exclusive
+    path = Column(String, nullable=False) # Relative to ARCHIVE_DIR
+    row_count = Column(Integer, nullable=False)
+    file_bytes = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("path", name="uq_archive_manifest_path"),
+        Index("idx_archive_manifest_table_range", "table_name", "range_start"),
+    )
+
+class PurgeJob(Base):
+    """
+    Background removal of a soft-deleted camera, location or spot and its history (see database/purge.py).
+    `progress` holds rows deleted per table and the last finished step, so an interrupted job resumes after it.
+    """
+    __tablename__ = "purge_jobs"
+
+    id = Column(BigIntegerPK, primary_key=True, autoincrement=True)
+    entity_type = Column(String, nullable=False) # "camera" | "location" | "spot"
+    entity_id = Column(String, nullable=False)
+    spot_ids = Column(JSON, nullable=True) # Spots removed along with a camera (zones no other camera covers)
+    status = Column(String, nullable=False, default="pending") # pending | running | done
+    step = Column(String, nullable=True) # Table or partition being purged
+    rows_deleted = Column(BigInteger, nullable=False, default=0)
+    progress = Column(JSON, nullable=True)
+    error = Column(String, nullable=True) # Last error; the job is retried on the next run
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("idx_purge_jobs_status", "status", "id"),
+    )
+
+
+# --- Packed spot states ---
+# One bit per spot in camera_spot_index position order, least significant bit first
+# (the same layout the vision worker uses on the wire).
+
+def pack_spot_states(states: Iterable[bool]) -> bytes:
+    out = bytearray()
+    for i, state in enumerate(states):
+        if i % 8 == 0:
+            out.append(0)
+        if state:
+            out[-1] |= 1 << (i % 8)
+    return bytes(out)
+
+def unpack_spot_states(data: bytes, count: int) -> List[bool]:
+    if len(data) * 8 < count:
+        raise ValueError(f"Bit vector holds {len(data) * 8} states, expected {count}")
+    return [bool(data[i // 8] & (1 << (i % 8))) for i in range(count)]
+
+def spot_state_at(data: bytes, position: int) -> bool:
+    return bool(data[position // 8] & (1 << (position % 8)))
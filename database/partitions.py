@@ -0,0 +1,284 @@
+"""
+Time-range partitioning for the high-volume history tables (PostgreSQL only).
+
+`occupancy_events`, `spot_observations` and `health_logs` are created as
+declaratively partitioned parents (monthly or daily on `timestamp`). The
+maintenance runner keeps future partitions created ahead of time and applies
+retention by detaching whole partitions, then dropping or archiving them.
+Rows that landed in a table's DEFAULT partition are moved into a range
+partition when one is created for them, and retention deletes (or archives)
+those older than the cutoff in batches.
+
+Existing unpartitioned tables are left untouched; see database/README.md for
+the migration procedure.
+"""
+
+import os
+import re
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import MetaData, PrimaryKeyConstraint, Table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database.models import Base
+from database.rollups import HOUR, watermark
+
+# Configuration from Environment
+PARTITION_INTERVAL = os.getenv("DB_PARTITION_INTERVAL", "month")  # month | day | none
+PARTITIONS_AHEAD = int(os.getenv("DB_PARTITIONS_AHEAD", "3"))
+RETENTION_MODE = os.getenv("DB_PARTITION_RETENTION_MODE", "drop")  # drop | archive
+ARCHIVE_SCHEMA = os.getenv("DB_PARTITION_ARCHIVE_SCHEMA", "archive")
+# Rows removed from a DEFAULT partition per statement when applying retention
+RETENTION_BATCH_ROWS = int(os.getenv("DB_PARTITION_RETENTION_BATCH_ROWS", "10000"))
+
+# Retention per table in days; 0 keeps history forever
+RETENTION_DAYS = {
+    "occupancy_events": int(os.getenv("RETENTION_DAYS_OCCUPANCY_EVENTS", "0")),
+    "spot_observations": int(os.getenv("RETENTION_DAYS_SPOT_OBSERVATIONS", "0")),
+    "health_logs": int(os.getenv("RETENTION_DAYS_HEALTH_LOGS", "0")),
+}
+
+PARENT_INDEXES = {
+    "occupancy_events": [
+        "CREATE INDEX IF NOT EXISTS idx_occupancy_camera_timestamp ON occupancy_events(camera_id, timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_occupancy_timestamp ON occupancy_events(timestamp, id)",
+    ],
+    "spot_observations": [
+        # Covers spot history pages, so they are served by index-only scans
+        "CREATE INDEX IF NOT EXISTS idx_spot_obs_spot_timestamp ON spot_observations(spot_id, timestamp, id) INCLUDE (occupied, camera_id)",
+        "CREATE INDEX IF NOT EXISTS idx_spot_obs_timestamp_brin ON spot_observations USING brin (timestamp)",
+    ],
+    "health_logs": ["CREATE INDEX IF NOT EXISTS idx_health_camera_timestamp ON health_logs(camera_id, timestamp)"],
+}
+
+PARTITIONED_TABLES = list(PARENT_INDEXES)
+
+_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[datetime]  # None for the DEFAULT partition
+    end: Optional[datetime]
+
+
+def enabled(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql" and PARTITION_INTERVAL in ("month", "day")
+
+
+def _period_start(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    if PARTITION_INTERVAL == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_period(start: datetime) -> datetime:
+    if PARTITION_INTERVAL == "day":
+        return start + timedelta(days=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _partition_name(table: str, start: datetime) -> str:
+    suffix = start.strftime("%Y%m%d" if PARTITION_INTERVAL == "day" else "%Y%m")
+    return f"{table}_p{suffix}"
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :t"),
+        {"t": table},
+    ).first() is not None
+
+
+def _default_partition(conn, table: str) -> Optional[str]:
+    return conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :t AND pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT'
+    """), {"t": table}).scalar()
+
+
+def _create_partition(conn, table: str, name: str, start: datetime, end: datetime, default: Optional[str]):
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    held = default is not None and conn.execute(
+        text(f"SELECT 1 FROM {default} WHERE timestamp >= :s AND timestamp < :e LIMIT 1"), {"s": start, "e": end},
+    ).first() is not None
+    if not held:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+        return
+    # Creating the partition fails while DEFAULT holds rows in its range: move them over first, then attach
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE timestamp >= :s AND timestamp < :e RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"s": start, "e": end}).rowcount
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}"))
+    print(f"Moved {moved} rows from {default} into {name}")
+
+
+def _partitioned_table(metadata: MetaData, name: str) -> Table:
+    """Copy the ORM table as a range-partitioned parent. The partition key must join the primary key."""
+    table = Base.metadata.tables[name].to_metadata(metadata)
+    table.c.timestamp.primary_key = True
+    table.c.timestamp.nullable = False
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.timestamp))
+    table.dialect_options["postgresql"]["partition_by"] = "RANGE (timestamp)"
+    return table
+
+
+def create_partitioned_tables(engine: Engine):
+    """Create partitioned parents for tables that do not exist yet. Call before `create_all`."""
+    if not enabled(engine):
+        return
+
+    metadata = MetaData()
+    # Referenced tables must be present in the metadata to resolve foreign keys
+    for name, table in Base.metadata.tables.items():
+        if name not in PARTITIONED_TABLES:
+            table.to_metadata(metadata)
+
+    with engine.begin() as conn:
+        for name in PARTITIONED_TABLES:
+            exists = conn.execute(text("SELECT to_regclass(:t)"), {"t": name}).scalar()
+            if exists:
+                if not _is_partitioned(conn, name):
+                    print(f"{name} exists and is not partitioned; skipping (see database/README.md to migrate)")
+                continue
+            # Parents reference cameras/spots, so those are created first if this is a fresh database
+            metadata.create_all(conn, tables=[t for n, t in metadata.tables.items() if n not in PARTITIONED_TABLES])
+            metadata.create_all(conn, tables=[_partitioned_table(metadata, name)])
+            for index in PARENT_INDEXES[name]:
+                conn.execute(text(index))
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name}_default PARTITION OF {name} DEFAULT"))
+            print(f"Created partitioned table {name} ({PARTITION_INTERVAL}ly)")
+
+    ensure_partitions(engine)
+
+
+def list_partitions(engine: Engine, table: str) -> List[Partition]:
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :t
+        """), {"t": table}).all()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound or "")
+        if match:
+            start, end = (datetime.fromisoformat(v).astimezone(timezone.utc) for v in match.groups())
+            partitions.append(Partition(name, start, end))
+        else:
+            partitions.append(Partition(name, None, None))
+    return sorted(partitions, key=lambda p: p.start or datetime.max.replace(tzinfo=timezone.utc))
+
+
+def ensure_partitions(engine: Engine, ahead: int = PARTITIONS_AHEAD, since: Optional[datetime] = None) -> int:
+    """
+    Create partitions for the current period and `ahead` future periods, plus past periods back to `since`
+    (used when loading history). Returns the number created.
+    """
+    if not enabled(engine):
+        return 0
+
+    last = _period_start(datetime.now(timezone.utc))
+    for _ in range(ahead):
+        last = _next_period(last)
+
+    created = 0
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not _is_partitioned(conn, table):
+                continue
+            default = _default_partition(conn, table)
+            start = _period_start(since or datetime.now(timezone.utc))
+            while start <= last:
+                end = _next_period(start)
+                name = _partition_name(table, start)
+                if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is None:
+                    _create_partition(conn, table, name, start, end, default)
+                    created += 1
+                start = end
+    return created
+
+
+def _retire_default_rows(engine: Engine, table: str, default: str, cutoff: datetime, dry_run: bool) -> int:
+    """Delete (or move to the archive schema) DEFAULT partition rows older than the cutoff, in batches."""
+    old = {"cutoff": cutoff, "n": RETENTION_BATCH_ROWS}
+    if dry_run:
+        with engine.connect() as conn:
+            return conn.execute(text(f"SELECT count(*) FROM {default} WHERE timestamp < :cutoff"), old).scalar()
+
+    batch = f"DELETE FROM {default} WHERE ctid IN (SELECT ctid FROM {default} WHERE timestamp < :cutoff LIMIT :n)"
+    if RETENTION_MODE == "archive":
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.{default} (LIKE {table})"))
+        batch = f"WITH moved AS ({batch} RETURNING *) INSERT INTO {ARCHIVE_SCHEMA}.{default} SELECT * FROM moved"
+
+    removed = 0
+    while True:
+        # One short transaction per batch
+        with engine.begin() as conn:
+            rows = conn.execute(text(batch), old).rowcount
+        removed += rows
+        if rows < RETENTION_BATCH_ROWS:
+            return removed
+
+
+def _retention_cutoff(engine: Engine, table: str, cutoff: datetime) -> datetime:
+    """Hold the age cutoff back to what the hourly rollups and the Parquet archive have already consumed."""
+    from database import archive  # archive imports this module
+
+    epoch = datetime.fromtimestamp(0, tz=timezone.utc)
+    with Session(engine) as db:
+        if table in archive.ROLLUP_SOURCES:
+            mark = watermark(db, HOUR)
+            cutoff = min(cutoff, mark) if mark is not None else epoch
+        if archive.ARCHIVE_AFTER_DAYS.get(table, 0) > 0:
+            cutoff = min(cutoff, archive.archived_through(db, table))
+    return cutoff
+
+
+def apply_retention(engine: Engine, retention_days: Dict[str, int] = RETENTION_DAYS, dry_run: bool = False) -> List[str]:
+    """
+    Detach partitions that lie entirely before each table's retention cutoff, then drop or archive them.
+    Rows of the DEFAULT partition past the cutoff are removed the same way, row by row.
+    The cutoff never passes the hourly rollup watermark (for rollup sources) or the archive's progress.
+    """
+    if not enabled(engine):
+        return []
+
+    removed = []
+    now = datetime.now(timezone.utc)
+    for table, days in retention_days.items():
+        if days <= 0:
+            continue
+        cutoff = _retention_cutoff(engine, table, now - timedelta(days=days))
+        for partition in list_partitions(engine, table):
+            if partition.start is None:
+                rows = _retire_default_rows(engine, table, partition.name, cutoff, dry_run)
+                if rows:
+                    removed.append(f"{partition.name} ({rows} rows)")
+                continue
+            if partition.end > cutoff:
+                continue
+            removed.append(partition.name)
+            if dry_run:
+                continue
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition.name}"))
+                if RETENTION_MODE == "archive":
+                    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                    conn.execute(text(f"ALTER TABLE {partition.name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                else:
+                    conn.execute(text(f"DROP TABLE {partition.name}"))
+    return removed
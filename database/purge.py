@@ -0,0 +1,275 @@
+"""
+Background purge of deleted cameras, locations and spots.
+
+The Control Plane's DELETE endpoints only set `deleted_at` (the entity disappears
+from the API at once) and queue a `purge_jobs` row. This module removes the
+entity's history and finally its row, without long-running deletes:
+
+- Rows are deleted in batches of PURGE_BATCH_ROWS, selected by primary key. Each
+  batch is its own short transaction and also records progress on the job.
+- Partitioned history tables (PostgreSQL) are purged one partition at a time,
+  oldest first, addressing the partition directly so every batch probes a
+  single partition's index.
+- `spot_observations` has no camera index, so a camera's observations are
+  deleted spot by spot through idx_spot_obs_spot_timestamp. The spots are those
+  of its location plus any it has state intervals for (e.g. from before a
+  move), collected once when the job starts.
+- Deletes are idempotent. The job remembers the last finished step, and an
+  interrupted or failed job continues from there on the next run.
+- A location waits until the purges of its cameras have removed them.
+
+Parquet files already written by database/archive.py are not rewritten.
+
+Run once:   python -m database.purge [--job-id 12]
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import column, delete, select, table, tuple_
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import partitions
+from database.models import (
+    Camera, CameraOccupancyRollup, CameraSpotIndex, HealthLog, HealthStatusInterval, Location, LocationOccupancyRollup,
+    OccupancyEvent, OccupancyEventSummary, PurgeJob, Spot, SpotCurrentState, SpotObservation, SpotOccupancyRollup,
+    SpotStateInterval,
+)
+
+# Configuration from Environment
+PURGE_BATCH_ROWS = int(os.getenv("PURGE_BATCH_ROWS", "5000"))
+# Pause between batches, so replicas, autovacuum and ingest keep up
+PURGE_BATCH_PAUSE_SEC = float(os.getenv("PURGE_BATCH_PAUSE_SEC", "0.05"))
+PURGE_MAX_SEC_PER_RUN = float(os.getenv("PURGE_MAX_SEC_PER_RUN", "120"))
+
+CAMERA = "camera"
+LOCATION = "location"
+SPOT = "spot"
+ENTITY_TYPES = (CAMERA, LOCATION, SPOT)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+
+
+class Step(NamedTuple):
+    key: str             # Unique within the job; shown as the job's `step`
+    table: str           # Table the rows are counted against
+    target: Any          # Table or partition to delete from
+    primary_key: List[str]
+    where: Dict[str, Any]
+
+
+class _Deferred(Exception):
+    """The entity is still referenced by rows another job will remove."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _targets(db: Session, model) -> List[Any]:
+    """The model's table, or its partitions oldest first when it is partitioned."""
+    parent = model.__table__
+    bind = db.get_bind()
+    if parent.name in partitions.PARTITIONED_TABLES and partitions.enabled(bind):
+        children = partitions.list_partitions(bind, parent.name)
+        if children:
+            return [table(p.name, *[column(c.name, c.type) for c in parent.columns]) for p in children]
+    return [parent]
+
+
+def _steps_for(db: Session, model, **where) -> List[Step]:
+    primary_key = [c.name for c in model.__table__.primary_key]
+    condition = " ".join(f"{k}={v}" for k, v in where.items())
+    return [
+        Step(f"{target.name} {condition}", model.__tablename__, target, primary_key, where)
+        for target in _targets(db, model)
+    ]
+
+
+def _spot_steps(db: Session, spot_ids: List[str]) -> List[Step]:
+    steps = []
+    for spot_id in spot_ids:
+        for model in (SpotObservation, SpotStateInterval, SpotCurrentState, SpotOccupancyRollup):
+            steps += _steps_for(db, model, spot_id=spot_id)
+    return steps
+
+
+def _location_spot_ids(db: Session, location_id) -> List[str]:
+    return [row.id for row in db.query(Spot.id).filter(Spot.location_id == location_id).order_by(Spot.id)]
+
+
+def camera_spot_ids(db: Session, camera_id) -> List[str]:
+    """Spots that may hold observations from the camera: its location's, and any it has intervals for."""
+    camera = db.get(Camera, camera_id)
+    spot_ids = set(_location_spot_ids(db, camera.location_id)) if camera else set()
+    spot_ids.update(row.spot_id for row in db.query(SpotStateInterval.spot_id)
+                    .filter(SpotStateInterval.camera_id == camera_id).distinct())
+    return sorted(spot_ids)
+
+
+def plan(db: Session, job: PurgeJob, camera_spots: List[str] = ()) -> List[Step]:
+    """
+    Batched delete steps that remove everything referencing the job's entity, in order.
+    `camera_spots`: spots to clear of a camera's observations (see camera_spot_ids).
+    """
+    if job.entity_type == CAMERA:
+        camera_id = uuid.UUID(job.entity_id)
+        steps = []
+        for model in (OccupancyEvent, HealthLog, OccupancyEventSummary, HealthStatusInterval):
+            steps += _steps_for(db, model, camera_id=camera_id)
+        # Both are deleted through their spot indexes; neither table has a camera index
+        for model in (SpotObservation, SpotStateInterval):
+            for spot_id in camera_spots:
+                steps += _steps_for(db, model, spot_id=spot_id, camera_id=camera_id)
+        for model in (SpotCurrentState, CameraSpotIndex, CameraOccupancyRollup):
+            steps += _steps_for(db, model, camera_id=camera_id)
+        return steps + _spot_steps(db, sorted(job.spot_ids or []))
+    if job.entity_type == LOCATION:
+        location_id = uuid.UUID(job.entity_id)
+        return _spot_steps(db, _location_spot_ids(db, location_id)) + _steps_for(db, LocationOccupancyRollup, location_id=location_id)
+    return _spot_steps(db, [job.entity_id])
+
+
+def _delete_batch(db: Session, step: Step) -> int:
+    target = step.target
+    keys = [target.c[name] for name in step.primary_key]
+    batch = select(*keys).where(*[target.c[k] == v for k, v in step.where.items()]).limit(PURGE_BATCH_ROWS)
+    if len(keys) == 1:
+        condition = keys[0].in_(batch.scalar_subquery())
+    else:
+        condition = tuple_(*keys).in_(batch)
+    return db.execute(delete(target).where(condition)).rowcount
+
+
+def _delete_entity(db: Session, job: PurgeJob):
+    """Remove the entity rows themselves, once their history is gone."""
+    if job.entity_type == CAMERA:
+        if job.spot_ids:
+            db.query(Spot).filter(Spot.id.in_(job.spot_ids), Spot.deleted_at.isnot(None))\
+                .delete(synchronize_session=False)
+        db.query(Camera).filter(Camera.id == uuid.UUID(job.entity_id), Camera.deleted_at.isnot(None))\
+            .delete(synchronize_session=False)
+    elif job.entity_type == LOCATION:
+        location_id = uuid.UUID(job.entity_id)
+        if db.query(Camera.id).filter(Camera.location_id == location_id).first():
+            raise _Deferred("waiting for the location's cameras to be purged")
+        db.query(Spot).filter(Spot.location_id == location_id).delete(synchronize_session=False)
+        db.query(Location).filter(Location.id == location_id, Location.deleted_at.isnot(None))\
+            .delete(synchronize_session=False)
+    else:
+        db.query(Spot).filter(Spot.id == job.entity_id, Spot.deleted_at.isnot(None)).delete(synchronize_session=False)
+
+
+def run_job(db: Session, job: PurgeJob, deadline: float) -> bool:
+    """Work on `job` until it is done (returns True) or `deadline` (time.monotonic) passes."""
+    if job.status == PENDING:
+        job.status, job.started_at = RUNNING, _now()
+        db.commit()
+
+    progress = dict(job.progress or {})
+    tables: Dict[str, int] = dict(progress.get("tables", {}))
+    resume_after: Optional[str] = progress.get("resume_after")
+    # Fixed when the job starts, so the plan (and `resume_after`) stay valid while intervals are deleted
+    camera_spots: List[str] = progress.get("camera_spots", [])
+    if job.entity_type == CAMERA and "camera_spots" not in progress:
+        camera_spots = camera_spot_ids(db, uuid.UUID(job.entity_id))
+
+    steps = plan(db, job, camera_spots)
+    keys = [step.key for step in steps]
+    start = keys.index(resume_after) + 1 if resume_after in keys else 0
+
+    for step in steps[start:]:
+        job.step = step.key
+        while True:
+            if time.monotonic() >= deadline:
+                db.commit()
+                return False
+            deleted = _delete_batch(db, step)
+            finished = deleted < PURGE_BATCH_ROWS
+            if finished:
+                resume_after = step.key
+            if deleted:
+                tables[step.table] = tables.get(step.table, 0) + deleted
+                job.rows_deleted = (job.rows_deleted or 0) + deleted
+            job.progress = {"tables": dict(tables), "resume_after": resume_after, "camera_spots": camera_spots}
+            db.commit()
+            if finished:
+                break
+            time.sleep(PURGE_BATCH_PAUSE_SEC)
+
+    job.step = f"{job.entity_type} row"
+    try:
+        _delete_entity(db, job)
+    except _Deferred as e:
+        db.rollback()
+        job.step = str(e)
+        db.commit()
+        return False
+    except Exception:
+        db.rollback()
+        # History may have been added meanwhile; start over on the next run
+        job.progress = {"tables": dict(tables), "resume_after": None}  # Also re-collects the camera's spots
+        db.commit()
+        raise
+    job.status, job.step, job.error, job.finished_at = DONE, None, None, _now()
+    db.commit()
+    return True
+
+
+def run(db: Session, job_id: Optional[int] = None, max_sec: float = PURGE_MAX_SEC_PER_RUN) -> Dict[str, int]:
+    """Work through unfinished purge jobs, oldest first, for at most `max_sec` seconds."""
+    deadline = time.monotonic() + max_sec
+    query = db.query(PurgeJob).filter(PurgeJob.status.in_([PENDING, RUNNING]))
+    if job_id is not None:
+        query = query.filter(PurgeJob.id == job_id)
+    jobs = query.order_by(PurgeJob.id).all()
+
+    result = {"jobs": len(jobs), "finished": 0, "failed": 0, "rows": 0}
+    for job in jobs:
+        if time.monotonic() >= deadline:
+            break
+        before = job.rows_deleted or 0
+        try:
+            if run_job(db, job, deadline):
+                result["finished"] += 1
+        except Exception as e:
+            db.rollback()
+            job.error = f"{type(e).__name__}: {e}"[:1000]
+            db.commit()
+            result["failed"] += 1
+            print(f"Purge job {job.id} ({job.entity_type} {job.entity_id}) failed: {e}")
+        result["rows"] += (job.rows_deleted or 0) - before
+    return result
+
+
+def format_result(result: Dict[str, int]) -> str:
+    return (f"finished {result['finished']} of {result['jobs']} jobs, deleted {result['rows']} rows"
+            + (f", {result['failed']} failed" if result["failed"] else ""))
+
+
+def main():
+    from database.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Purge history of deleted cameras, locations and spots")
+    parser.add_argument("--job-id", type=int, help="Run only this purge job")
+    parser.add_argument("--max-sec", type=float, default=PURGE_MAX_SEC_PER_RUN, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(format_result(run(db, job_id=args.job_id, max_sec=args.max_sec)))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Statements behind the hot API reads and ingest lookups.
+
+The control plane and the ingest service build these queries here, and
+database/query_plans.py runs EXPLAIN on the same builders. A plan check
+therefore always covers the query its endpoint actually runs, including its
+soft-delete filters, ordering and paging.
+
+Builders that page or load ORM rows take a Session and return a Query. The
+export and ingest statements are Core statements, so they take no session.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.orm import Query, Session, load_only
+
+from database.models import (
+    Camera, CameraOccupancyRollup, CameraSpotIndex, DeviceStatus, HealthLog, Location, LocationOccupancyRollup,
+    OccupancyEvent, Spot, SpotCurrentState, SpotObservation, SpotOccupancyRollup, SpotStateInterval,
+)
+
+# Event columns every API response loads; heavy columns are only loaded for the fields that need them
+# (legacy events keep spot_details in metadata_json)
+EVENT_LIGHT_COLUMNS = (OccupancyEvent.id, OccupancyEvent.camera_id, OccupancyEvent.timestamp,
+                       OccupancyEvent.occupied_count, OccupancyEvent.free_count, OccupancyEvent.total_slots)
+EVENT_HEAVY_COLUMNS = {
+    "metadata_json": (OccupancyEvent.metadata_json,),
+    "spot_details": (OccupancyEvent.spot_table_version, OccupancyEvent.spot_states, OccupancyEvent.metadata_json),
+}
+
+
+def keyset_page(query: Query, time_column, id_column, limit: int, after: Optional[tuple] = None,
+                start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Query:
+    """
+    Newest-first page of `query` after the (time, id) key `after`, within [start_date, end_date].
+    Fetches limit + 1 rows; the extra row tells whether another page exists.
+    """
+    if start_date:
+        query = query.filter(time_column >= start_date)
+    if end_date:
+        query = query.filter(time_column <= end_date)
+    if after:
+        query = query.filter(tuple_(time_column, id_column) < tuple_(*after))
+    return query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1)
+
+
+# --- Ingest ---
+
+def active_camera(db: Session, camera_id: uuid.UUID) -> Query:
+    return db.query(Camera).filter(Camera.id == camera_id, Camera.deleted_at == None)
+
+
+def location_spot_ids(db: Session, location_id: uuid.UUID) -> Query:
+    return db.query(Spot.id).filter(Spot.location_id == location_id, Spot.deleted_at == None)
+
+
+def open_intervals(camera_id: uuid.UUID, spot_ids: Iterable[str]):
+    """Open state intervals of a camera's spots, locked in spot order so concurrent events cannot deadlock."""
+    table = SpotStateInterval.__table__
+    return select(table.c.id, table.c.spot_id, table.c.occupied, table.c.end_time)\
+        .where(table.c.camera_id == camera_id, table.c.is_open == True, table.c.spot_id.in_(spot_ids))\
+        .order_by(table.c.spot_id)\
+        .with_for_update()
+
+
+def current_state_upsert(insert, camera_id: uuid.UUID, states: Dict[str, bool], timestamp: datetime):
+    """
+    Upsert of spot_current_state for one event, with the dialect's `insert`. `since` only moves when
+    the state flips, and late, out-of-order samples are ignored. Returns (spot_id, occupied, since).
+    """
+    table = SpotCurrentState.__table__
+    stmt = insert(table).values([
+        {"spot_id": spot_id, "camera_id": camera_id, "occupied": occupied, "since": timestamp, "last_seen": timestamp}
+        for spot_id, occupied in states.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.spot_id],
+        set_={
+            "camera_id": stmt.excluded.camera_id,
+            "occupied": stmt.excluded.occupied,
+            "since": case((table.c.occupied != stmt.excluded.occupied, stmt.excluded.since), else_=table.c.since),
+            "last_seen": stmt.excluded.last_seen,
+        },
+        where=table.c.last_seen <= stmt.excluded.last_seen,
+    )
+    return stmt.returning(table.c.spot_id, table.c.occupied, table.c.since)
+
+
+# --- Control plane: dashboard and lists ---
+
+def stats(one_day_ago: datetime):
+    """All dashboard counters in a single round trip."""
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    return select(
+        count(Camera, Camera.deleted_at == None).label("total_cameras"),
+        count(Camera, Camera.deleted_at == None, Camera.status == DeviceStatus.HEALTHY).label("active_cameras"),
+        count(Location, Location.deleted_at == None).label("total_locations"),
+        count(Spot, Spot.deleted_at == None).label("total_spots"),
+        # Spot stats come from the current-state table maintained by ingest
+        count(SpotCurrentState, SpotCurrentState.occupied == True).label("occupied_spots"),
+        # Served by the timestamp index on occupancy_events
+        count(OccupancyEvent, OccupancyEvent.timestamp >= one_day_ago).label("recent_events_24h"),
+    )
+
+
+def events(db: Session, fields: Sequence[str], camera_id: Optional[uuid.UUID] = None) -> Query:
+    """Events of live cameras with camera and location names, loading heavy columns only if a field needs them."""
+    columns = {c.key: c for c in EVENT_LIGHT_COLUMNS}
+    for field in fields:
+        columns.update({c.key: c for c in EVENT_HEAVY_COLUMNS.get(field, ())})
+    query = db.query(
+        OccupancyEvent,
+        Camera.name.label('camera_name'),
+        Location.name.label('location_name')
+    ).options(load_only(*columns.values()))\
+     .join(Camera, OccupancyEvent.camera_id == Camera.id)\
+     .join(Location, Camera.location_id == Location.id)\
+     .filter(Camera.deleted_at == None)
+    if camera_id:
+        query = query.filter(OccupancyEvent.camera_id == camera_id)
+    return query
+
+
+def spots(db: Session, location_id: Optional[uuid.UUID] = None, offset: int = 0, limit: Optional[int] = None) -> Query:
+    """Live spots with their latest status and location name, ordered by spot ID."""
+    query = db.query(
+        Spot.id,
+        Spot.name,
+        Spot.location_id,
+        Location.name.label('location_name'),
+        SpotCurrentState.occupied,
+        SpotCurrentState.last_seen
+    ).join(Location, Spot.location_id == Location.id)\
+     .outerjoin(SpotCurrentState, SpotCurrentState.spot_id == Spot.id)\
+     .filter(Spot.deleted_at == None)
+    if location_id:
+        query = query.filter(Spot.location_id == location_id)
+    return query.order_by(Spot.id).offset(offset).limit(limit)
+
+
+def location_status(db: Session, location_id: uuid.UUID, since: Optional[datetime] = None) -> Query:
+    """Latest status of a location's live spots; with `since`, only spots whose state changed after it."""
+    query = db.query(Spot.id, Spot.name, SpotCurrentState.occupied, SpotCurrentState.since, SpotCurrentState.last_seen)\
+        .outerjoin(SpotCurrentState, SpotCurrentState.spot_id == Spot.id)\
+        .filter(Spot.location_id == location_id, Spot.deleted_at == None)
+    if since:
+        query = query.filter(SpotCurrentState.since > since)
+    return query.order_by(Spot.id)
+
+
+# --- Control plane: spot history ---
+
+def deleted_camera_ids(db: Session) -> List[uuid.UUID]:
+    """Cameras awaiting their purge; few, and filtering on them keeps the history index-only scans."""
+    return [row.id for row in db.query(Camera.id).filter(Camera.deleted_at != None)]
+
+
+def spot_observations(db: Session, spot_id: str, deleted_cameras: Sequence[uuid.UUID] = ()) -> Query:
+    # Only columns covered by idx_spot_obs_spot_timestamp, so pages are index-only scans
+    query = db.query(SpotObservation.id, SpotObservation.timestamp, SpotObservation.occupied, SpotObservation.camera_id)\
+        .filter(SpotObservation.spot_id == spot_id)
+    if deleted_cameras:
+        query = query.filter(SpotObservation.camera_id.notin_(deleted_cameras))
+    return query
+
+
+def spot_intervals(db: Session, spot_id: str, deleted_cameras: Sequence[uuid.UUID] = ()) -> Query:
+    query = db.query(SpotStateInterval).filter(SpotStateInterval.spot_id == spot_id)
+    if deleted_cameras:
+        query = query.filter(SpotStateInterval.camera_id.notin_(deleted_cameras))
+    return query
+
+
+def spot_events(db: Session, location_id: uuid.UUID, zone_id: str) -> Query:
+    """Packed events of live cameras covering a zone, with the zone's bit position in each camera's spot table."""
+    return db.query(OccupancyEvent.id, OccupancyEvent.timestamp, OccupancyEvent.camera_id, OccupancyEvent.spot_states,
+                    CameraSpotIndex.position)\
+        .join(Camera, OccupancyEvent.camera_id == Camera.id)\
+        .join(CameraSpotIndex, (CameraSpotIndex.camera_id == OccupancyEvent.camera_id)
+              & (CameraSpotIndex.table_version == OccupancyEvent.spot_table_version))\
+        .filter(Camera.location_id == location_id, CameraSpotIndex.zone_id == zone_id,
+                OccupancyEvent.spot_states.isnot(None), Camera.deleted_at == None)
+
+
+# --- Control plane: analytics exports (newest first, unpaged) ---
+
+def export_observations(location_id: Optional[uuid.UUID] = None, start_date: Optional[datetime] = None,
+                        end_date: Optional[datetime] = None):
+    stmt = select(
+        SpotObservation.id,
+        SpotObservation.timestamp,
+        SpotObservation.occupied,
+        SpotObservation.spot_id,
+        Spot.name.label('spot_name'),
+        Spot.location_id,
+        Location.name.label('location_name'),
+        SpotObservation.camera_id,
+        Camera.name.label('camera_name')
+    ).join(Spot, SpotObservation.spot_id == Spot.id)\
+     .join(Location, Spot.location_id == Location.id)\
+     .join(Camera, SpotObservation.camera_id == Camera.id)\
+     .where(Spot.deleted_at == None, Location.deleted_at == None, Camera.deleted_at == None)
+    if location_id:
+        stmt = stmt.where(Spot.location_id == location_id)
+    if start_date:
+        stmt = stmt.where(SpotObservation.timestamp >= start_date)
+    if end_date:
+        stmt = stmt.where(SpotObservation.timestamp <= end_date)
+    return stmt.order_by(SpotObservation.timestamp.desc())
+
+
+def export_intervals(location_id: Optional[uuid.UUID] = None, start_date: Optional[datetime] = None,
+                     end_date: Optional[datetime] = None):
+    """State intervals overlapping [start_date, end_date]."""
+    stmt = select(
+        SpotStateInterval.id,
+        SpotStateInterval.start_time,
+        SpotStateInterval.end_time,
+        SpotStateInterval.occupied,
+        SpotStateInterval.observation_count,
+        SpotStateInterval.is_open,
+        SpotStateInterval.spot_id,
+        Spot.name.label('spot_name'),
+        Spot.location_id,
+        Location.name.label('location_name'),
+        SpotStateInterval.camera_id,
+        Camera.name.label('camera_name')
+    ).join(Spot, SpotStateInterval.spot_id == Spot.id)\
+     .join(Location, Spot.location_id == Location.id)\
+     .join(Camera, SpotStateInterval.camera_id == Camera.id)\
+     .where(Spot.deleted_at == None, Location.deleted_at == None, Camera.deleted_at == None)
+    if location_id:
+        stmt = stmt.where(Spot.location_id == location_id)
+    if start_date:
+        stmt = stmt.where(SpotStateInterval.end_time >= start_date)
+    if end_date:
+        stmt = stmt.where(SpotStateInterval.start_time <= end_date)
+    return stmt.order_by(SpotStateInterval.start_time.desc())
+
+
+def export_spot_rollups(granularity: str, location_id: Optional[uuid.UUID] = None, spot_id: Optional[str] = None,
+                        start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    R = SpotOccupancyRollup
+    stmt = select(R, Spot.name.label('spot_name'), Location.name.label('location_name'))\
+        .outerjoin(Spot, R.spot_id == Spot.id)\
+        .outerjoin(Location, R.location_id == Location.id)\
+        .where(R.granularity == granularity, Spot.deleted_at == None, Location.deleted_at == None)
+    if location_id:
+        stmt = stmt.where(R.location_id == location_id)
+    if spot_id:
+        stmt = stmt.where(R.spot_id == spot_id)
+    if start_date:
+        stmt = stmt.where(R.bucket_start >= start_date)
+    if end_date:
+        stmt = stmt.where(R.bucket_start <= end_date)
+    return stmt.order_by(R.bucket_start.desc(), R.spot_id)
+
+
+def export_location_rollups(granularity: str, location_id: Optional[uuid.UUID] = None,
+                            start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    R = LocationOccupancyRollup
+    stmt = select(R, Location.name.label('location_name'))\
+        .outerjoin(Location, R.location_id == Location.id)\
+        .where(R.granularity == granularity, Location.deleted_at == None)
+    if location_id:
+        stmt = stmt.where(R.location_id == location_id)
+    if start_date:
+        stmt = stmt.where(R.bucket_start >= start_date)
+    if end_date:
+        stmt = stmt.where(R.bucket_start <= end_date)
+    return stmt.order_by(R.bucket_start.desc())
+
+
+def export_camera_rollups(granularity: str, camera_id: Optional[uuid.UUID] = None,
+                          location_id: Optional[uuid.UUID] = None, start_date: Optional[datetime] = None,
+                          end_date: Optional[datetime] = None):
+    R = CameraOccupancyRollup
+    stmt = select(R, Camera.name.label('camera_name'))\
+        .outerjoin(Camera, R.camera_id == Camera.id)\
+        .where(R.granularity == granularity, Camera.deleted_at == None)
+    if camera_id:
+        stmt = stmt.where(R.camera_id == camera_id)
+    if location_id:
+        stmt = stmt.where(R.location_id == location_id)
+    if start_date:
+        stmt = stmt.where(R.bucket_start >= start_date)
+    if end_date:
+        stmt = stmt.where(R.bucket_start <= end_date)
+    return stmt.order_by(R.bucket_start.desc())
+
+
+def export_health(camera_id: Optional[uuid.UUID] = None, start_date: Optional[datetime] = None,
+                  end_date: Optional[datetime] = None):
+    stmt = select(
+        HealthLog.id,
+        HealthLog.timestamp,
+        HealthLog.status,
+        HealthLog.message,
+        HealthLog.camera_id,
+        Camera.name.label('camera_name'),
+        Location.name.label('location_name')
+    ).join(Camera, HealthLog.camera_id == Camera.id)\
+     .outerjoin(Location, Camera.location_id == Location.id)\
+     .where(Camera.deleted_at == None)
+    if camera_id:
+        stmt = stmt.where(HealthLog.camera_id == camera_id)
+    if start_date:
+        stmt = stmt.where(HealthLog.timestamp >= start_date)
+    if end_date:
+        stmt = stmt.where(HealthLog.timestamp <= end_date)
+    return stmt.order_by(HealthLog.timestamp.desc())
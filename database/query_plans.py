@@ -0,0 +1,447 @@
+"""
+Query-plan regression checks for the hot database queries (PostgreSQL only).
+
+Each check builds its query with the same database/queries.py builder as its
+endpoint (control plane reads, ingest lookups and upserts), runs it under
+EXPLAIN (ANALYZE, BUFFERS) inside a transaction that is rolled back, and then
+checks the result:
+  * plan shape: no sequential scans on large tables, no sorts over more rows than needed
+  * latency: execution time against a per-query budget (scaled with --budget-scale)
+For failing plans, index suggestions are printed, e.g. BRIN on `timestamp` for
+time-range scans, or btree on the filter and sort columns.
+
+--seed loads a synthetic dataset with generate_series: locations, cameras and
+spots, then observations, events, heartbeats, state intervals, current state
+and hourly rollups spread over --days. Point DATABASE_URL at a scratch
+database; seeding refuses to run if cameras already exist.
+
+Examples:
+    python -m database.query_plans --seed --spots 2000 --observations 20000000
+    python -m database.query_plans --budget-scale 2 --report plans.json
+    python -m database.query_plans --only events_recent --show-plans
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.models import (
+    Base, Camera, DesiredState, DeviceStatus, Location, OccupancyEvent, Spot, SpotCurrentState, SpotObservation, SpotStateInterval,
+)
+from database import queries
+from database.partitions import PARTITIONED_TABLES, create_partitioned_tables, ensure_partitions
+
+# Tables at or above this many rows may not be read with a sequential scan by a hot query
+LARGE_TABLE_ROWS = 100000
+SPOTS_PER_CAMERA = 50
+_PARTITION_SUFFIX = re.compile(r"_(p\d+|default)$")
+_FILTER_COLUMN = re.compile(r'"?(\w+)"?\s*(?:=|>=|<=|>|<|<>)\s')
+
+
+# --- Seeding ---
+
+def _sql(db: Session, statement: str, **params):
+    db.execute(text(statement), params)
+
+
+def seed(db: Session, locations: int, spots: int, observations: int, days: int, heartbeat_sec: int):
+    """Load a synthetic dataset ending now. Observations are spread evenly over spots and time."""
+    if db.query(Camera).count():
+        sys.exit("Refusing to seed: cameras already exist. Use an empty scratch database.")
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=days)
+    ensure_partitions(db.get_bind(), since=start)
+
+    samples = max(observations // spots, 1)
+    step_sec = max(days * 86400 // samples, 1)
+    print(f"Seeding {locations} locations, {spots} spots, {samples} samples per spot every {step_sec}s over {days} days")
+
+    spot_ids: List[str] = []
+    camera_ids: List[str] = []
+    per_location = math.ceil(spots / locations)
+    for li in range(locations):
+        location = Location(id=uuid.uuid4(), name=f"Bench Lot {li + 1}")
+        db.add(location)
+        count = min(per_location, spots - len(spot_ids))
+        for ci in range(math.ceil(count / SPOTS_PER_CAMERA)):
+            camera = Camera(
+                id=uuid.uuid4(), name=f"Bench Cam {li + 1}-{ci + 1}", location_id=location.id, stream_url="bench://",
+                desired_state=DesiredState.RUNNING, status=DeviceStatus.HEALTHY, last_heartbeat=now, last_event_time=now,
+            )
+            db.add(camera)
+            for si in range(min(SPOTS_PER_CAMERA, count - ci * SPOTS_PER_CAMERA)):
+                spot_id = f"{location.id}:B{ci * SPOTS_PER_CAMERA + si:05d}"
+                db.add(Spot(id=spot_id, location_id=location.id, name=spot_id.split(":")[1]))
+                spot_ids.append(spot_id)
+                camera_ids.append(str(camera.id))
+    db.commit()
+    cameras = sorted(set(camera_ids))
+    spot_params = {"spot_ids": spot_ids, "camera_ids": camera_ids}
+    spot_set = "unnest(CAST(:spot_ids AS text[]), CAST(:camera_ids AS uuid[])) AS s(spot_id, camera_id)"
+    # Every camera packs its spots against spot table version 1
+    _sql(db, f"""
+        INSERT INTO camera_spot_index (camera_id, table_version, position, zone_id)
+        SELECT s.camera_id, 1, row_number() OVER (PARTITION BY s.camera_id ORDER BY s.spot_id) - 1, split_part(s.spot_id, ':', 2)
+        FROM {spot_set}
+    """, **spot_params)
+
+    # One statement per day keeps inserts in time order, like live ingest
+    samples_per_day = max(samples // days, 1)
+    for day in range(days):
+        g0 = day * samples_per_day
+        g1 = samples - 1 if day == days - 1 else g0 + samples_per_day - 1
+        if g0 > g1:
+            break
+        window = {"start": start, "step": step_sec, "g0": g0, "g1": g1}
+        _sql(db, f"""
+            INSERT INTO spot_observations (spot_id, camera_id, occupied, timestamp)
+            SELECT s.spot_id, s.camera_id, random() < 0.6, :start + make_interval(secs => g * :step)
+            FROM generate_series(:g0, :g1) AS g CROSS JOIN {spot_set}
+        """, **window, **spot_params)
+        _sql(db, """
+            INSERT INTO occupancy_events
+                (camera_id, timestamp, occupied_count, free_count, total_slots, spot_table_version, spot_states)
+            SELECT c.camera_id, :start + make_interval(secs => g * :step), o, 50 - o, 50,
+                   1, substring(decode(md5(random()::text), 'hex') FROM 1 FOR :state_bytes)
+            FROM generate_series(:g0, :g1) AS g
+            CROSS JOIN unnest(CAST(:cameras AS uuid[])) AS c(camera_id)
+            CROSS JOIN LATERAL (SELECT (random() * 50)::int + g * 0 AS o) AS r
+        """, **window, cameras=cameras, state_bytes=math.ceil(SPOTS_PER_CAMERA / 8))
+        db.commit()
+        print(f"  day {day + 1}/{days}")
+
+    heartbeats = days * 86400 // heartbeat_sec
+    _sql(db, """
+        INSERT INTO health_logs (camera_id, timestamp, status, message)
+        SELECT c.camera_id, :start + make_interval(secs => g * :step),
+               CASE WHEN random() < 0.98 THEN 'HEALTHY' ELSE 'DEGRADED' END::devicestatus, 'bench'
+        FROM generate_series(0, :n - 1) AS g CROSS JOIN unnest(CAST(:cameras AS uuid[])) AS c(camera_id)
+    """, start=start, step=heartbeat_sec, n=heartbeats, cameras=cameras)
+
+    # Each spot flips every 20 samples; the last run is still open
+    runs = max(samples // 20, 1)
+    run_sec = step_sec * 20
+    _sql(db, f"""
+        INSERT INTO spot_state_intervals (spot_id, camera_id, occupied, start_time, end_time, observation_count, is_open)
+        SELECT s.spot_id, s.camera_id, k % 2 = 0, :start + make_interval(secs => k * :len),
+               :start + make_interval(secs => (k + 1) * :len), 20, k = :runs - 1
+        FROM generate_series(0, :runs - 1) AS k CROSS JOIN {spot_set}
+    """, start=start, len=run_sec, runs=runs, **spot_params)
+    _sql(db, f"""
+        INSERT INTO spot_current_state (spot_id, camera_id, occupied, since, last_seen)
+        SELECT s.spot_id, s.camera_id, random() < 0.6, :since, :now FROM {spot_set}
+    """, since=now - timedelta(seconds=run_sec), now=now, **spot_params)
+
+    hours = days * 24
+    _sql(db, """
+        INSERT INTO spot_occupancy_rollups
+            (spot_id, granularity, bucket_start, location_id, occupied_seconds, observed_seconds, observation_count, flips)
+        SELECT sp.id, 'hour', date_trunc('hour', :start) + make_interval(hours => h), sp.location_id,
+               random() * 3600, 3600, 3600 / :step, (random() * 4)::int
+        FROM generate_series(0, :hours - 1) AS h CROSS JOIN spots sp
+    """, start=start, step=step_sec, hours=hours)
+    _sql(db, """
+        INSERT INTO location_occupancy_rollups
+            (location_id, granularity, bucket_start, spot_count, occupied_seconds, observed_seconds, observation_count, flips)
+        SELECT location_id, granularity, bucket_start, count(*), sum(occupied_seconds), sum(observed_seconds),
+               sum(observation_count), sum(flips)
+        FROM spot_occupancy_rollups GROUP BY location_id, granularity, bucket_start
+    """)
+    db.commit()
+
+    for table in Base.metadata.tables:
+        _sql(db, f"ANALYZE {table}")
+    db.commit()
+    print(f"Seeded {samples * spots} observations, {samples * len(cameras)} events, {heartbeats * len(cameras)} heartbeats")
+
+
+# --- Checks ---
+
+class Context(NamedTuple):
+    location_id: uuid.UUID
+    camera_id: uuid.UUID
+    spot_id: str
+    spot_ids: List[str]
+    window_start: datetime
+    window_end: datetime
+
+
+class Check(NamedTuple):
+    name: str
+    source: str  # Endpoint or code path the query mirrors
+    build: Callable[[Session, Context], Any]
+    budget_ms: float
+    # Sorting more rows than this means the ORDER BY is not served by an index
+    max_sorted_rows: Optional[int] = None
+    # Table whose scans must be index-only (the index covers every selected column)
+    index_only: Optional[str] = None
+
+
+def _context(db: Session) -> Context:
+    location_id, spot_count = db.query(Spot.location_id, func.count(Spot.id))\
+        .group_by(Spot.location_id).order_by(func.count(Spot.id).desc()).first() or (None, 0)
+    camera = db.query(Camera).filter(Camera.location_id == location_id).first() if location_id else None
+    if camera is None:
+        sys.exit("No location with cameras and spots to check against; run with --seed first.")
+    spot_ids = [s for (s,) in db.query(SpotCurrentState.spot_id).filter(SpotCurrentState.camera_id == camera.id)]
+    spot_ids = spot_ids or [s for (s,) in db.query(Spot.id).filter(Spot.location_id == location_id).limit(SPOTS_PER_CAMERA)]
+    window_end = db.query(func.max(SpotObservation.timestamp)).scalar() or datetime.now(timezone.utc)
+    return Context(location_id, camera.id, spot_ids[0], spot_ids, window_end - timedelta(days=1), window_end)
+
+
+# Events are checked as the default 'full' view loads them, heavy columns included
+_FULL_EVENT_FIELDS = tuple(queries.EVENT_HEAVY_COLUMNS)
+
+
+def _page(query, time_column, id_column, limit: int, ctx: Optional[Context] = None):
+    """First page of a keyset-paged query, or with `ctx` a page a day deep into history, as sent back in an API cursor."""
+    after = (ctx.window_start, 2**62) if ctx else None
+    return queries.keyset_page(query, time_column, id_column, limit, after)
+
+
+def _events(db: Session, ctx: Context, camera: bool = False, deep: bool = False):
+    query = queries.events(db, _FULL_EVENT_FIELDS, ctx.camera_id if camera else None)
+    return _page(query, OccupancyEvent.timestamp, OccupancyEvent.id, 100, ctx if deep else None)
+
+
+def _spot_history(db: Session, ctx: Context, deep: bool = False):
+    query = queries.spot_observations(db, ctx.spot_id, queries.deleted_camera_ids(db))
+    return _page(query, SpotObservation.timestamp, SpotObservation.id, 50, ctx if deep else None)
+
+
+CHECKS: List[Check] = [
+    # Ingest: per event
+    Check("ingest_camera_lookup", "ingest POST /cameras/{id}/event",
+          lambda db, c: queries.active_camera(db, c.camera_id), 5),
+    Check("ingest_valid_spots", "ingest POST /cameras/{id}/event",
+          lambda db, c: queries.location_spot_ids(db, c.location_id), 10),
+    Check("ingest_open_intervals", "ingest _record_spot_states",
+          lambda db, c: queries.open_intervals(c.camera_id, c.spot_ids), 10),
+    Check("ingest_current_state_upsert", "ingest _upsert_current_state",
+          lambda db, c: queries.current_state_upsert(postgresql.insert, c.camera_id, dict.fromkeys(c.spot_ids, True),
+                                                     datetime.now(timezone.utc)), 20),
+    # Control plane: dashboard
+    Check("stats", "GET /stats",
+          lambda db, c: queries.stats(datetime.now(timezone.utc) - timedelta(days=1)), 150),
+    Check("events_recent", "GET /events", lambda db, c: _events(db, c), 50, max_sorted_rows=0),
+    Check("events_by_camera", "GET /events?camera_id=", lambda db, c: _events(db, c, camera=True), 20, max_sorted_rows=0),
+    Check("events_page", "GET /events?cursor=", lambda db, c: _events(db, c, deep=True), 50, max_sorted_rows=0),
+    Check("events_by_camera_page", "GET /events?camera_id=&cursor=",
+          lambda db, c: _events(db, c, camera=True, deep=True), 20, max_sorted_rows=0),
+    Check("spots_list", "GET /spots", lambda db, c: queries.spots(db), 100),
+    Check("spots_by_location", "GET /spots?location_id=&limit=",
+          lambda db, c: queries.spots(db, c.location_id, limit=100), 20),
+    Check("location_status", "GET /locations/{id}/status",
+          lambda db, c: queries.location_status(db, c.location_id), 20),
+    Check("spot_history", "GET /spots/{id}/history", lambda db, c: _spot_history(db, c), 10,
+          max_sorted_rows=0, index_only="spot_observations"),
+    Check("spot_history_page", "GET /spots/{id}/history?cursor=", lambda db, c: _spot_history(db, c, deep=True), 10,
+          max_sorted_rows=0, index_only="spot_observations"),
+    Check("spot_history_events", "GET /spots/{id}/history?view=events",
+          lambda db, c: _page(queries.spot_events(db, c.location_id, c.spot_id.partition(":")[2]),
+                              OccupancyEvent.timestamp, OccupancyEvent.id, 50), 20, max_sorted_rows=1000),
+    Check("spot_history_intervals", "GET /spots/{id}/history?view=intervals",
+          lambda db, c: _page(queries.spot_intervals(db, c.spot_id, queries.deleted_camera_ids(db)),
+                              SpotStateInterval.start_time, SpotStateInterval.id, 50), 10, max_sorted_rows=0),
+    # Control plane: exports over one day
+    Check("export_observations", "GET /analytics/observations?location_id=&start_date=&end_date=",
+          lambda db, c: queries.export_observations(c.location_id, c.window_start, c.window_end), 2000),
+    Check("export_intervals", "GET /analytics/intervals?location_id=&start_date=&end_date=",
+          lambda db, c: queries.export_intervals(c.location_id, c.window_start, c.window_end), 1000),
+    Check("export_health", "GET /analytics/health?start_date=&end_date=",
+          lambda db, c: queries.export_health(start_date=c.window_start, end_date=c.window_end), 500),
+    Check("export_spot_rollups", "GET /analytics/rollups/spots?location_id=&start_date=",
+          lambda db, c: queries.export_spot_rollups("hour", c.location_id, start_date=c.window_start), 500),
+    Check("export_location_rollups", "GET /analytics/rollups/locations",
+          lambda db, c: queries.export_location_rollups("hour"), 200),
+]
+
+
+# --- Plan analysis ---
+
+def _walk(node: Dict[str, Any], parent: Optional[Dict[str, Any]] = None):
+    yield node, parent
+    for child in node.get("Plans", []):
+        yield from _walk(child, node)
+
+
+def _parent_table(relation: str) -> str:
+    return _PARTITION_SUFFIX.sub("", relation)
+
+
+def _table_rows(db: Session) -> Dict[str, int]:
+    """Planner row estimates per table, with partitions summed into their parent."""
+    rows: Dict[str, int] = {}
+    for name, estimate in db.execute(text("SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r'")):
+        table = _parent_table(name)
+        rows[table] = rows.get(table, 0) + max(estimate, 0)
+    return rows
+
+
+def _suggest(node: Dict[str, Any], table: str) -> Optional[str]:
+    """Index that would let this scan or sort use an index instead."""
+    if node["Node Type"] == "Sort":
+        keys = [re.sub(r"^\w+\.", "", key) for key in node.get("Sort Key", [])]
+        if not keys:
+            return None
+        columns = ", ".join(keys)
+        name = "_".join(re.sub(r"\W+", "", k.replace(" DESC", "")) for k in keys)
+        return f"CREATE INDEX idx_{table}_{name} ON {table} ({columns})"
+
+    columns = list(dict.fromkeys(_FILTER_COLUMN.findall(node.get("Filter", ""))))
+    if not columns:
+        return None
+    if columns == ["timestamp"] and table in PARTITIONED_TABLES:
+        # Append-only history is physically ordered by time, so a tiny BRIN index covers range scans
+        return f"CREATE INDEX idx_{table}_timestamp_brin ON {table} USING brin (timestamp)"
+    # Equality columns first, then the range column
+    columns.sort(key=lambda c: c in ("timestamp", "start_time", "end_time", "bucket_start"))
+    return f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})"
+
+
+def analyze(plan: Dict[str, Any], check: Check, table_rows: Dict[str, int]) -> Dict[str, List[str]]:
+    problems: List[str] = []
+    suggestions: List[str] = []
+    for node, parent in _walk(plan["Plan"]):
+        kind = node["Node Type"]
+        if kind == "Seq Scan":
+            table = _parent_table(node["Relation Name"])
+            if table_rows.get(table, 0) >= LARGE_TABLE_ROWS:
+                problems.append(f"Seq Scan on {node['Relation Name']} ({node.get('Actual Rows', 0)} rows kept, "
+                                f"{node.get('Rows Removed by Filter', 0)} removed)")
+                suggestions.append(_suggest(node, table))
+        elif check.index_only and kind in ("Index Scan", "Bitmap Heap Scan") \
+                and _parent_table(node["Relation Name"]) == check.index_only:
+            problems.append(f"{kind} on {node['Relation Name']}; expected an Index Only Scan")
+        elif kind == "Sort" and check.max_sorted_rows is not None:
+            sorted_rows = node["Plans"][0].get("Actual Rows", 0) * node["Plans"][0].get("Actual Loops", 1)
+            if sorted_rows > check.max_sorted_rows:
+                scans = [n.get("Relation Name") for n, _ in _walk(node) if n.get("Relation Name")]
+                table = _parent_table(scans[0]) if scans else "?"
+                problems.append(f"Sort over {sorted_rows} rows ({', '.join(node.get('Sort Key', []))})")
+                suggestions.append(_suggest(node, table))
+    return {"problems": problems, "suggestions": [s for s in dict.fromkeys(suggestions) if s]}
+
+
+def _plan_summary(node: Dict[str, Any], depth: int = 0) -> List[str]:
+    target = node.get("Index Name") or node.get("Relation Name") or ""
+    line = f"{'  ' * depth}{node['Node Type']}{' on ' + target if target else ''}" \
+           f"  rows={node.get('Actual Rows', '?')} loops={node.get('Actual Loops', '?')} time={node.get('Actual Total Time', '?')}ms"
+    lines = [line]
+    for child in node.get("Plans", []):
+        lines.extend(_plan_summary(child, depth + 1))
+    return lines
+
+
+def explain(db: Session, statement) -> Dict[str, Any]:
+    compiled = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    raw = db.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}")).scalar()
+    return (json.loads(raw) if isinstance(raw, str) else raw)[0]
+
+
+def run(db: Session, checks: List[Check] = CHECKS, budget_scale: float = 1.0, show_plans: bool = False) -> List[Dict[str, Any]]:
+    ctx = _context(db)
+    table_rows = _table_rows(db)
+    results = []
+    for check in checks:
+        built = check.build(db, ctx)
+        statement = getattr(built, "statement", built)
+        try:
+            explain(db, statement)  # Warm the cache so budgets measure steady-state latency
+            plan = explain(db, statement)
+        finally:
+            db.rollback()  # EXPLAIN ANALYZE executes writes too
+
+        findings = analyze(plan, check, table_rows)
+        budget = check.budget_ms * budget_scale
+        elapsed = plan["Execution Time"]
+        if elapsed > budget:
+            findings["problems"].append(f"{elapsed:.1f}ms over budget of {budget:.0f}ms")
+        buffers = plan["Plan"]
+        results.append({
+            "name": check.name,
+            "source": check.source,
+            "execution_ms": round(elapsed, 3),
+            "planning_ms": round(plan["Planning Time"], 3),
+            "budget_ms": budget,
+            "shared_hit": buffers.get("Shared Hit Blocks", 0),
+            "shared_read": buffers.get("Shared Read Blocks", 0),
+            "ok": not findings["problems"],
+            **findings,
+            "plan": _plan_summary(plan["Plan"]),
+        })
+        if show_plans:
+            print(f"\n{check.name}:\n  " + "\n  ".join(results[-1]["plan"]))
+    return results
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print(f"\n{'query':<30} {'exec ms':>9} {'budget':>8} {'hit':>8} {'read':>8}  result")
+    for r in results:
+        print(f"{r['name']:<30} {r['execution_ms']:>9.2f} {r['budget_ms']:>8.0f} {r['shared_hit']:>8} {r['shared_read']:>8}"
+              f"  {'ok' if r['ok'] else 'FAIL'}")
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"\n{r['name']} ({r['source']}):")
+        for problem in r["problems"]:
+            print(f"  - {problem}")
+        for suggestion in r["suggestions"]:
+            print(f"  suggested: {suggestion};")
+    print(f"\n{len(results) - len(failed)}/{len(results)} queries within plan and latency budgets")
+
+
+def main():
+    from database.db import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE the hot queries and check plan shape and latency")
+    parser.add_argument("--seed", action="store_true", help="Load a synthetic dataset first (empty database only)")
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--spots", type=int, default=2000)
+    parser.add_argument("--observations", type=int, default=20000000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--heartbeat-sec", type=int, default=60)
+    parser.add_argument("--only", action="append", choices=[c.name for c in CHECKS], help="Run only this check (repeatable)")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply all latency budgets (slow machines, CI)")
+    parser.add_argument("--show-plans", action="store_true")
+    parser.add_argument("--report", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        sys.exit("Query-plan checks need PostgreSQL (EXPLAIN ANALYZE, BUFFERS)")
+
+    db = SessionLocal()
+    try:
+        if args.seed:
+            started = time.monotonic()
+            create_partitioned_tables(engine)
+            Base.metadata.create_all(bind=engine)
+            seed(db, args.locations, args.spots, args.observations, args.days, args.heartbeat_sec)
+            print(f"Seeded in {time.monotonic() - started:.0f}s")
+        checks = [c for c in CHECKS if not args.only or c.name in args.only]
+        results = run(db, checks, args.budget_scale, args.show_plans)
+    finally:
+        db.close()
+
+    print_report(results)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Incremental hourly/daily occupancy rollups.
+
+Hourly buckets are built from spot_state_intervals, spot_observations and
+occupancy_events once they are older than ROLLUP_LATENESS_SEC; daily buckets
+are summed from the hourly rows once the whole day has been built. Progress is
+tracked per granularity in `rollup_watermarks`, so each run only processes
+buckets after the high-water mark. Rebuilding a bucket replaces its rows, so a
+run can be repeated safely.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import (
+    Camera, CameraOccupancyRollup, LocationOccupancyRollup, OccupancyEvent, RollupWatermark,
+    Spot, SpotObservation, SpotOccupancyRollup, SpotStateInterval,
+)
+
+# Configuration from Environment
+ROLLUP_LATENESS_SEC = int(os.getenv("ROLLUP_LATENESS_SEC", "300"))
+ROLLUP_MAX_BUCKETS_PER_RUN = int(os.getenv("ROLLUP_MAX_BUCKETS_PER_RUN", "168"))
+
+HOUR = "hour"
+DAY = "day"
+GRANULARITIES = (HOUR, DAY)
+
+ROLLUP_TABLES = (SpotOccupancyRollup, LocationOccupancyRollup, CameraOccupancyRollup)
+
+
+def _as_utc(ts: datetime) -> datetime:
+    """Normalize DB timestamps (naive on SQLite) to aware UTC."""
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def _floor(ts: datetime, granularity: str) -> datetime:
+    ts = _as_utc(ts).replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if granularity == DAY else ts
+
+
+def _step(granularity: str) -> timedelta:
+    return timedelta(days=1) if granularity == DAY else timedelta(hours=1)
+
+
+def _clear_bucket(db: Session, granularity: str, bucket_start: datetime):
+    for model in ROLLUP_TABLES:
+        db.query(model).filter(model.granularity == granularity, model.bucket_start == bucket_start)\
+            .delete(synchronize_session=False)
+
+
+def build_hour(db: Session, b0: datetime):
+    """(Re)build all hourly rollups for the bucket starting at b0."""
+    b1 = b0 + _step(HOUR)
+    _clear_bucket(db, HOUR, b0)
+
+    spots: Dict[str, Dict[str, float]] = defaultdict(lambda: {
+        "occupied_seconds": 0.0, "observed_seconds": 0.0, "observation_count": 0, "flips": 0,
+    })
+
+    for spot_id, count in db.query(SpotObservation.spot_id, func.count())\
+            .filter(SpotObservation.timestamp >= b0, SpotObservation.timestamp < b1)\
+            .group_by(SpotObservation.spot_id):
+        spots[spot_id]["observation_count"] = count
+
+    intervals = db.query(
+        SpotStateInterval.spot_id, SpotStateInterval.occupied, SpotStateInterval.start_time, SpotStateInterval.end_time
+    ).filter(SpotStateInterval.start_time < b1, SpotStateInterval.end_time >= b0)\
+     .order_by(SpotStateInterval.spot_id, SpotStateInterval.start_time)
+
+    previous: Dict[str, bool] = {}
+    for row in intervals:
+        start, end = _as_utc(row.start_time), _as_utc(row.end_time)
+        overlap = max(0.0, (min(end, b1) - max(start, b0)).total_seconds())
+        stats = spots[row.spot_id]
+        stats["observed_seconds"] += overlap
+        if row.occupied:
+            stats["occupied_seconds"] += overlap
+        # A flip is an interval starting in this bucket with the opposite state of the one before it
+        if start >= b0 and row.spot_id in previous and previous[row.spot_id] != row.occupied:
+            stats["flips"] += 1
+        previous[row.spot_id] = row.occupied
+
+    locations = dict(db.query(Spot.id, Spot.location_id).filter(Spot.id.in_(list(spots)))) if spots else {}
+    per_location: Dict[object, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for spot_id, stats in spots.items():
+        location_id = locations.get(spot_id)
+        if location_id is None:
+            continue # Spot deleted since; its history can no longer be attributed
+        db.add(SpotOccupancyRollup(spot_id=spot_id, granularity=HOUR, bucket_start=b0, location_id=location_id, **stats))
+        totals = per_location[location_id]
+        totals["spot_count"] += 1
+        for key, value in stats.items():
+            totals[key] += value
+
+    for location_id, totals in per_location.items():
+        db.add(LocationOccupancyRollup(
+            location_id=location_id, granularity=HOUR, bucket_start=b0,
+            spot_count=int(totals["spot_count"]),
+            occupied_seconds=totals["occupied_seconds"],
+            observed_seconds=totals["observed_seconds"],
+            observation_count=int(totals["observation_count"]),
+            flips=int(totals["flips"]),
+        ))
+
+    cameras = db.query(
+        OccupancyEvent.camera_id,
+        Camera.location_id,
+        func.count().label("event_count"),
+        func.min(OccupancyEvent.occupied_count).label("min_occupied"),
+        func.max(OccupancyEvent.occupied_count).label("max_occupied"),
+        func.sum(OccupancyEvent.occupied_count).label("sum_occupied"),
+        func.max(OccupancyEvent.total_slots).label("max_total_slots"),
+    ).outerjoin(Camera, OccupancyEvent.camera_id == Camera.id)\
+     .filter(OccupancyEvent.timestamp >= b0, OccupancyEvent.timestamp < b1)\
+     .group_by(OccupancyEvent.camera_id, Camera.location_id)
+
+    for row in cameras:
+        db.add(CameraOccupancyRollup(
+            camera_id=row.camera_id, granularity=HOUR, bucket_start=b0, location_id=row.location_id,
+            event_count=row.event_count, min_occupied=row.min_occupied, max_occupied=row.max_occupied,
+            sum_occupied=row.sum_occupied or 0, max_total_slots=row.max_total_slots,
+        ))
+
+
+def build_day(db: Session, d0: datetime):
+    """(Re)build all daily rollups for the day starting at d0 from its hourly rows."""
+    d1 = d0 + _step(DAY)
+    _clear_bucket(db, DAY, d0)
+
+    def hourly(model):
+        return db.query(model).filter(model.granularity == HOUR, model.bucket_start >= d0, model.bucket_start < d1)
+
+    S = SpotOccupancyRollup
+    for row in hourly(S).with_entities(
+        S.spot_id, S.location_id, func.sum(S.occupied_seconds), func.sum(S.observed_seconds),
+        func.sum(S.observation_count), func.sum(S.flips),
+    ).group_by(S.spot_id, S.location_id):
+        db.add(S(spot_id=row[0], granularity=DAY, bucket_start=d0, location_id=row[1],
+                 occupied_seconds=row[2], observed_seconds=row[3], observation_count=row[4], flips=row[5]))
+
+    # Spots are counted once per day, not once per hour
+    for row in hourly(S).with_entities(
+        S.location_id, func.count(func.distinct(S.spot_id)), func.sum(S.occupied_seconds), func.sum(S.observed_seconds),
+        func.sum(S.observation_count), func.sum(S.flips),
+    ).group_by(S.location_id):
+        db.add(LocationOccupancyRollup(location_id=row[0], granularity=DAY, bucket_start=d0, spot_count=row[1],
+                                       occupied_seconds=row[2], observed_seconds=row[3], observation_count=row[4], flips=row[5]))
+
+    C = CameraOccupancyRollup
+    for row in hourly(C).with_entities(
+        C.camera_id, C.location_id, func.sum(C.event_count), func.min(C.min_occupied), func.max(C.max_occupied),
+        func.sum(C.sum_occupied), func.max(C.max_total_slots),
+    ).group_by(C.camera_id, C.location_id):
+        db.add(C(camera_id=row[0], granularity=DAY, bucket_start=d0, location_id=row[1], event_count=row[2],
+                 min_occupied=row[3], max_occupied=row[4], sum_occupied=row[5], max_total_slots=row[6]))
+
+
+def _earliest_hour_source(db: Session) -> Optional[datetime]:
+    candidates = [
+        db.query(func.min(OccupancyEvent.timestamp)).scalar(),
+        db.query(func.min(SpotStateInterval.start_time)).scalar(),
+        db.query(func.min(SpotObservation.timestamp)).scalar(),
+    ]
+    candidates = [_as_utc(c) for c in candidates if c is not None]
+    return min(candidates) if candidates else None
+
+
+def _earliest_day_source(db: Session) -> Optional[datetime]:
+    first = db.query(func.min(SpotOccupancyRollup.bucket_start)).filter(SpotOccupancyRollup.granularity == HOUR).scalar()
+    first_camera = db.query(func.min(CameraOccupancyRollup.bucket_start)).filter(CameraOccupancyRollup.granularity == HOUR).scalar()
+    candidates = [_as_utc(c) for c in (first, first_camera) if c is not None]
+    return min(candidates) if candidates else None
+
+
+def watermark(db: Session, granularity: str) -> Optional[datetime]:
+    row = db.get(RollupWatermark, granularity)
+    return _as_utc(row.high_water) if row else None
+
+
+def _advance(db: Session, granularity: str, ready_before: datetime, earliest: Callable[[Session], Optional[datetime]],
+             build: Callable[[Session, datetime], None], limit: int) -> int:
+    """Build buckets after the watermark that end before `ready_before`, committing one bucket at a time."""
+    start = watermark(db, granularity)
+    if start is None:
+        first = earliest(db)
+        if first is None:
+            return 0 # Nothing recorded yet
+        start = _floor(first, granularity)
+
+    built = 0
+    step = _step(granularity)
+    while built < limit and start + step <= ready_before:
+        build(db, start)
+        start += step
+        row = db.get(RollupWatermark, granularity)
+        if row is None:
+            db.add(RollupWatermark(granularity=granularity, high_water=start))
+        else:
+            row.high_water = start
+        db.commit()
+        built += 1
+    return built
+
+
+def run(db: Session, now: Optional[datetime] = None, limit: int = ROLLUP_MAX_BUCKETS_PER_RUN) -> Dict[str, int]:
+    """Advance the hourly then daily rollups. Returns the number of buckets built per granularity."""
+    now = now or datetime.now(timezone.utc)
+    hours = _advance(db, HOUR, now - timedelta(seconds=ROLLUP_LATENESS_SEC), _earliest_hour_source, build_hour, limit)
+
+    # A day is final only once all of its hours are
+    hour_mark = watermark(db, HOUR)
+    days = _advance(db, DAY, hour_mark, _earliest_day_source, build_day, limit) if hour_mark else 0
+    return {HOUR: hours, DAY: days}
+
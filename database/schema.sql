@@ -8,7 +8,8 @@ CREATE TABLE locations (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     name VARCHAR NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP WITH TIME ZONE -- soft delete; history purged by purge_jobs
 );
 
 CREATE TABLE cameras (
@@ -30,44 +31,198 @@ CREATE TABLE cameras (
     last_event_time TIMESTAMP WITH TIME ZONE,
     status device_status DEFAULT 'disconnected',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP WITH TIME ZONE
 );
 
 CREATE TABLE spots (
     id VARCHAR PRIMARY KEY, -- e.g., "North-001"
     location_id UUID NOT NULL REFERENCES locations(id) ON DELETE CASCADE,
     name VARCHAR,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP WITH TIME ZONE
 );
 
+-- History tables are range-partitioned by timestamp (see database/partitions.py);
+-- the partition key must be part of the primary key.
 CREATE TABLE occupancy_events (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
-    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     occupied_count INTEGER NOT NULL,
     free_count INTEGER NOT NULL,
     total_slots INTEGER NOT NULL,
-    metadata_json JSONB
+    metadata_json JSONB,
+    spot_table_version BIGINT,                     -- see camera_spot_index
+    spot_states BYTEA,                             -- one bit per spot, LSB first
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Bit position of each zone in a camera's packed spot states, per spot table version
+CREATE TABLE camera_spot_index (
+    camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
+    table_version BIGINT NOT NULL,
+    position INTEGER NOT NULL,
+    zone_id VARCHAR NOT NULL,                      -- spot ID as reported by the worker
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (camera_id, table_version, position)
 );
 
 CREATE TABLE spot_observations (
+    id BIGSERIAL,
+    spot_id VARCHAR NOT NULL REFERENCES spots(id) ON DELETE CASCADE,
+    camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
+    occupied BOOLEAN NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Run-length encoded spot history: one row per (spot, camera) state run
+CREATE TABLE spot_state_intervals (
     id BIGSERIAL PRIMARY KEY,
     spot_id VARCHAR NOT NULL REFERENCES spots(id) ON DELETE CASCADE,
     camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
     occupied BOOLEAN NOT NULL,
-    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    start_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    end_time TIMESTAMP WITH TIME ZONE NOT NULL, -- last observation while open, flip time once closed
+    observation_count INTEGER NOT NULL DEFAULT 1,
+    is_open BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+-- Latest state per spot, upserted by ingest alongside each event
+CREATE TABLE spot_current_state (
+    spot_id VARCHAR PRIMARY KEY REFERENCES spots(id) ON DELETE CASCADE,
+    camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
+    occupied BOOLEAN NOT NULL,
+    since TIMESTAMP WITH TIME ZONE NOT NULL, -- when the spot entered its current state
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL
 );
 
 CREATE TABLE health_logs (
+    id BIGSERIAL,
+    camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status device_status NOT NULL,
+    message TEXT,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Partitions: created ahead by the maintenance runner, plus a DEFAULT catch-all, e.g.
+-- CREATE TABLE occupancy_events_p202501 PARTITION OF occupancy_events
+--     FOR VALUES FROM ('2025-01-01') TO ('2025-02-01');
+CREATE TABLE occupancy_events_default PARTITION OF occupancy_events DEFAULT;
+CREATE TABLE spot_observations_default PARTITION OF spot_observations DEFAULT;
+CREATE TABLE health_logs_default PARTITION OF health_logs DEFAULT;
+
+-- Compacted history (database/compaction.py)
+CREATE TABLE occupancy_event_summaries (
+    camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    bucket_seconds INTEGER NOT NULL,
+    event_count INTEGER NOT NULL,
+    min_occupied INTEGER NOT NULL,
+    max_occupied INTEGER NOT NULL,
+    sum_occupied BIGINT NOT NULL,
+    max_total_slots INTEGER NOT NULL,
+    PRIMARY KEY (camera_id, bucket_start)
+);
+
+CREATE TABLE health_status_intervals (
     id BIGSERIAL PRIMARY KEY,
     camera_id UUID NOT NULL REFERENCES cameras(id) ON DELETE CASCADE,
-    timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     status device_status NOT NULL,
-    message TEXT
+    start_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    end_time TIMESTAMP WITH TIME ZONE NOT NULL, -- last heartbeat in the run
+    heartbeat_count INTEGER NOT NULL DEFAULT 1,
+    last_message TEXT
+);
+
+-- Hourly/daily rollups maintained by the maintenance runner (derived data, no foreign keys)
+CREATE TABLE spot_occupancy_rollups (
+    spot_id VARCHAR NOT NULL,
+    granularity VARCHAR NOT NULL, -- 'hour' | 'day'
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    location_id UUID NOT NULL,
+    occupied_seconds FLOAT NOT NULL DEFAULT 0,
+    observed_seconds FLOAT NOT NULL DEFAULT 0,
+    observation_count INTEGER NOT NULL DEFAULT 0,
+    flips INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (spot_id, granularity, bucket_start)
+);
+
+CREATE TABLE location_occupancy_rollups (
+    location_id UUID NOT NULL,
+    granularity VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    spot_count INTEGER NOT NULL DEFAULT 0,
+    occupied_seconds FLOAT NOT NULL DEFAULT 0,
+    observed_seconds FLOAT NOT NULL DEFAULT 0,
+    observation_count INTEGER NOT NULL DEFAULT 0,
+    flips INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (location_id, granularity, bucket_start)
+);
+
+CREATE TABLE camera_occupancy_rollups (
+    camera_id UUID NOT NULL,
+    granularity VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    location_id UUID,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    min_occupied INTEGER,
+    max_occupied INTEGER,
+    sum_occupied BIGINT NOT NULL DEFAULT 0,
+    max_total_slots INTEGER,
+    PRIMARY KEY (camera_id, granularity, bucket_start)
+);
+
+CREATE TABLE rollup_watermarks (
+    granularity VARCHAR PRIMARY KEY,
+    high_water TIMESTAMP WITH TIME ZONE NOT NULL, -- every bucket before this has been built
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Parquet files of archived history (database/archive.py)
+CREATE TABLE archive_manifest (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR NOT NULL,
+    range_start TIMESTAMP WITH TIME ZONE NOT NULL, -- inclusive
+    range_end TIMESTAMP WITH TIME ZONE NOT NULL,   -- exclusive
+    path VARCHAR NOT NULL,                         -- relative to ARCHIVE_DIR
+    row_count INTEGER NOT NULL,
+    file_bytes BIGINT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_archive_manifest_path UNIQUE (path)
+);
+
+-- Background deletes of cameras, locations and spots (database/purge.py)
+CREATE TABLE purge_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    entity_type VARCHAR NOT NULL, -- camera | location | spot
+    entity_id VARCHAR NOT NULL,
+    spot_ids JSONB,               -- spots removed along with a camera
+    status VARCHAR NOT NULL DEFAULT 'pending', -- pending | running | done
+    step VARCHAR,                 -- table or partition being purged
+    rows_deleted BIGINT NOT NULL DEFAULT 0,
+    progress JSONB,               -- rows deleted per table, last finished step
+    error VARCHAR,                -- last error; the job is retried on the next run
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP WITH TIME ZONE
 );
 
 -- Indices for performance
-CREATE INDEX idx_occupancy_camera_timestamp ON occupancy_events(camera_id, timestamp);
+CREATE INDEX idx_occupancy_camera_timestamp ON occupancy_events(camera_id, timestamp, id);
+CREATE INDEX idx_occupancy_timestamp ON occupancy_events(timestamp, id);
 CREATE INDEX idx_health_camera_timestamp ON health_logs(camera_id, timestamp);
-CREATE INDEX idx_spot_obs_spot_timestamp ON spot_observations(spot_id, timestamp);
+CREATE INDEX idx_spot_obs_spot_timestamp ON spot_observations(spot_id, timestamp, id) INCLUDE (occupied, camera_id);
+CREATE INDEX idx_spot_obs_timestamp_brin ON spot_observations USING brin (timestamp);
 CREATE INDEX idx_spots_location ON spots(location_id);
+CREATE INDEX idx_camera_spot_index_zone ON camera_spot_index(camera_id, zone_id);
+CREATE INDEX idx_spot_intervals_spot_start ON spot_state_intervals(spot_id, start_time, id);
+CREATE UNIQUE INDEX idx_spot_intervals_open ON spot_state_intervals(camera_id, spot_id) WHERE is_open;
+CREATE INDEX idx_spot_intervals_end ON spot_state_intervals(end_time);
+CREATE INDEX idx_health_intervals_camera_start ON health_status_intervals(camera_id, start_time);
+CREATE INDEX idx_spot_rollups_location_bucket ON spot_occupancy_rollups(location_id, granularity, bucket_start);
+CREATE INDEX idx_archive_manifest_table_range ON archive_manifest(table_name, range_start);
+CREATE INDEX idx_purge_jobs_status ON purge_jobs(status, id);
@@ -0,0 +1,147 @@
+"""
+Content-addressed snapshot storage.
+
+Annotated JPEG snapshots are kept outside Postgres, keyed by the SHA-256 of
+their bytes. `occupancy_events.metadata_json` only stores the reference
+(`snapshot_ref`), which the Control Plane resolves via `GET /snapshots/{ref}`.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Optional, Type
+
+# Configuration from Environment
+SNAPSHOT_BACKEND = os.getenv("SNAPSHOT_BACKEND", "local")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/data/snapshots")
+
+_REF_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_valid_ref(ref: str) -> bool:
+    """Snapshot references are lowercase hex SHA-256 digests."""
+    return bool(ref) and bool(_REF_PATTERN.match(ref))
+
+
+class SnapshotStore(ABC):
+    """
+    Interface for snapshot backends. Blobs are immutable once written.
+    A backend missing any method fails when it is instantiated, not on first use.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def get(self, ref: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def delete(self, ref: str) -> bool:
+        ...
+
+    @abstractmethod
+    def purge_older_than(self, cutoff: datetime) -> int:
+        """Delete blobs last written before `cutoff`. Returns the number removed."""
+
+
+class LocalSnapshotStore(SnapshotStore):
+    """Filesystem backend using a two-level hashed layout: `ab/cd/abcd....jpg`."""
+
+    def __init__(self, root: str = SNAPSHOT_DIR):
+        self.root = root
+
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.root, ref[:2], ref[2:4], f"{ref}.jpg")
+
+    def put(self, data: bytes) -> str:
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._path(ref)
+
+        if os.path.exists(path):
+            # Identical frame already stored; refresh mtime so retention counts from the latest write
+            os.utime(path, None)
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial JPEG
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return ref
+
+    def get(self, ref: str) -> Optional[bytes]:
+        if not is_valid_ref(ref):
+            return None
+        try:
+            with open(self._path(ref), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, ref: str) -> bool:
+        if not is_valid_ref(ref):
+            return False
+        try:
+            os.remove(self._path(ref))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def purge_older_than(self, cutoff: datetime) -> int:
+        cutoff_ts = cutoff.timestamp()
+        removed = 0
+        if not os.path.isdir(self.root):
+            return 0
+
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff_ts:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+            # Drop empty hash directories (but never the root itself)
+            if dirpath != self.root:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+        return removed
+
+
+# --- Backend registry ---
+
+_BACKENDS: Dict[str, Type[SnapshotStore]] = {
+    "local": LocalSnapshotStore,
+}
+
+_store: Optional[SnapshotStore] = None
+
+
+def register_backend(name: str, backend: Type[SnapshotStore]):
+    """Register an additional backend (e.g. object storage) selectable via SNAPSHOT_BACKEND."""
+    _BACKENDS[name] = backend
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Return the process-wide snapshot store configured from the environment."""
+    global _store
+    if _store is None:
+        backend = _BACKENDS.get(SNAPSHOT_BACKEND)
+        if backend is None:
+            raise RuntimeError(f"Unknown SNAPSHOT_BACKEND '{SNAPSHOT_BACKEND}'")
+        _store = backend()
+    return _store
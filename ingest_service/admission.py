@@ -0,0 +1,121 @@
+"""
+Admission control for the Ingest Service.
+
+Bounds the number of telemetry requests being processed at once and sheds load
+in priority order when the database falls behind:
+
+1. Snapshots   - dropped from events once in-flight work passes SNAPSHOT_SHED_RATIO
+2. Heartbeats  - rejected with 429 once in-flight work passes HEARTBEAT_SHED_RATIO
+3. Events      - queued for up to QUEUE_TIMEOUT_SEC, then rejected with 503
+
+Rejections carry `Retry-After` so workers back off instead of timing out.
+"""
+
+import asyncio
+import os
+from collections import Counter
+from typing import Dict
+
+# Configuration from Environment
+MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "32"))
+MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT_SEC = float(os.getenv("INGEST_QUEUE_TIMEOUT_SEC", "2.0"))
+SNAPSHOT_SHED_RATIO = float(os.getenv("INGEST_SNAPSHOT_SHED_RATIO", "0.5"))
+HEARTBEAT_SHED_RATIO = float(os.getenv("INGEST_HEARTBEAT_SHED_RATIO", "0.8"))
+RETRY_AFTER_SEC = int(os.getenv("INGEST_RETRY_AFTER_SEC", "2"))
+
+EVENT = "event"
+HEARTBEAT = "heartbeat"
+
+
+class Shed(Exception):
+    """Raised when a request is refused admission."""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_queue: int = MAX_QUEUE,
+        queue_timeout: float = QUEUE_TIMEOUT_SEC,
+        snapshot_shed_ratio: float = SNAPSHOT_SHED_RATIO,
+        heartbeat_shed_ratio: float = HEARTBEAT_SHED_RATIO,
+        retry_after: int = RETRY_AFTER_SEC,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.snapshot_limit = int(max_in_flight * snapshot_shed_ratio)
+        self.heartbeat_limit = int(max_in_flight * heartbeat_shed_ratio)
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.waiting = 0
+        self._slot_freed = asyncio.Condition()
+
+        self.accepted: Counter = Counter()
+        self.shed: Counter = Counter()
+        self.queued = 0
+        self.snapshots_shed = 0
+
+    def _backoff(self) -> int:
+        # Scale the hint with queue depth so a crowd of workers spreads out
+        return self.retry_after * (1 + self.waiting // max(self.max_in_flight, 1))
+
+    async def acquire(self, kind: str) -> bool:
+        """Admit a request or raise Shed. Returns True if the event's snapshot should be dropped."""
+        if kind == HEARTBEAT:
+            if self.in_flight >= self.heartbeat_limit:
+                self.shed[kind] += 1
+                raise Shed(429, self._backoff(), "Ingest busy, heartbeat shed")
+        elif self.in_flight >= self.max_in_flight:
+            await self._wait_for_slot(kind)
+
+        self.in_flight += 1
+        self.accepted[kind] += 1
+
+        shed_snapshot = kind == EVENT and self.in_flight > self.snapshot_limit
+        if shed_snapshot:
+            self.snapshots_shed += 1
+        return shed_snapshot
+
+    async def _wait_for_slot(self, kind: str):
+        if self.waiting >= self.max_queue:
+            self.shed[kind] += 1
+            raise Shed(503, self._backoff(), "Ingest overloaded, queue full")
+
+        self.waiting += 1
+        self.queued += 1
+        try:
+            async with self._slot_freed:
+                await asyncio.wait_for(
+                    self._slot_freed.wait_for(lambda: self.in_flight < self.max_in_flight),
+                    timeout=self.queue_timeout,
+                )
+        except asyncio.TimeoutError:
+            self.shed[kind] += 1
+            raise Shed(503, self._backoff(), "Ingest overloaded, queue timeout")
+        finally:
+            self.waiting -= 1
+
+    async def release(self):
+        self.in_flight -= 1
+        async with self._slot_freed:
+            self._slot_freed.notify()
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "accepted": dict(self.accepted),
+            "shed": dict(self.shed),
+            "queued": self.queued,
+            "snapshots_shed": self.snapshots_shed,
+        }
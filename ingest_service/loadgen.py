@@ -0,0 +1,298 @@
+"""
+Synthetic fleet load generator for the Ingest Service.
+
+Provisions N cameras x M spots directly in the database, then replays their
+events and heartbeats against a running ingest service and reports sustained
+throughput, latency percentiles, error rates and database growth.
+
+Example (ingest on :8001, Postgres or SQLite via DATABASE_URL):
+    python loadgen.py --cameras 200 --spots 40 --event-interval 5 --duration 120
+    python loadgen.py --cameras 50 --encoding msgpack --burst --duration 60 --cleanup
+"""
+
+import argparse
+import base64
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.db import SessionLocal, engine
+from database.models import (
+    Base, Camera, CameraSpotIndex, DesiredState, HealthLog, HealthStatusInterval, Location, OccupancyEvent, OccupancyEventSummary, Spot,
+    SpotCurrentState, SpotObservation, SpotStateInterval,
+)
+from telemetry_codec import MSGPACK_CONTENT_TYPE, PackedOccupancy, encode_occupancy, pack_bits, spot_table_version
+
+
+class SimCamera:
+    def __init__(self, camera_id: uuid.UUID, spot_ids: List[str]):
+        self.id = camera_id
+        self.spot_ids = spot_ids
+        self.version = spot_table_version(spot_ids)
+        self.states = [random.random() < 0.5 for _ in spot_ids]
+        self.lock = threading.Lock()
+
+    def step(self, churn: float) -> List[bool]:
+        with self.lock:
+            self.states = [not s if random.random() < churn else s for s in self.states]
+            return list(self.states)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {"event": [], "heartbeat": []}
+        self.status: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def record(self, kind: str, latency: float, status):
+        with self.lock:
+            self.status[(kind, status)] += 1
+            if status == 200:
+                self.latencies[kind].append(latency)
+            else:
+                self.errors[kind] += 1
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def database_size_bytes() -> int:
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            return conn.execute(text("SELECT pg_database_size(current_database())")).scalar()
+        if engine.dialect.name == "sqlite":
+            page_count = conn.execute(text("PRAGMA page_count")).scalar()
+            page_size = conn.execute(text("PRAGMA page_size")).scalar()
+            return page_count * page_size
+    return 0
+
+
+# --- Provisioning ---
+
+def provision(n_cameras: int, n_spots: int) -> Tuple[uuid.UUID, List[SimCamera]]:
+    """Create one location with N cameras, each owning M spots."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        location = Location(name=f"loadgen-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}")
+        db.add(location)
+        db.flush()
+
+        sims = []
+        for c in range(n_cameras):
+            zone_ids = [f"C{c:04d}-S{s:03d}" for s in range(n_spots)]
+            geometry = [{"id": z, "points": [[0, 0], [10, 0], [10, 10], [0, 10]]} for z in zone_ids]
+            camera = Camera(
+                name=f"loadgen-cam-{c:04d}",
+                location_id=location.id,
+                stream_url="loadgen://synthetic",
+                geometry=geometry,
+                desired_state=DesiredState.STOPPED,
+            )
+            db.add(camera)
+            db.add_all(Spot(id=f"{location.id}:{z}", location_id=location.id, name=z) for z in zone_ids)
+            db.flush()
+            sims.append(SimCamera(camera.id, zone_ids))
+
+        db.commit()
+        return location.id, sims
+    finally:
+        db.close()
+
+
+def cleanup(location_id: uuid.UUID):
+    db = SessionLocal()
+    try:
+        camera_ids = db.query(Camera.id).filter(Camera.location_id == location_id)
+        db.query(SpotObservation).filter(SpotObservation.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(SpotStateInterval).filter(SpotStateInterval.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(SpotCurrentState).filter(SpotCurrentState.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(OccupancyEvent).filter(OccupancyEvent.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(HealthLog).filter(HealthLog.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(OccupancyEventSummary).filter(OccupancyEventSummary.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(HealthStatusInterval).filter(HealthStatusInterval.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(CameraSpotIndex).filter(CameraSpotIndex.camera_id.in_(camera_ids)).delete(synchronize_session=False)
+        db.query(Spot).filter(Spot.location_id == location_id).delete(synchronize_session=False)
+        db.query(Camera).filter(Camera.location_id == location_id).delete(synchronize_session=False)
+        db.query(Location).filter(Location.id == location_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- Traffic ---
+
+def send_event(client: httpx.Client, args, sim: SimCamera, snapshot: bytes, stats: Stats, due: Optional[float] = None):
+    states = sim.step(args.churn)
+    occupied = sum(states)
+    now = datetime.now(timezone.utc)
+    url = f"{args.ingest_url}/cameras/{sim.id}/event"
+
+    if args.encoding == "msgpack":
+        body = encode_occupancy(PackedOccupancy(
+            timestamp=now,
+            occupied_count=occupied,
+            free_count=len(states) - occupied,
+            total_slots=len(states),
+            spot_table_version=sim.version,
+            spot_bits=pack_bits(states),
+            snapshot=snapshot or None,
+        ))
+        request = dict(content=body, headers={"Content-Type": MSGPACK_CONTENT_TYPE})
+    else:
+        request = dict(json={
+            "timestamp": now.isoformat(),
+            "occupied_count": occupied,
+            "free_count": len(states) - occupied,
+            "total_slots": len(states),
+            "metadata_json": {
+                "spot_details": [{"spot_id": s, "occupied": o} for s, o in zip(sim.spot_ids, states)],
+                "snapshot": base64.b64encode(snapshot).decode() if snapshot else None,
+            },
+        })
+    _timed_post(client, url, "event", stats, due, **request)
+
+
+def send_heartbeat(client: httpx.Client, args, sim: SimCamera, stats: Stats, due: Optional[float] = None):
+    url = f"{args.ingest_url}/cameras/{sim.id}/heartbeat"
+    _timed_post(client, url, "heartbeat", stats, due, json={"status": "healthy", "message": "loadgen"})
+
+
+def _timed_post(client: httpx.Client, url: str, kind: str, stats: Stats, due: Optional[float] = None, **kwargs):
+    """
+    POST and record the latency. With `due` (the time.monotonic() the request was scheduled for),
+    latency includes time spent queued behind slow requests, so a stalling server is not under-reported.
+    """
+    started = time.monotonic() if due is None else due
+    try:
+        status = client.post(url, **kwargs).status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    stats.record(kind, time.monotonic() - started, status)
+
+
+def run_paced(args, sims: List[SimCamera], snapshot: bytes, stats: Stats):
+    """Open-loop schedule: each camera fires on its own interval regardless of response times."""
+    start = time.monotonic()
+    deadline = start + args.duration
+    schedule = []
+    for i, sim in enumerate(sims):
+        # Stagger cameras across the interval like a real fleet
+        heapq.heappush(schedule, (start + random.uniform(0, args.event_interval), i, "event"))
+        heapq.heappush(schedule, (start + random.uniform(0, args.heartbeat_interval), i, "heartbeat"))
+
+    with httpx.Client(timeout=args.timeout) as client, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while schedule:
+            due, i, kind = heapq.heappop(schedule)
+            if due >= deadline:
+                break
+            time.sleep(max(0.0, due - time.monotonic()))
+            if kind == "event":
+                pool.submit(send_event, client, args, sims[i], snapshot, stats, due)
+                heapq.heappush(schedule, (due + args.event_interval, i, kind))
+            else:
+                pool.submit(send_heartbeat, client, args, sims[i], stats, due)
+                heapq.heappush(schedule, (due + args.heartbeat_interval, i, kind))
+
+
+def run_burst(args, sims: List[SimCamera], snapshot: bytes, stats: Stats):
+    """Closed-loop saturation: every thread sends events back-to-back to find the ceiling."""
+    deadline = time.monotonic() + args.duration
+
+    def loop(offset: int):
+        n = offset
+        while time.monotonic() < deadline:
+            send_event(client, args, sims[n % len(sims)], snapshot, stats)
+            n += args.concurrency
+
+    with httpx.Client(timeout=args.timeout) as client, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for offset in range(args.concurrency):
+            pool.submit(loop, offset)
+
+
+def report(args, stats: Stats, elapsed: float, size_before: int, size_after: int):
+    print("\n=== Ingest load report ===")
+    print(f"Fleet: {args.cameras} cameras x {args.spots} spots, encoding={args.encoding}, "
+          f"{'burst' if args.burst else f'event every {args.event_interval}s'}, churn={args.churn}")
+    for kind, latencies in stats.latencies.items():
+        sent = sum(v for (k, _), v in stats.status.items() if k == kind)
+        if not sent:
+            continue
+        errors = stats.errors[kind]
+        print(f"{kind:>9}: sent={sent} ok={len(latencies)} rate={len(latencies) / elapsed:.1f}/s "
+              f"errors={errors} ({errors / sent:.1%}) "
+              f"p50={percentile(latencies, 50) * 1000:.1f}ms p95={percentile(latencies, 95) * 1000:.1f}ms "
+              f"p99={percentile(latencies, 99) * 1000:.1f}ms")
+
+    by_status = {f"{kind}:{status}": n for (kind, status), n in sorted(stats.status.items(), key=str) if status != 200}
+    if by_status:
+        print(f"Non-200 responses: {by_status}")
+
+    growth = size_after - size_before
+    print(f"Database growth: {growth / 1e6:.2f} MB in {elapsed:.0f}s -> {growth / elapsed * 3600 / 1e6:.1f} MB/hour")
+
+    try:
+        metrics = httpx.get(f"{args.ingest_url}/metrics", timeout=5).json()
+        print(f"Ingest admission: {metrics.get('admission')}")
+    except (httpx.HTTPError, ValueError):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a camera fleet against the ingest service")
+    parser.add_argument("--ingest-url", default=os.getenv("INGEST_SERVICE_URL", "http://localhost:8001"))
+    parser.add_argument("--cameras", type=int, default=20)
+    parser.add_argument("--spots", type=int, default=30, help="Spots per camera")
+    parser.add_argument("--event-interval", type=float, default=5.0, help="Seconds between events per camera")
+    parser.add_argument("--heartbeat-interval", type=float, default=60.0, help="Seconds between heartbeats per camera")
+    parser.add_argument("--churn", type=float, default=0.02, help="Probability a spot flips state per event")
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--snapshot-bytes", type=int, default=0, help="Attach a synthetic snapshot of this size")
+    parser.add_argument("--burst", action="store_true", help="Send back-to-back instead of on the schedule")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to generate load")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent HTTP senders")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Per-request timeout (matches the worker)")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic fleet and its history afterwards")
+    args = parser.parse_args()
+
+    print(f"Provisioning {args.cameras} cameras x {args.spots} spots in {engine.url.render_as_string(hide_password=True)}...")
+    location_id, sims = provision(args.cameras, args.spots)
+    snapshot = os.urandom(args.snapshot_bytes) if args.snapshot_bytes else b""
+
+    stats = Stats()
+    size_before = database_size_bytes()
+    started = time.monotonic()
+    try:
+        (run_burst if args.burst else run_paced)(args, sims, snapshot, stats)
+    except KeyboardInterrupt:
+        print("Interrupted, reporting partial results")
+    elapsed = time.monotonic() - started
+    size_after = database_size_bytes()
+
+    report(args, stats, elapsed, size_before, size_after)
+
+    if args.cleanup:
+        cleanup(location_id)
+        print(f"Removed synthetic location {location_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ Ingest Service: Receives telemetry from Vision Workers and writes to DB.
 Separated from Control Plane for scalability (high-frequency writes).
 """
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, PrivateAttr, ValidationError
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Set, Tuple
+import base64
+import binascii
 import uuid
 import os
 import sys
@@ -16,8 +22,21 @@ import sys
 # Path hack to access shared database module
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database.db import get_db
-from database.models import Camera, OccupancyEvent, HealthLog, Spot, SpotObservation, DeviceStatus
+from database import queries
+from database.changes import publish_camera_status, publish_spot_changes
+from database.db import get_db, pool_metrics
+from database.models import (
+    Camera, CameraSpotIndex, OccupancyEvent, HealthLog, SpotCurrentState, SpotObservation, SpotStateInterval, DeviceStatus,
+    pack_spot_states, unpack_spot_states,
+)
+from database.snapshot_store import get_snapshot_store
+from admission import EVENT, HEARTBEAT, AdmissionController, Shed
+from telemetry_codec import MSGPACK_CONTENT_TYPES, PackedOccupancy, decode_occupancy, spot_table, spot_table_version
+
+# Per-sample spot_observations rows can be disabled once consumers read spot_state_intervals
+RECORD_SPOT_OBSERVATIONS = os.getenv("RECORD_SPOT_OBSERVATIONS", "true").lower() == "true"
+# A gap longer than this between observations starts a new interval instead of extending the open one
+SPOT_INTERVAL_MAX_GAP_SEC = float(os.getenv("SPOT_INTERVAL_MAX_GAP_SEC", "900"))
 
 app = FastAPI(title="Telemetry Ingest Service")
 
@@ -29,6 +48,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+admission = AdmissionController()
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Bound in-flight telemetry writes and shed low-priority work under load."""
+    if request.method != "POST":
+        return await call_next(request)
+
+    path = request.url.path
+    if path.endswith("/event"):
+        kind = EVENT
+    elif path.endswith("/heartbeat"):
+        kind = HEARTBEAT
+    else:
+        return await call_next(request)
+
+    try:
+        request.state.shed_snapshot = await admission.acquire(kind)
+    except Shed as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": e.reason},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    try:
+        return await call_next(request)
+    finally:
+        await admission.release()
+
 # --- Pydantic Schemas (duplicated from control_plane for independence) ---
 
 class OccupancyUpdate(BaseModel):
@@ -38,11 +88,221 @@ class OccupancyUpdate(BaseModel):
     total_slots: int
     metadata_json: Optional[Dict[str, Any]] = None
 
+    # Set only when the event arrived in the compact binary encoding
+    _packed: Optional[PackedOccupancy] = PrivateAttr(default=None)
+
 class HealthUpdate(BaseModel):
     status: DeviceStatus
     message: Optional[str] = None
 
 
+# --- Helpers ---
+
+def _store_snapshot(data: bytes) -> Optional[str]:
+    """Write JPEG bytes to the snapshot store and return the reference."""
+    try:
+        return get_snapshot_store().put(data)
+    except OSError as e:
+        # Losing a snapshot is preferable to losing the occupancy event
+        print(f"Snapshot store write failed: {e}")
+        return None
+
+
+def _offload_snapshot(metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Move an inline base64 snapshot into the snapshot store, keeping only its reference."""
+    if not metadata or not metadata.get("snapshot"):
+        return metadata
+
+    metadata = dict(metadata)
+    snapshot = metadata.pop("snapshot")
+    try:
+        data = base64.b64decode(snapshot, validate=True)
+    except (binascii.Error, ValueError) as e:
+        print(f"Discarding malformed snapshot: {e}")
+        return metadata
+
+    ref = _store_snapshot(data)
+    if ref:
+        metadata["snapshot_ref"] = ref
+    return metadata
+
+
+def _unpack_spot_states(packed: PackedOccupancy, db_camera: Camera) -> Tuple[List[str], List[bool]]:
+    """Check a binary spot bitmap against the camera's spot table; returns zone IDs and their states."""
+    spot_ids = spot_table(db_camera.geometry)
+    if spot_table_version(spot_ids) != packed.spot_table_version:
+        # Worker is running with stale geometry; it must refresh config before we can map bits to spots
+        raise HTTPException(status_code=409, detail="Spot table version mismatch")
+
+    try:
+        states = unpack_spot_states(packed.spot_bits, len(spot_ids))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return spot_ids, states
+
+
+def _split_spot_details(metadata: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], List[str], List[bool]]:
+    """Take `spot_details` out of JSON metadata; per-spot states are stored as a bit vector instead."""
+    if not metadata or "spot_details" not in metadata:
+        return metadata, [], []
+
+    metadata = dict(metadata)
+    details = metadata.pop("spot_details") or []
+    spot_ids, states = [], []
+    for spot in details:
+        if isinstance(spot, dict) and spot.get("spot_id") is not None:
+            spot_ids.append(str(spot["spot_id"]))
+            states.append(bool(spot.get("occupied")))
+    return metadata, spot_ids, states
+
+
+def _as_utc(ts: datetime) -> datetime:
+    """Normalize DB timestamps (naive on SQLite) to aware UTC for comparison."""
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
+
+
+def _record_spot_states(db: Session, camera_id: uuid.UUID, states: Dict[str, bool], timestamp: datetime):
+    """Extend or close each spot's open state interval, and optionally log raw observations."""
+    timestamp = _as_utc(timestamp)
+    if RECORD_SPOT_OBSERVATIONS:
+        # One executemany instead of an ORM object per spot
+        db.execute(SpotObservation.__table__.insert(), [
+            {"spot_id": spot_id, "camera_id": camera_id, "occupied": occupied, "timestamp": timestamp}
+            for spot_id, occupied in states.items()
+        ])
+
+    # Core statements throughout, like the observations above: no ORM object per spot.
+    # Open intervals are locked (in spot order, so concurrent requests cannot deadlock) until this event commits.
+    table = SpotStateInterval.__table__
+    open_intervals = {row.spot_id: row for row in db.execute(queries.open_intervals(camera_id, states.keys()))}
+    extended, flipped, lost, opened = [], [], [], []
+
+    for spot_id, occupied in states.items():
+        interval = open_intervals.get(spot_id)
+        if interval is not None:
+            last_seen = _as_utc(interval.end_time)
+            if timestamp < last_seen:
+                continue # Late, out-of-order sample; the interval already covers a later time
+
+            gap = (timestamp - last_seen).total_seconds()
+            if gap > SPOT_INTERVAL_MAX_GAP_SEC:
+                lost.append(interval.id) # We lost sight of the spot: close at the last sighting
+            elif interval.occupied != occupied:
+                flipped.append(interval.id) # State flipped: close at the flip
+            else:
+                extended.append(interval.id)
+                continue
+
+        opened.append({"spot_id": spot_id, "camera_id": camera_id, "occupied": occupied, "start_time": timestamp,
+                       "end_time": timestamp, "observation_count": 1, "is_open": True})
+
+    # Every extended or flipped interval ends at this sample, so each kind of change is one UPDATE
+    if extended:
+        db.execute(update(table).where(table.c.id.in_(extended))
+                   .values(end_time=timestamp, observation_count=table.c.observation_count + 1))
+    if flipped:
+        db.execute(update(table).where(table.c.id.in_(flipped)).values(end_time=timestamp, is_open=False))
+    if lost:
+        db.execute(update(table).where(table.c.id.in_(lost)).values(is_open=False))
+    if not opened:
+        return
+    insert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        db.execute(table.insert(), opened)
+        return
+    # A concurrent request may have opened the spot's first interval meanwhile; its interval stands
+    db.execute(insert(table).on_conflict_do_nothing(
+        index_elements=[table.c.camera_id, table.c.spot_id], index_where=table.c.is_open,
+    ), opened)
+
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _upsert_current_state(db: Session, camera_id: uuid.UUID, states: Dict[str, bool], timestamp: datetime) -> List[Tuple[str, bool]]:
+    """
+    Upsert spot_current_state in the event's transaction. `since` only moves when the state flips.
+    Returns the spots that flipped (or were seen for the first time) as (spot_id, occupied).
+    """
+    timestamp = _as_utc(timestamp)
+    insert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        # Portable fallback for other dialects: read-modify-write through the ORM
+        changes = []
+        for spot_id, occupied in states.items():
+            current = db.get(SpotCurrentState, spot_id)
+            if current is None:
+                db.add(SpotCurrentState(spot_id=spot_id, camera_id=camera_id, occupied=occupied, since=timestamp, last_seen=timestamp))
+                changes.append((spot_id, occupied))
+            elif _as_utc(current.last_seen) <= timestamp:
+                if current.occupied != occupied:
+                    current.since = timestamp
+                    changes.append((spot_id, occupied))
+                current.camera_id, current.occupied, current.last_seen = camera_id, occupied, timestamp
+        return changes
+
+    # `since` equals this sample's time exactly when the row was inserted or flipped
+    rows = db.execute(queries.current_state_upsert(insert, camera_id, states, timestamp))
+    return [(spot_id, occupied) for spot_id, occupied, since in rows if _as_utc(since) == timestamp]
+
+
+# (camera_id, spot table version) pairs known to be in camera_spot_index
+_registered_spot_tables: Set[Tuple[uuid.UUID, int]] = set()
+
+
+def _register_spot_table(db: Session, camera_id: uuid.UUID, version: int, spot_ids: List[str]):
+    """Record the bit position of each zone for this spot table version, once per camera and version."""
+    if (camera_id, version) in _registered_spot_tables:
+        return
+    exists = db.query(CameraSpotIndex.position)\
+        .filter(CameraSpotIndex.camera_id == camera_id, CameraSpotIndex.table_version == version).first()
+    if exists:
+        return
+
+    rows = [{"camera_id": camera_id, "table_version": version, "position": i, "zone_id": s_id} for i, s_id in enumerate(spot_ids)]
+    insert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        for row in rows:
+            db.merge(CameraSpotIndex(**row))
+        return
+    # Another ingest replica may register the same table concurrently
+    db.execute(insert(CameraSpotIndex.__table__).values(rows).on_conflict_do_nothing())
+
+
+async def read_occupancy_update(request: Request) -> OccupancyUpdate:
+    """Parse an occupancy event body as JSON or MessagePack, negotiated by Content-Type."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    body = await request.body()
+    # Admission control drops snapshots first when ingest is under pressure
+    shed_snapshot = getattr(request.state, "shed_snapshot", False)
+
+    if content_type in MSGPACK_CONTENT_TYPES:
+        try:
+            packed = decode_occupancy(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if shed_snapshot:
+            packed.snapshot = None
+        # Fields were type-checked by the decoder; skip per-field Pydantic validation
+        update = OccupancyUpdate.model_construct(
+            timestamp=packed.timestamp,
+            occupied_count=packed.occupied_count,
+            free_count=packed.free_count,
+            total_slots=packed.total_slots,
+            metadata_json=None,
+        )
+        update._packed = packed
+        return update
+
+    try:
+        update = OccupancyUpdate.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    if shed_snapshot and update.metadata_json:
+        update.metadata_json.pop("snapshot", None)
+    return update
+
+
 # --- Endpoints ---
 
 @app.get("/health")
@@ -50,57 +310,89 @@ async def health():
     return {"status": "ingest service online"}
 
 
-@app.post("/cameras/{camera_id}/event")
-def camera_event(camera_id: uuid.UUID, update: OccupancyUpdate, db: Session = Depends(get_db)):
+@app.get("/metrics")
+async def metrics():
+    """Admission counters (accepted, shed and queued requests) and database pool usage."""
+    return {"admission": admission.metrics(), "db_pool": pool_metrics()}
+
+
+@app.post(
+    "/cameras/{camera_id}/event",
+    openapi_extra={"requestBody": {"content": {
+        "application/json": {"schema": OccupancyUpdate.model_json_schema()},
+        "application/msgpack": {"schema": {"type": "string", "format": "binary"}},
+    }}},
+)
+def camera_event(camera_id: uuid.UUID, update: OccupancyUpdate = Depends(read_occupancy_update), db: Session = Depends(get_db)):
     """Receive occupancy event from a Vision Worker and persist to database."""
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    db_camera = queries.active_camera(db, camera_id).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
+    packed = update._packed
+    if packed is not None:
+        spot_ids, spot_states = _unpack_spot_states(packed, db_camera)
+        spot_bits, version = packed.spot_bits, packed.spot_table_version
+        ref = _store_snapshot(packed.snapshot) if packed.snapshot else None
+        metadata = {"snapshot_ref": ref} if ref else None
+    else:
+        metadata, spot_ids, spot_states = _split_spot_details(_offload_snapshot(update.metadata_json))
+        spot_bits = pack_spot_states(spot_states) if spot_ids else None
+        version = spot_table_version(spot_ids) if spot_ids else None
+    
     # Update camera last event timestamp
     db_camera.last_event_time = update.timestamp
     
-    # Create event record
+    # Create event record (snapshot bytes live in the snapshot store, per-spot states in the bit vector)
     event = OccupancyEvent(
         camera_id=camera_id,
         timestamp=update.timestamp,
         occupied_count=update.occupied_count,
         free_count=update.free_count,
         total_slots=update.total_slots,
-        metadata_json=update.metadata_json
+        metadata_json=metadata or None,
+        spot_table_version=version,
+        spot_states=spot_bits,
     )
     db.add(event)
+    if spot_ids:
+        _register_spot_table(db, camera_id, version, spot_ids)
     
-    # Populate spot_observations if camera is linked to a location
-    if db_camera.location_id and update.metadata_json and "spot_details" in update.metadata_json:
-        valid_spot_ids = {s[0] for s in db.query(Spot.id).filter(Spot.location_id == db_camera.location_id).all()}
+    # Record per-spot state if camera is linked to a location
+    if db_camera.location_id and spot_ids:
+        valid_spot_ids = {s[0] for s in queries.location_spot_ids(db, db_camera.location_id)}
         
-        for spot in update.metadata_json["spot_details"]:
-            s_id = spot["spot_id"]
-            prefixed_id = f"{db_camera.location_id}:{s_id}"
+        states = {}
+        for zone_id, occupied in zip(spot_ids, spot_states):
+            prefixed_id = f"{db_camera.location_id}:{zone_id}"
             if prefixed_id in valid_spot_ids:
-                obs = SpotObservation(
-                    spot_id=prefixed_id,
-                    camera_id=camera_id,
-                    occupied=bool(spot["occupied"]),
-                    timestamp=update.timestamp
-                )
-                db.add(obs)
+                states[prefixed_id] = occupied
+        
+        if states:
+            _record_spot_states(db, camera_id, states, update.timestamp)
+            changes = _upsert_current_state(db, camera_id, states, update.timestamp)
+            if changes:
+                # Delivered to live dashboards when this transaction commits
+                publish_spot_changes(db, camera_id, db_camera.location_id, update.timestamp, changes)
     
     db.commit()
+    if spot_ids:
+        _registered_spot_tables.add((camera_id, version))
     return {"received": True}
 
 
 @app.post("/cameras/{camera_id}/heartbeat")
 def camera_heartbeat(camera_id: uuid.UUID, update: HealthUpdate, db: Session = Depends(get_db)):
     """Receive heartbeat from a Vision Worker to indicate liveness."""
-    db_camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    db_camera = queries.active_camera(db, camera_id).first()
     if not db_camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
     # Update heartbeat time and status
     from datetime import timezone
     db_camera.last_heartbeat = datetime.now(timezone.utc)
+    if db_camera.status != update.status:
+        publish_camera_status(db, camera_id, update.status.value)
     db_camera.status = update.status
     
     # Log health event
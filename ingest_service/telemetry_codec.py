@@ -0,0 +1,105 @@
+"""
+Compact binary telemetry encoding (MessagePack), negotiated by Content-Type.
+
+Duplicated in vision_worker/telemetry_codec.py for independence; keep both in sync.
+The bit packing here is database/models.py's, the same form stored in
+occupancy_events.spot_states; the worker's copy is the only other one.
+
+Occupancy payload (MessagePack map):
+    ts    float   event time, UTC epoch seconds
+    occ   int     occupied_count
+    free  int     free_count
+    total int     total_slots
+    ver   int     spot table version (see spot_table_version)
+    bits  bytes   packed spot states, one bit per spot in spot table order (LSB first)
+    snap  bytes   optional annotated JPEG (raw, not base64)
+"""
+
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import msgpack
+
+from database.models import pack_spot_states, unpack_spot_states
+
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+MSGPACK_CONTENT_TYPES = {MSGPACK_CONTENT_TYPE, "application/x-msgpack"}
+
+
+@dataclass
+class PackedOccupancy:
+    timestamp: datetime
+    occupied_count: int
+    free_count: int
+    total_slots: int
+    spot_table_version: int
+    spot_bits: bytes
+    snapshot: Optional[bytes] = None
+
+
+def spot_table(geometry: Any) -> List[str]:
+    """Ordered spot IDs for a camera, matching the worker's zone order."""
+    if not isinstance(geometry, list):
+        return []
+    return [
+        zone.get("id", f"spot_{i+1}") if isinstance(zone, dict) else f"spot_{i+1}"
+        for i, zone in enumerate(geometry)
+    ]
+
+
+def spot_table_version(spot_ids: Iterable[str]) -> int:
+    """Stable fingerprint of the ordered spot table, so both sides agree on bit positions."""
+    return zlib.crc32("\x1f".join(str(s) for s in spot_ids).encode("utf-8"))
+
+
+def pack_bits(states: Iterable[bool]) -> bytes:
+    return pack_spot_states(states)
+
+
+def unpack_bits(data: bytes, count: int) -> List[bool]:
+    return unpack_spot_states(data, count)
+
+
+def encode_occupancy(packed: PackedOccupancy) -> bytes:
+    payload: Dict[str, Any] = {
+        "ts": packed.timestamp.timestamp(),
+        "occ": packed.occupied_count,
+        "free": packed.free_count,
+        "total": packed.total_slots,
+        "ver": packed.spot_table_version,
+        "bits": packed.spot_bits,
+    }
+    if packed.snapshot:
+        payload["snap"] = packed.snapshot
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def decode_occupancy(body: bytes) -> PackedOccupancy:
+    """Decode a MessagePack occupancy payload. Raises ValueError on malformed input."""
+    try:
+        data = msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack body: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Payload must be a map")
+
+    try:
+        snapshot = data.get("snap")
+        bits = data["bits"]
+        if not isinstance(bits, bytes) or (snapshot is not None and not isinstance(snapshot, bytes)):
+            raise ValueError("'bits' and 'snap' must be binary")
+        return PackedOccupancy(
+            timestamp=datetime.fromtimestamp(float(data["ts"]), tz=timezone.utc),
+            occupied_count=int(data["occ"]),
+            free_count=int(data["free"]),
+            total_slots=int(data["total"]),
+            spot_table_version=int(data["ver"]),
+            spot_bits=bits,
+            snapshot=snapshot,
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing field {e}")
+    except (TypeError, OverflowError, OSError) as e:
+        raise ValueError(f"Invalid field value: {e}")
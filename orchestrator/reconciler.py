@@ -9,6 +9,7 @@ CONTROL_PLANE_URL = os.getenv("CONTROL_PLANE_URL", "http://control-plane:8000")
 INGEST_SERVICE_URL = os.getenv("INGEST_SERVICE_URL", "http://ingest-service:8001")
 RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "10"))
 WORKER_IMAGE = os.getenv("WORKER_IMAGE", "parking-vision-worker:latest")
+WORKER_TELEMETRY_ENCODING = os.getenv("WORKER_TELEMETRY_ENCODING", "json")  # json | msgpack
 
 def get_desired_state():
     try:
@@ -113,6 +114,7 @@ def start_worker(camera):
         "-e", f"API_ENDPOINT={INGEST_SERVICE_URL}",
         "-e", f"CONFIG_ENDPOINT={CONTROL_PLANE_URL}",
         "-e", f"POLL_INTERVAL={camera['processing_interval_sec']}",
+        "-e", f"TELEMETRY_ENCODING={WORKER_TELEMETRY_ENCODING}",
         "-e", f"ZONE_CONFIG={json.dumps(camera['geometry'])}",
         "-e", f"DETECTION_CLASSES={json.dumps(camera.get('detection_classes', [2, 3, 5, 7]))}",
         "-e", f"DETECTION_CONFIDENCE={camera.get('detection_confidence', 0.25)}",
@@ -2,12 +2,14 @@ import cv2
 import time
 import os
 import json
+import random
 import requests
 import threading
 from datetime import datetime, timezone
 from ultralytics import YOLO
 import numpy as np
 import base64
+from telemetry_codec import MSGPACK_CONTENT_TYPE, PackedOccupancy, encode_occupancy, pack_bits, spot_table_version
 try:
     from sahi import AutoDetectionModel
     from sahi.predict import get_sliced_prediction
@@ -23,6 +25,9 @@ class VisionWorker:
         self.api_endpoint = os.getenv("API_ENDPOINT")  # Telemetry: http://ingest-service:8001
         self.config_endpoint = os.getenv("CONFIG_ENDPOINT", os.getenv("API_ENDPOINT"))  # Config: http://control-plane:8000
         self.interval = float(os.getenv("POLL_INTERVAL", "5.0"))
+        self.telemetry_encoding = os.getenv("TELEMETRY_ENCODING", "json").lower()  # json | msgpack
+        self.telemetry_max_retries = int(os.getenv("TELEMETRY_MAX_RETRIES", "3"))
+        self.telemetry_max_backoff = float(os.getenv("TELEMETRY_MAX_BACKOFF_SEC", "30"))
         self.model_path = os.getenv("MODEL_PATH", "yolo26x.pt")
         
         # Advanced Vision Config
@@ -248,35 +253,78 @@ class VisionWorker:
                 cv2.polylines(annotated_frame, [poly], True, color, 2)
 
             _, buffer = cv2.imencode('.jpg', annotated_frame)
-            jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+            jpg_bytes = buffer.tobytes()
             
         except Exception as e:
             print(f"Inference error: {e}")
-            jpg_as_text = None
+            jpg_bytes = None
 
         # POST Telemetry
+        timestamp = datetime.now(timezone.utc)
+        url = f"{self.api_endpoint}/cameras/{self.camera_id}/event"
+        
+        try:
+            if self.telemetry_encoding == "msgpack":
+                resp = self._post_packed_event(url, timestamp, occupied_count, spot_results, jpg_bytes)
+                if resp.status_code == 409:
+                    # Ingest has a different spot table; pick up the new geometry and send this report as JSON
+                    print("Spot table version mismatch, refreshing config")
+                    self._fetch_remote_config()
+                    self._post_json_event(url, timestamp, occupied_count, spot_results, jpg_bytes)
+            else:
+                self._post_json_event(url, timestamp, occupied_count, spot_results, jpg_bytes)
+            print(f"Reported: {occupied_count}/{self.total_slots} (with per-spot data)")
+        except Exception as e:
+            print(f"Failed to report: {e}")
+
+    def _post_json_event(self, url, timestamp, occupied_count, spot_results, jpg_bytes):
         payload = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": timestamp.isoformat(),
             "occupied_count": occupied_count,
             "free_count": self.total_slots - occupied_count,
             "total_slots": self.total_slots,
             "metadata_json": {
                 "spot_details": spot_results,
-                "snapshot": jpg_as_text
+                "snapshot": base64.b64encode(jpg_bytes).decode('utf-8') if jpg_bytes else None
             }
         }
-        
-        try:
-            url = f"{self.api_endpoint}/cameras/{self.camera_id}/event"
-            requests.post(url, json=payload, timeout=5)
-            print(f"Reported: {occupied_count}/{self.total_slots} (with per-spot data)")
-        except Exception as e:
-            print(f"Failed to report: {e}")
+        return self._post_with_backoff(url, json=payload, timeout=5)
+
+    def _post_packed_event(self, url, timestamp, occupied_count, spot_results, jpg_bytes):
+        """Send the event as MessagePack: spot states become a bitmap in zone order."""
+        body = encode_occupancy(PackedOccupancy(
+            timestamp=timestamp,
+            occupied_count=occupied_count,
+            free_count=self.total_slots - occupied_count,
+            total_slots=self.total_slots,
+            spot_table_version=spot_table_version(s["spot_id"] for s in spot_results),
+            spot_bits=pack_bits(s["occupied"] for s in spot_results),
+            snapshot=jpg_bytes,
+        ))
+        return self._post_with_backoff(url, data=body, headers={"Content-Type": MSGPACK_CONTENT_TYPE}, timeout=5)
+
+    def _post_with_backoff(self, url, retries=None, **kwargs):
+        """POST telemetry, waiting out Retry-After when ingest sheds load (429/503)."""
+        retries = self.telemetry_max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            resp = requests.post(url, **kwargs)
+            if resp.status_code not in (429, 503) or attempt == retries:
+                return resp
+            try:
+                delay = float(resp.headers.get("Retry-After", "1"))
+            except ValueError:
+                delay = 1.0
+            # Jitter so workers shed at the same moment don't return in lockstep
+            delay = min(delay * (attempt + 1), self.telemetry_max_backoff) * random.uniform(1.0, 1.5)
+            print(f"Ingest busy ({resp.status_code}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        return resp
 
     def _send_heartbeat(self, status, msg=""):
         try:
             url = f"{self.api_endpoint}/cameras/{self.camera_id}/heartbeat"
-            requests.post(url, json={"status": status, "message": msg}, timeout=2)
+            # A shed heartbeat is superseded by the next one, so don't retry it
+            self._post_with_backoff(url, retries=0, json={"status": status, "message": msg}, timeout=2)
         except:
             pass
 